@@ -1,90 +1,112 @@
 import asyncio
 import logging
 import logging.config
-import os
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties # Для DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage # <--- Добавляем импорт MemoryStorage
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from app.config import BOT_TOKEN, POSTING_INTERVAL_MINUTES, TELEGRAM_CHANNEL_ID, LOG_LEVEL, LOG_FILE, POSTED_LINKS_FILE
+from app.config import Settings, get_settings
 from app.handlers import user_commands # Пока что user_commands будет пустым или с базовым хендлером
 # import app.handlers.scheduled_tasks as scheduled_tasks # Раскомментировать, если будут задачи по расписанию
-from app.scheduler import scheduled_post_job # Импортируем нашу задачу
+from app.scheduler import register_coordination_job, scheduled_post_job # Импортируем нашу задачу
 from app.services import telegram_service
 from app.services.ai_service import close_httpx_client # Для закрытия клиента
-from app.utils.common import load_posted_links, save_posted_link # Для инициализации файла ссылок
-
-# Настройка логирования
-log_config = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'formatters': {
-        'detailed': {
-            'format': '%(asctime)s - %(name)s - %(levelname)s - %(module)s:%(lineno)d - %(message)s'
+from app.services.coordination import get_coordinator
+from app.services.http_fetcher import close_http_fetcher
+from app.services.runtime_state import track_scheduler_jobs
+from app.services.rss_service import shutdown_feed_parse_pool
+from app.utils.metrics import start_metrics_server
+
+logger = logging.getLogger(__name__) # Логгер для этого модуля (bot.py)
+
+def setup_logging(settings: Settings) -> None:
+    """Настраивает логирование. Вызывается из main(), а не при импорте модуля."""
+    log_level = settings.log_level
+    log_config = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'filters': {
+            'trace_id': {'()': 'app.utils.tracing.TraceIdFilter'} # trace_id текущей новости в каждой записи
         },
-        'simple': {
-            'format': '%(asctime)s - %(levelname)s - %(message)s'
-        }
-    },
-    'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'simple',
-            'level': LOG_LEVEL,
-            'stream': 'ext://sys.stdout'  # Explicitly set stream
-        }
-    },
-    'root': {
-        'handlers': ['console'],
-        'level': 'INFO', # Общий уровень для root логгера
-    },
-    'loggers': {
-        'app': { # Логгер для нашего приложения
-            'handlers': ['console'],
-            'level': LOG_LEVEL,
-            'propagate': False, # Не передавать сообщения от 'app' в root логгер, если есть свой хендлер
+        'formatters': {
+            'detailed': {
+                'format': '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(module)s:%(lineno)d - %(message)s'
+            },
+            'simple': {
+                'format': '%(asctime)s - %(levelname)s - %(message)s'
+            }
         },
-        'aiogram': {
-            'handlers': ['console'],
-            'level': 'INFO', # Можно поставить WARNING для уменьшения спама от aiogram
-            'propagate': False,
+        'handlers': {
+            'console': {
+                'class': 'logging.StreamHandler',
+                'formatter': 'simple',
+                'filters': ['trace_id'],
+                'level': log_level,
+                'stream': 'ext://sys.stdout'  # Explicitly set stream
+            },
+            'recent_errors': { # Последние ошибки для /status
+                'class': 'app.services.runtime_state.RecentErrorsHandler',
+                'level': 'ERROR',
+            }
         },
-        'apscheduler': {
+        'root': {
             'handlers': ['console'],
-            'level': 'INFO', # или WARNING
-            'propagate': False,
+            'level': 'INFO', # Общий уровень для root логгера
+        },
+        'loggers': {
+            'app': { # Логгер для нашего приложения
+                'handlers': ['console', 'recent_errors'],
+                'level': log_level,
+                'propagate': False, # Не передавать сообщения от 'app' в root логгер, если есть свой хендлер
+            },
+            'aiogram': {
+                'handlers': ['console'],
+                'level': 'INFO', # Можно поставить WARNING для уменьшения спама от aiogram
+                'propagate': False,
+            },
+            'apscheduler': {
+                'handlers': ['console'],
+                'level': 'INFO', # или WARNING
+                'propagate': False,
+            }
         }
     }
-}
-
-if LOG_FILE:
-    log_config['handlers']['file'] = {
-        'class': 'logging.handlers.RotatingFileHandler',
-        'formatter': 'detailed',
-        'filename': LOG_FILE,
-        'maxBytes': 1024 * 1024 * 5,  # 5 MB
-        'backupCount': 3,
-        'level': LOG_LEVEL,
-        'encoding': 'utf-8'  # Add UTF-8 encoding for file handler
-    }
-    log_config['root']['handlers'].append('file')
-    if 'app' in log_config['loggers']:
-        log_config['loggers']['app']['handlers'].append('file')
-    if 'aiogram' in log_config['loggers']:
-        log_config['loggers']['aiogram']['handlers'].append('file')
-    if 'apscheduler' in log_config['loggers']:
-        log_config['loggers']['apscheduler']['handlers'].append('file')
-
-logging.config.dictConfig(log_config)
-logger = logging.getLogger(__name__) # Логгер для этого модуля (bot.py)
 
-# Убедимся, что файл для хранения ссылок существует
-if not os.path.exists(POSTED_LINKS_FILE):
-    save_posted_link(POSTED_LINKS_FILE, "# This file stores links to already posted news to avoid duplicates.")
-    logger.info(f"Создан файл для хранения опубликованных ссылок: {POSTED_LINKS_FILE}")
+    if settings.log_file:
+        log_config['handlers']['file'] = {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'formatter': 'detailed',
+            'filters': ['trace_id'],
+            'filename': settings.log_file,
+            'maxBytes': 1024 * 1024 * 5,  # 5 MB
+            'backupCount': 3,
+            'level': log_level,
+            'encoding': 'utf-8'  # Add UTF-8 encoding for file handler
+        }
+        log_config['root']['handlers'].append('file')
+        if 'app' in log_config['loggers']:
+            log_config['loggers']['app']['handlers'].append('file')
+        if 'aiogram' in log_config['loggers']:
+            log_config['loggers']['aiogram']['handlers'].append('file')
+        if 'apscheduler' in log_config['loggers']:
+            log_config['loggers']['apscheduler']['handlers'].append('file')
+
+    logging.config.dictConfig(log_config)
+
+def create_bot(settings: Settings) -> Bot:
+    """Создает Bot; при заданном TELEGRAM_API_BASE запросы идут на этот сервер Bot API."""
+    # Исправляем DeprecationWarning
+    # Вместо parse_mode в конструкторе Bot, используем DefaultBotProperties
+    default_bot_properties = DefaultBotProperties(parse_mode=ParseMode.HTML.value) # Используем HTML по умолчанию
+    session = None
+    if settings.telegram_api_base:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_base))
+    return Bot(token=settings.bot_token, session=session, default=default_bot_properties)
 
 async def on_startup(bot: Bot, scheduler: AsyncIOScheduler):
     logger.info("Бот запускается...")
@@ -102,9 +124,14 @@ async def on_startup(bot: Bot, scheduler: AsyncIOScheduler):
             elif scheduler.running:
                  logger.info("APScheduler уже был запущен (возможно, ошибка была из-за этого).")
 
-    if POSTING_INTERVAL_MINUTES > 0:
+    track_scheduler_jobs(scheduler) # Следующие запуски и итоги задач для /status
+    if register_coordination_job(scheduler, bot):
+        logger.info(f"Режим нескольких экземпляров: узел {get_coordinator().node_id}.")
+
+    posting_interval_minutes = get_settings().posting_interval_minutes
+    if posting_interval_minutes > 0:
         logger.info(
-            f"Интервал автопостинга настроен на {POSTING_INTERVAL_MINUTES} минут. "
+            f"Интервал автопостинга настроен на {posting_interval_minutes} минут. "
             f"Используйте /start_autopost для активации."
         )
     else:
@@ -120,22 +147,65 @@ async def on_shutdown(bot: Bot, scheduler: AsyncIOScheduler):
     if scheduler.running:
         scheduler.shutdown(wait=False) # wait=False чтобы не блокировать завершение, если есть активные задачи
         logger.info("APScheduler остановлен.")
+    coordinator = get_coordinator()
+    if coordinator is not None:
+        coordinator.release_lease() # Другой экземпляр станет публикатором, не дожидаясь истечения аренды
+    shutdown_feed_parse_pool()
+    await close_http_fetcher() # Общая сессия загрузки лент и статей
     await close_httpx_client() # Закрываем HTTP клиент
     logger.info("Бот успешно остановлен.")
 
+async def run_polling(dp: Dispatcher, bot: Bot, scheduler: AsyncIOScheduler) -> None:
+    """Long polling: бот сам запрашивает обновления у Telegram."""
+    # Если ранее был включен режим вебхука, getUpdates не работает, пока вебхук не удален
+    await bot.delete_webhook(drop_pending_updates=False)
+    logger.info("Starting bot polling...")
+    # Передаем данные в on_startup/on_shutdown через аргументы polling
+    await dp.start_polling(bot, scheduler=scheduler)
+
+async def run_webhook(dp: Dispatcher, bot: Bot, scheduler: AsyncIOScheduler, settings: Settings) -> None:
+    """Режим вебхука: Telegram сам присылает обновления на WEBHOOK_URL + WEBHOOK_PATH.
+
+    Без пустых циклов long polling; за публичным адресом должен стоять HTTPS (например, reverse proxy),
+    который проксирует запросы на WEBHOOK_HOST:WEBHOOK_PORT.
+    """
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    webhook_url = settings.webhook_url.rstrip('/') + settings.webhook_path
+
+    async def set_webhook(bot: Bot):
+        await bot.set_webhook(url=webhook_url, secret_token=settings.webhook_secret)
+        logger.info(f"Вебхук установлен: {webhook_url}")
+
+    dp.startup.register(set_webhook)
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=settings.webhook_secret).register(app, path=settings.webhook_path)
+    setup_application(app, dp, bot=bot, scheduler=scheduler) # on_startup/on_shutdown вызываются вместе с aiohttp приложением
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, settings.webhook_host, settings.webhook_port).start()
+        logger.info(f"Сервер вебхука слушает {settings.webhook_host}:{settings.webhook_port}{settings.webhook_path}")
+        await asyncio.Event().wait() # Работаем до отмены (Ctrl+C)
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
 async def main():
-    if not BOT_TOKEN:
-        logger.critical("Токен бота (BOT_TOKEN) не найден в переменных окружения. Завершение работы.")
+    try:
+        settings = get_settings()
+    except ValueError as e:
+        logging.basicConfig(level=logging.INFO)
+        logger.critical(f"Ошибка конфигурации: {e}. Завершение работы.")
         return
+    setup_logging(settings)
 
-    # Исправляем DeprecationWarning
-    # Вместо parse_mode в конструкторе Bot, используем DefaultBotProperties
-    default_bot_properties = DefaultBotProperties(parse_mode=ParseMode.HTML.value) # Используем HTML по умолчанию
-    bot = Bot(token=BOT_TOKEN, default=default_bot_properties)
+    bot = create_bot(settings)
     
     storage = MemoryStorage() # <--- Инициализируем MemoryStorage
     dp = Dispatcher(storage=storage) # <--- Передаем storage в Dispatcher
-    scheduler = AsyncIOScheduler(timezone="Europe/Moscow") # Пример указания таймзоны
+    scheduler = AsyncIOScheduler(timezone=settings.bot_timezone)
 
     # Передаем scheduler и bot в хендлеры через workflow_data
     # Это позволит получить к ним доступ в хендлерах через аргументы функции
@@ -148,15 +218,25 @@ async def main():
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
     
-    logger.info("Starting bot polling...")
+    metrics_runner = None
+    if settings.metrics_port > 0:
+        try:
+            metrics_runner = await start_metrics_server(settings.metrics_port, settings.metrics_host)
+        except OSError as e:
+            logger.error(f"Не удалось запустить сервер метрик на порту {settings.metrics_port}: {e}")
+
     try:
-        # Передаем данные в on_startup/on_shutdown через аргументы polling
-        await dp.start_polling(bot, scheduler=scheduler) 
+        if settings.webhook_url:
+            await run_webhook(dp, bot, scheduler, settings)
+        else:
+            await run_polling(dp, bot, scheduler)
     finally:
         # Этот блок выполнится при завершении dp.start_polling (например, по Ctrl+C)
         # on_shutdown уже вызовется через dp.shutdown.register
         # Дополнительно можно убедиться, что http клиент закрыт, если это не произошло в on_shutdown
         # await close_httpx_client() # Это уже есть в on_shutdown
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         logger.info("Polling завершен.")
 
 if __name__ == '__main__':
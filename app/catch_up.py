@@ -0,0 +1,405 @@
+"""Догоняющий режим публикации после простоя.
+
+Обычно публикатор (publish_job) берет из очереди одну лучшую новость за запуск,
+поэтому после долгого простоя (бот был выключен, упал, задачи автопостинга
+были сняты) большая часть пропущенных новостей так и не попала бы в каналы, а
+пытаться опубликовать их все разом - значит выдать в канал пачку постов.
+
+Время каждого запуска публикатора хранится в CATCHUP_STATE_FILE. Если с
+прошлого запуска прошло больше CATCHUP_AFTER_MINUTES, следующий запуск
+публикатора вместо одной новости запускает догоняющий режим:
+
+1. Ленты всех каналов загружаются целиком (без условного GET), и все записи,
+   опубликованные с прошлого запуска (не старше QUEUE_MAX_AGE_HOURS), проходят
+   фильтр релевантности и попадают в очередь кандидатов. Очередь ранжирует их
+   и отбрасывает дубли: уже опубликованные ссылки, повторы заголовков и записи
+   уже известных сюжетов.
+2. CATCHUP_MAX_POSTS лучших новостей публикуются обычным конвейером, до
+   CATCHUP_CONCURRENCY одновременно (загрузка статьи и LLM идут параллельно),
+   но в каждый канал не чаще раза в CATCHUP_POST_INTERVAL_MINUTES.
+3. Следующие CATCHUP_DIGEST_SIZE новостей уходят одной сводкой со ссылками,
+   собранной без LLM (режим "auto"; в режиме "digest" сводка - единственный пост,
+   в режиме "posts" сводки нет).
+
+Остальные новости остаются в очереди и публикуются обычным порядком. Ход
+выполнения и итог присылаются администратору (ADMIN_ID) одним обновляемым
+сообщением.
+
+Запуск вручную из корня проекта (публикует по-настоящему, настройки - те же .env):
+
+    python -m app.catch_up --hours 12
+    python -m app.catch_up --hours 6 --mode digest
+
+Без --hours период начинается с отмеченного простоя, а если его нет - за
+QUEUE_MAX_AGE_HOURS. Администратор может сделать то же командой
+/catch_up [часы] [auto|posts|digest].
+"""
+import argparse
+import asyncio
+import html
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from aiogram import Bot
+
+from app.config import get_settings
+from app.services import rss_service, telegram_service
+from app.services.channels import Channel, get_channel_registry
+from app.services.coordination import get_coordinator
+from app.services.llm_usage import get_token_ledger
+from app.services.runtime_state import get_runtime_state
+from app.services.story_clustering import get_story_clusterer
+from app.services.telegram_sender import get_telegram_sender
+from app.scheduler import (
+    PostThrottle, enqueue_candidates, get_candidate_queue, in_quiet_hours, is_relevant_news,
+    process_and_post_news, throttled_posting,
+)
+from app.utils.dates import normalize_entry_date
+from app.utils.metrics import DEDUPE_HITS, POSTS
+
+logger = logging.getLogger(__name__)
+
+# Сводка - одно текстовое сообщение Telegram; в режиме "auto" сводка из одной новости не отправляется
+DIGEST_MAX_CHARS = 4096
+DIGEST_MIN_ITEMS = 2
+
+
+class CatchUpState:
+    """Время последнего запуска публикатора и начало пропущенного периода (переживают перезапуск)."""
+
+    def __init__(self, state_file: Optional[str], after_seconds: float):
+        self.state_file = state_file
+        self.after_seconds = after_seconds
+        self.last_run: Optional[float] = None
+        # Начало простоя, который еще не отработан догоняющим режимом
+        self.pending_since: Optional[float] = None
+        self._load()
+
+    def record_run(self, now: Optional[float] = None) -> None:
+        """Отмечает запуск публикатора; после долгого перерыва запоминает начало простоя."""
+        now = time.time() if now is None else now
+        gap = now - self.last_run if self.last_run is not None else 0.0
+        if self.after_seconds > 0 and self.pending_since is None and gap > self.after_seconds:
+            self.pending_since = self.last_run
+            logger.warning(f"Публикатор не запускался {gap / 60:.0f} мин: пропущенные новости будут опубликованы в догоняющем режиме.")
+        self.last_run = now
+        self.save()
+
+    def clear_pending(self) -> None:
+        self.pending_since = None
+        self.save()
+
+    def save(self) -> None:
+        if not self.state_file:
+            return
+        try:
+            with open(self.state_file, "w", encoding="utf-8") as f:
+                json.dump({"last_run": self.last_run, "pending_since": self.pending_since}, f)
+        except OSError as e:
+            logger.error(f"Ошибка при сохранении состояния публикатора в {self.state_file}: {e}")
+
+    def _load(self) -> None:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            self.last_run = raw.get("last_run")
+            self.pending_since = raw.get("pending_since")
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке состояния публикатора из {self.state_file}: {e}")
+
+
+_catch_up_state: Optional[CatchUpState] = None
+
+
+def get_catch_up_state() -> CatchUpState:
+    global _catch_up_state
+    if _catch_up_state is None:
+        settings = get_settings()
+        _catch_up_state = CatchUpState(settings.catchup_state_file, settings.catchup_after_minutes * 60)
+    return _catch_up_state
+
+
+def _plan(mode: str) -> Tuple[int, int]:
+    """Сколько новостей опубликовать отдельными постами и сколько - сводкой."""
+    settings = get_settings()
+    posts = max(0, settings.catchup_max_posts) if mode in ("auto", "posts") else 0
+    digest = max(0, settings.catchup_digest_size) if mode in ("auto", "digest") else 0
+    return posts, digest
+
+
+def _pop_pending(count: int) -> List[Any]:
+    """Извлекает из очереди до count лучших новостей, которые еще ждут публикации хотя бы в одном канале."""
+    candidate_queue = get_candidate_queue()
+    channel_registry = get_channel_registry()
+    items: List[Any] = []
+    while len(items) < count:
+        entry = candidate_queue.pop_best()
+        if entry is None:
+            break
+        if not channel_registry.pending_channels(entry):
+            DEDUPE_HITS.inc(where="posted")
+            continue
+        items.append(entry)
+    return items
+
+
+def format_digest(items: List[Any], since: datetime) -> Tuple[str, List[Any]]:
+    """HTML сводки со ссылками на новости и новости, которые в нее поместились."""
+    hours = max(1, round((datetime.now(timezone.utc) - since).total_seconds() / 3600))
+    text = f"<b>🗞 Главное за последние {hours} ч</b>\n"
+    included = []
+    for item in items:
+        title = html.escape(item.get('title') or item['link'])
+        line = f"\n• <a href=\"{html.escape(item['link'], quote=True)}\">{title}</a>"
+        host = urlparse(item.get('feed_source_url') or item['link']).netloc
+        if host:
+            line += f" <i>({html.escape(host)})</i>"
+        if len(text) + len(line) > DIGEST_MAX_CHARS:
+            break
+        text += line
+        included.append(item)
+    return text, included
+
+
+async def _post_digest(bot: Bot, channel: Channel, items: List[Any], since: datetime, throttle: PostThrottle) -> List[Any]:
+    """Публикует сводку в канал; возвращает опубликованные в ней новости."""
+    coordinator = get_coordinator()
+    # Захват каждой ссылки: другой экземпляр бота не опубликует эти новости в канал отдельно
+    claimed = [item for item in items if not coordinator or coordinator.claim(channel.name, item['link'])]
+    if len(claimed) < len(items):
+        DEDUPE_HITS.inc(len(items) - len(claimed), where="claim")
+    text, included = format_digest(claimed, since)
+    if coordinator:
+        for item in claimed[len(included):]:
+            coordinator.release_claim(channel.name, item['link'])
+    if not included:
+        return []
+
+    await throttle.wait(channel.name)
+    logger.info(f"Публикую сводку из {len(included)} новостей в канал {channel.name}...")
+    success = await telegram_service.post_to_channel(bot=bot, text=text, chat_id=channel.chat_id)
+    if not success:
+        logger.error(f"Не удалось опубликовать сводку в канале {channel.name}.")
+        if coordinator:
+            for item in included:
+                coordinator.release_claim(channel.name, item['link'])
+        return []
+
+    channel_registry = get_channel_registry()
+    clusterer = get_story_clusterer()
+    for item in included:
+        channel_registry.mark_posted(channel, item['link'])
+        story = clusterer.story_for(item['link']) if clusterer is not None else None
+        if story:
+            story.posted = True
+            for member in story.members:
+                if member.get('link'):
+                    channel_registry.mark_posted(channel, member['link'])
+    POSTS.inc(channel=channel.name)
+    get_runtime_state().record_post(channel.name, f"Сводка: {len(included)} новостей")
+    return included
+
+
+async def run_catch_up(
+    bot: Bot,
+    since: Optional[float] = None,
+    mode: Optional[str] = None,
+    progress: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> Dict[str, Any]:
+    """Публикует новости, пропущенные с момента since, и возвращает отчет.
+
+    Args:
+        since: Начало пропущенного периода (timestamp); по умолчанию - начало
+            отмеченного простоя, а без него - QUEUE_MAX_AGE_HOURS назад (раньше
+            этого момента период не начинается в любом случае).
+        mode: "auto", "posts" или "digest"; по умолчанию CATCHUP_MODE.
+        progress: Необязательный колбэк для сообщений о ходе выполнения (например, администратору).
+    """
+    async def report_progress(text: str) -> None:
+        if progress is not None:
+            await progress(text)
+
+    settings = get_settings()
+    mode = mode or settings.catchup_mode
+    start = time.time()
+    oldest = start - settings.queue_max_age_hours * 3600
+    # Не last_run: публикатор обновляет его каждый запуск, и ручной прогон без простоя охватил бы полчаса
+    since = max(since or get_catch_up_state().pending_since or oldest, oldest)
+    since_dt = datetime.fromtimestamp(since, timezone.utc)
+    candidate_queue = get_candidate_queue()
+    channel_registry = get_channel_registry()
+
+    logger.info(f"Догоняющий режим ({mode}): новости с {since_dt.isoformat()}...")
+    await report_progress(f"Догоняющий режим: загрузка лент за {(start - since) / 3600:.1f} ч... ⏳")
+    # Ленты загружаются целиком: условный GET вернул бы только записи, появившиеся с последнего опроса
+    entries = await rss_service.fetch_feed_entries(feeds=channel_registry.feeds(), conditional=False)
+    in_window = []
+    for entry in entries:
+        published = normalize_entry_date(entry)
+        if published and published.timestamp() >= since:
+            in_window.append(entry)
+    relevant = [entry for entry in in_window if is_relevant_news(entry)]
+    added = enqueue_candidates(relevant)
+    logger.info(
+        f"Догоняющий режим: записей в лентах {len(entries)}, за период {len(in_window)}, релевантных {len(relevant)}, "
+        f"добавлено в очередь {added}, в очереди {len(candidate_queue)}."
+    )
+
+    max_posts, digest_size = _plan(mode)
+    throttle = PostThrottle(settings.catchup_post_interval_minutes * 60)
+    posts = _pop_pending(max_posts)
+    published = failed = 0
+    deferred: List[Any] = []
+    await report_progress(f"Новостей за период: {len(in_window)}, в очереди: {len(candidate_queue) + len(posts)}. Публикую {len(posts)}... ⏳")
+
+    semaphore = asyncio.Semaphore(max(1, settings.catchup_concurrency))
+
+    async def publish(entry: Any) -> None:
+        nonlocal published, failed
+        async with semaphore:
+            # Бюджет или тихие часы могли наступить по ходу: оставшиеся новости ждут в очереди
+            if get_token_ledger().exhausted() or in_quiet_hours():
+                deferred.append(entry)
+                return
+            try:
+                ok = await process_and_post_news(bot, entry)
+            except Exception as e:
+                logger.error(f"Догоняющий режим: ошибка при обработке \"{entry.get('title', 'N/A')}\": {e}", exc_info=True)
+                ok = False
+            if ok:
+                published += 1
+            else:
+                failed += 1
+            await report_progress(f"Опубликовано {published} из {len(posts)}...")
+
+    with throttled_posting(throttle):
+        await asyncio.gather(*(publish(entry) for entry in posts))
+    for entry in deferred:
+        candidate_queue.push(entry)
+
+    digest_items: List[Any] = []
+    digest_links: set = set()
+    digest_channels = 0
+    digest_pool = _pop_pending(digest_size) if not deferred else []
+    if digest_pool and (mode == "digest" or len(digest_pool) >= DIGEST_MIN_ITEMS):
+        await report_progress(f"Опубликовано {published} из {len(posts)}. Публикую сводку из {len(digest_pool)} новостей... ⏳")
+        by_channel: Dict[str, Tuple[Channel, List[Any]]] = {}
+        for item in digest_pool:
+            for channel in channel_registry.pending_channels(item):
+                by_channel.setdefault(channel.name, (channel, []))[1].append(item)
+        for channel, items in by_channel.values():
+            included = await _post_digest(bot, channel, items, since_dt, throttle)
+            if included:
+                digest_channels += 1
+                digest_links.update(item['link'] for item in included)
+        digest_items = [item for item in digest_pool if item['link'] in digest_links]
+    # Не попавшие в сводку новости возвращаются в очередь
+    for item in digest_pool:
+        if item['link'] not in digest_links:
+            candidate_queue.push(item)
+
+    report = {
+        "since": since_dt.isoformat(),
+        "mode": mode,
+        "fetched": len(entries),
+        "in_window": len(in_window),
+        "relevant": len(relevant),
+        "added": added,
+        "published": published,
+        "failed": failed,
+        "deferred": len(deferred),
+        "digest_items": len(digest_items),
+        "digest_channels": digest_channels,
+        "queue_left": len(candidate_queue),
+        "duration_s": round(time.time() - start, 1),
+    }
+    logger.info(f"Догоняющий режим завершен: {report}")
+    await report_progress(format_report(report))
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Итог догоняющего режима для администратора и консоли."""
+    lines = [
+        f"Догоняющий режим ({report['mode']}) завершен за {report['duration_s']:.0f} с.",
+        f"Период: с {report['since']}.",
+        f"Записей в лентах: {report['fetched']}, за период: {report['in_window']}, "
+        f"релевантных: {report['relevant']}, новых в очереди: {report['added']}.",
+        f"Опубликовано постов: {report['published']}, не удалось: {report['failed']}.",
+    ]
+    if report["digest_items"]:
+        lines.append(f"Сводка: {report['digest_items']} новостей в {report['digest_channels']} канал(ах).")
+    if report["deferred"]:
+        lines.append(f"Отложено (бюджет LLM или тихие часы): {report['deferred']}.")
+    lines.append(f"Осталось в очереди: {report['queue_left']}.")
+    return "\n".join(lines)
+
+
+async def run_catch_up_for_admin(
+    bot: Bot,
+    since: Optional[float] = None,
+    mode: Optional[str] = None,
+    chat_id: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    """Запускает догоняющий режим с отчетом в чат chat_id (по умолчанию ADMIN_ID).
+
+    Отмеченный простой считается отработанным и при ошибке: иначе публикатор
+    повторял бы неудачный догоняющий запуск вместо обычной публикации.
+    """
+    state = get_catch_up_state()
+    chat_id = chat_id or get_settings().admin_id
+    since = since or state.pending_since
+    sender = get_telegram_sender()
+    progress_key = f"catch_up:{int(time.time())}"
+
+    async def progress(text: str) -> None:
+        if chat_id:
+            await sender.send_progress(bot, chat_id, progress_key, text)
+
+    try:
+        return await run_catch_up(bot, since=since, mode=mode, progress=progress)
+    except Exception as e:
+        logger.error(f"Ошибка догоняющего режима: {e}", exc_info=True)
+        await progress(f"Ошибка догоняющего режима: {e}")
+        return None
+    finally:
+        state.clear_pending()
+        if chat_id:
+            sender.finish_progress(chat_id, progress_key)
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from app.bot import create_bot
+    from app.services.ai_service import close_httpx_client
+    from app.services.http_fetcher import close_http_fetcher
+
+    bot = create_bot(get_settings())
+    since = time.time() - args.hours * 3600 if args.hours else None
+    try:
+        report = await run_catch_up(bot, since=since, mode=args.mode)
+    finally:
+        await bot.session.close()
+        await close_http_fetcher()
+        await close_httpx_client()
+    print(format_report(report))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Публикация новостей, пропущенных за время простоя")
+    parser.add_argument("--hours", type=float, default=None, help="За сколько последних часов (по умолчанию - с начала простоя, а без него - QUEUE_MAX_AGE_HOURS)")
+    parser.add_argument("--mode", choices=["auto", "posts", "digest"], default=None, help="Режим (по умолчанию CATCHUP_MODE)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Подробные логи конвейера")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
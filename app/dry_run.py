@@ -0,0 +1,309 @@
+"""Теневой прогон конвейера (dry run) по последним новостям без публикации.
+
+Последние N записей из лент всех каналов проходят весь конвейер, как при
+автопостинге: фильтр релевантности, извлечение статьи, генерация текста LLM
+на каждый стиль каналов и выбор изображения. Вместо отправки в Telegram
+пост попадает в отчет, ссылки не отмечаются опубликованными, а картинки
+не генерируются (только изображения из RSS). Так можно проверить изменение
+промпта, модели или параллелизма, не трогая живой канал.
+
+Отчет содержит таблицу времени по этапам (из трасс, см. app.utils.tracing),
+расход токенов LLM, доли попаданий в дешевые уровни (текст статьи без
+загрузки страницы, общий текст для каналов с одним стилем, общая картинка)
+и сгенерированные посты. Он сохраняется в JSON-файл.
+
+Запуск из корня проекта (настройки - те же .env, что у бота):
+
+    python -m app.dry_run 5
+    python -m app.dry_run 20 --concurrency 4 --report dry_run_report.json
+
+Администратор может сделать то же командой /dry_run N.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.config import get_settings
+from app.services import rss_service
+from app.services.channels import get_channel_registry
+from app.scheduler import dry_run_mode, process_and_post_news
+from app.utils import tracing
+from app.utils.metrics import ARTICLE_EXTRACTIONS, LLM_COST, LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPORT_FILE = "dry_run_report.json"
+# Этапы в порядке конвейера; корневой спан - полное время обработки одной новости
+STAGE_ORDER = ("relevance", "article_fetch", "llm_reformat", "image", "process_and_post_news")
+# Уровни извлечения статьи, для которых страница не загружалась
+NO_FETCH_TIERS = ("feed", "prefetched")
+
+
+class _DryRunCollector:
+    """Экспортер трасс на время прогона: запоминает трассы теневого режима и передает все трассы прежнему экспортеру."""
+
+    def __init__(self, previous: Any):
+        self.previous = previous
+        self.spans: List[tracing.Span] = []
+
+    def export(self, spans: List[tracing.Span]) -> None:
+        # Параллельно может работать обычная публикация: ее трассы в отчет не попадают
+        if any(s.parent_id is None and s.attributes.get("dry_run") for s in spans):
+            self.spans.extend(spans)
+        if self.previous is not None:
+            self.previous.export(spans)
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+
+def stage_table(spans: List[tracing.Span]) -> Dict[str, Dict[str, float]]:
+    """Время по этапам (мс): количество, сумма, p50, p95, максимум."""
+    durations: Dict[str, List[float]] = {}
+    for s in spans:
+        durations.setdefault(s.name, []).append(s.duration * 1000)
+    names = [name for name in STAGE_ORDER if name in durations] + sorted(set(durations) - set(STAGE_ORDER))
+    table = {}
+    for name in names:
+        values = sorted(durations[name])
+        table[name] = {
+            "count": len(values),
+            "total_ms": round(sum(values), 1),
+            "p50_ms": round(_percentile(values, 0.5), 1),
+            "p95_ms": round(_percentile(values, 0.95), 1),
+            "max_ms": round(values[-1], 1),
+        }
+    return table
+
+
+def _counter_delta(before: Dict[tuple, float], after: Dict[tuple, float]) -> Dict[tuple, float]:
+    return {key: value - before.get(key, 0.0) for key, value in after.items() if value - before.get(key, 0.0)}
+
+
+def _ratio(part: float, whole: float) -> float:
+    return round(part / whole, 3) if whole else 0.0
+
+
+def _items(spans: List[tracing.Span], posts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Итог по каждой новости: релевантность, уровень извлечения статьи, ошибки и посты."""
+    by_trace: Dict[str, List[tracing.Span]] = {}
+    for s in spans:
+        by_trace.setdefault(s.trace_id, []).append(s)
+    items = []
+    for trace_spans in by_trace.values():
+        root = next((s for s in trace_spans if s.parent_id is None), None)
+        if root is None:
+            continue
+        stages = {s.name: s for s in trace_spans}
+        link = root.attributes.get("link", "")
+        item = {
+            "title": root.attributes.get("title", ""),
+            "link": link,
+            "duration_ms": round(root.duration * 1000, 1),
+            "relevant": stages["relevance"].attributes.get("relevant") if "relevance" in stages else None,
+            "article_tier": stages["article_fetch"].attributes.get("tier") if "article_fetch" in stages else None,
+            "article_chars": stages["article_fetch"].attributes.get("chars") if "article_fetch" in stages else None,
+            "errors": [f"{s.name}: {s.error}" for s in trace_spans if s.error],
+            "posts": [post for post in posts if post["link"] == link],
+        }
+        items.append((root.start, item))
+    return [item for _, item in sorted(items, key=lambda pair: pair[0])]
+
+
+async def run_dry_run(
+    count: int,
+    concurrency: int = 1,
+    report_file: Optional[str] = DEFAULT_REPORT_FILE,
+    progress: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> Dict[str, Any]:
+    """Прогоняет последние count новостей через конвейер без публикации и возвращает отчет.
+
+    Args:
+        concurrency: Сколько новостей обрабатывать одновременно.
+        report_file: Куда сохранить отчет в JSON (None - не сохранять).
+        progress: Необязательный колбэк для сообщений о ходе выполнения (например, администратору).
+    """
+    async def report_progress(text: str) -> None:
+        if progress is not None:
+            await progress(text)
+
+    settings = get_settings()
+    channel_registry = get_channel_registry()
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+
+    await report_progress("Загрузка лент... ⏳")
+    # Ленты загружаются целиком (без условного GET): нужны последние новости, а не только новые
+    entries = await rss_service.fetch_feed_entries(feeds=channel_registry.feeds(), conditional=False, limit=count)
+    fetch_feeds_ms = (time.perf_counter() - start) * 1000
+    await report_progress(f"Новостей для прогона: {len(entries)}. Обработка... ⏳")
+
+    tokens_before = LLM_TOKENS.snapshot()
+    cost_before = LLM_COST.snapshot()
+    tiers_before = ARTICLE_EXTRACTIONS.snapshot()
+    previous_exporter = tracing.get_exporter()
+    collector = _DryRunCollector(previous_exporter)
+    tracing.set_exporter(collector)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    done = 0
+
+    async def process(entry: Any) -> None:
+        nonlocal done
+        async with semaphore:
+            try:
+                await process_and_post_news(None, entry)
+            except Exception as e:
+                logger.error(f"Теневой прогон: ошибка при обработке \"{entry.get('title', 'N/A')}\": {e}", exc_info=True)
+            done += 1
+            await report_progress(f"Обработано {done} из {len(entries)}...")
+
+    try:
+        with dry_run_mode() as posts:
+            await asyncio.gather(*(process(entry) for entry in entries))
+    finally:
+        tracing.set_exporter(previous_exporter)
+
+    tokens = _counter_delta(tokens_before, LLM_TOKENS.snapshot())
+    cost = sum(_counter_delta(cost_before, LLM_COST.snapshot()).values())
+    tiers = {key[0]: int(value) for key, value in _counter_delta(tiers_before, ARTICLE_EXTRACTIONS.snapshot()).items()}
+    feeds_ms = round(fetch_feeds_ms, 1)
+    stages = {
+        "fetch_feed_entries": {"count": 1, "total_ms": feeds_ms, "p50_ms": feeds_ms, "p95_ms": feeds_ms, "max_ms": feeds_ms},
+        **stage_table(collector.spans),
+    }
+    # Успешные генерации: вызовы, отклоненные бюджетом или с ошибкой, текст не дали
+    generations = sum(1 for s in collector.spans if s.name == "llm_reformat" and s.attributes.get("ok"))
+    images = stages.get("image", {}).get("count", 0)
+    prompt_tokens = int(sum(v for (provider, kind), v in tokens.items() if kind == "prompt"))
+    completion_tokens = int(sum(v for (provider, kind), v in tokens.items() if kind == "completion"))
+    cached_tokens = int(sum(v for (provider, kind), v in tokens.items() if kind == "cached"))
+
+    report = {
+        "started_at": started_at.isoformat(),
+        "duration_s": round(time.perf_counter() - start, 2),
+        "requested": count,
+        "processed": len(entries),
+        "posts": len(posts),
+        "settings": {
+            "ai_provider": settings.ai_provider,
+            "chat_model": settings.llm_cascade_models or (
+                settings.openrouter_chat_model if settings.ai_provider == "openrouter" else settings.openai_chat_model
+            ),
+            "article_min_chars": settings.article_min_chars,
+            "concurrency": concurrency,
+            "channels": [channel.name for channel in channel_registry],
+        },
+        "stages": stages,
+        "tokens": {
+            "prompt": prompt_tokens,
+            "cached": cached_tokens,
+            "completion": completion_tokens,
+            "total": prompt_tokens + completion_tokens,
+            "cost_usd": round(cost, 6),
+            "cost_per_post_usd": round(cost / len(posts), 6) if posts else 0.0,
+        },
+        "cache": {
+            "article_tiers": tiers,
+            # Доля статей, для которых не понадобилась загрузка страницы
+            "article_no_fetch": _ratio(sum(tiers.get(t, 0) for t in NO_FETCH_TIERS), sum(tiers.values())),
+            # Доля постов, получивших уже сгенерированный текст (каналы с одинаковым промптом)
+            "llm_text_reuse": _ratio(len(posts) - generations, len(posts)),
+            # Доля постов, получивших уже выбранную картинку (каналы с одинаковой политикой изображений)
+            "image_reuse": _ratio(len(posts) - images, len(posts)),
+        },
+        "items": _items(collector.spans, posts),
+    }
+    if report_file:
+        try:
+            with open(report_file, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+            logger.info(f"Отчет теневого прогона сохранен в {report_file}")
+        except OSError as e:
+            logger.error(f"Не удалось сохранить отчет теневого прогона в {report_file}: {e}")
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Краткий текстовый отчет: итог, таблица этапов, токены и доли попаданий (моноширинный текст)."""
+    lines = [
+        f"Теневой прогон: {report['processed']} из {report['requested']} новостей за {report['duration_s']} с, "
+        f"постов: {report['posts']} (модель {report['settings']['chat_model']}, "
+        f"параллельно {report['settings']['concurrency']})",
+        "",
+        f"{'этап':<22} {'кол-во':>6} {'всего, мс':>10} {'p50, мс':>9} {'p95, мс':>9} {'макс, мс':>9}",
+    ]
+    for name, stats in report["stages"].items():
+        lines.append(
+            f"{name:<22} {stats['count']:>6} {stats['total_ms']:>10.1f} {stats['p50_ms']:>9.1f} "
+            f"{stats['p95_ms']:>9.1f} {stats['max_ms']:>9.1f}"
+        )
+    tokens = report["tokens"]
+    cache = report["cache"]
+    tiers = ", ".join(f"{tier} {n}" for tier, n in sorted(cache["article_tiers"].items())) or "-"
+    lines += [
+        "",
+        f"Токены LLM: prompt {tokens['prompt']} (из кэша {tokens['cached']}), completion {tokens['completion']}, "
+        f"всего {tokens['total']}; ${tokens['cost_usd']:.4f}, на пост ${tokens['cost_per_post_usd']:.5f}",
+        f"Статьи по уровням: {tiers}; без загрузки страницы {cache['article_no_fetch']:.0%}",
+        f"Повторное использование: текст LLM {cache['llm_text_reuse']:.0%}, картинки {cache['image_reuse']:.0%}",
+    ]
+    skipped = [item for item in report["items"] if not item["posts"]]
+    if skipped:
+        lines.append(f"Без поста: {len(skipped)} (нерелевантные: {sum(1 for i in skipped if i['relevant'] is False)})")
+    return "\n".join(lines)
+
+
+def format_posts(report: Dict[str, Any]) -> str:
+    """Сгенерированные посты по новостям (для вывода в консоль)."""
+    blocks = []
+    for item in report["items"]:
+        header = f"=== {item['title']} ({item['link']})"
+        if not item["posts"]:
+            reason = "нерелевантна" if item["relevant"] is False else "; ".join(item["errors"]) or "пост не получен"
+            blocks.append(f"{header}\n[без поста: {reason}]")
+            continue
+        for post in item["posts"]:
+            image = f"\n[изображение: {post['image_url']}]" if post["image_url"] else ""
+            blocks.append(f"{header} -> {post['channel']}\n{post['text']}{image}")
+    return "\n\n".join(blocks)
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from app.services.ai_service import close_httpx_client
+    from app.services.http_fetcher import close_http_fetcher
+
+    try:
+        report = await run_dry_run(args.count, concurrency=args.concurrency, report_file=args.report or None)
+    finally:
+        await close_http_fetcher()
+        await close_httpx_client()
+    if args.posts:
+        print(format_posts(report))
+        print()
+    print(format_report(report))
+    if args.report:
+        print(f"\nОтчет: {args.report}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Теневой прогон конвейера по последним новостям без публикации")
+    parser.add_argument("count", type=int, nargs="?", default=5, help="Сколько последних новостей прогнать")
+    parser.add_argument("--concurrency", type=int, default=1, help="Сколько новостей обрабатывать одновременно")
+    parser.add_argument("--report", default=DEFAULT_REPORT_FILE, help="Файл отчета JSON (пусто - не сохранять)")
+    parser.add_argument("--no-posts", dest="posts", action="store_false", help="Не печатать сгенерированные посты")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Подробные логи конвейера")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
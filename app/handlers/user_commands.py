@@ -1,13 +1,15 @@
 import logging
 import html # для экранирования HTML символов в данных от пользователя, если нужно
 import os # Добавлен os для работы с файлами
+import time
 from datetime import datetime # Добавлена datetime для форматирования времени
+from typing import Optional
 # import re # Больше не нужен здесь, функция экранирования перенесена
 import markdown # <--- Added import for the markdown library
 
 from aiogram import Router, Bot, F
-from aiogram.filters import CommandStart, Command, StateFilter
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ContentType
+from aiogram.filters import CommandStart, Command, CommandObject, StateFilter
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ContentType, FSInputFile
 from aiogram.enums import ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -18,14 +20,23 @@ from aiogram.utils.formatting import Text # <--- Corrected import, Text might be
 from apscheduler.schedulers.asyncio import AsyncIOScheduler # Для аннотации типа scheduler
 
 from app.services import rss_service, ai_service, telegram_service
-from app.config import (
-    OPENAI_IMAGE_MODEL, ADMIN_ID, 
-    RSS_FEED_URL, POSTING_INTERVAL_MINUTES, POSTED_LINKS_FILE,
-    IMAGE_GENERATION_ENABLED, IMAGE_SOURCE_PRIORITY, # Добавлены для использования в post_latest_news
-    TELEGRAM_CHANNEL_ID, AI_PROVIDER, OPENROUTER_CHAT_MODEL # Добавлены для cmd_status
+from app.services.channels import get_channel_registry
+from app.services.coordination import AUTOPOST_FLAG, get_coordinator
+from app.services.feed_content import entry_content
+from app.services.llm_usage import get_token_ledger
+from app.services.relevance_service import get_relevance_classifier
+from app.services.runtime_state import get_runtime_state
+from app.services.telegram_sender import get_telegram_sender
+from app.catch_up import run_catch_up_for_admin
+from app.config import VALID_CATCHUP_MODES, get_settings
+from app.dry_run import DEFAULT_REPORT_FILE, format_report, run_dry_run
+from app.scheduler import (
+    autopost_intervals, scheduled_post_job, register_autopost_jobs, remove_autopost_jobs, get_candidate_queue, PUBLISH_JOB_ID
 )
 from app.utils.image_utils import get_final_image_url # <--- Импортируем новую функцию
-from app.utils.common import load_posted_links, markdown_v2_escape, save_posted_link # Используем функции из common.py
+from app.utils.common import markdown_v2_escape # Используем функции из common.py
+from app.utils.metrics import ARTICLE_EXTRACTIONS, DEDUPE_HITS, RECENT_LATENCY
+from app.utils.tracing import current_trace_id, span, start_trace
 
 logger = logging.getLogger(__name__)
 router = Router() # Создаем экземпляр Router
@@ -51,11 +62,16 @@ admin_keyboard = ReplyKeyboardMarkup(
     one_time_keyboard=False
 )
 
+def is_admin(user_id: int) -> bool:
+    """Проверяет, что команду отправил администратор бота (ADMIN_ID)."""
+    admin_id = get_settings().admin_id
+    return bool(admin_id) and user_id == admin_id
+
 @router.message(CommandStart())
 async def cmd_start(message: Message):
     """Обработчик команды /start."""
     user_full_name_safe = markdown_v2_escape(message.from_user.full_name if message.from_user else "Пользователь")
-    if ADMIN_ID and message.from_user.id == ADMIN_ID:
+    if is_admin(message.from_user.id):
         text_part1 = markdown_v2_escape(f"Привет, {user_full_name_safe}! Я бот для постинга AI новостей.")
         text_part2 = markdown_v2_escape("Вы администратор. Используйте клавиатуру для управления.")
         full_text = f"{text_part1}\n{text_part2}"
@@ -89,11 +105,13 @@ async def cmd_help(message: Message):
         f"`/prepare_post` {markdown_v2_escape('- подготовить новость, показать превью и запросить подтверждение перед постингом.')}\n"
         f"`/start_autopost` {markdown_v2_escape('- включить автоматический постинг новостей.')}\n"
         f"`/stop_autopost` {markdown_v2_escape('- выключить автоматический постинг новостей.')}\n"
+        f"`/dry_run N` {markdown_v2_escape('- прогнать последние N новостей через конвейер без публикации и прислать отчет.')}\n"
+        f"`/catch_up [часы] [auto|posts|digest]` {markdown_v2_escape('- опубликовать новости, пропущенные за время простоя (без часов - с начала отмеченного простоя, а если его нет - за QUEUE_MAX_AGE_HOURS): лучшие отдельными постами с интервалом, остальные сводкой.')}\n"
         f"`/show_logs` {markdown_v2_escape('- показать последние логи (TODO).')}"
     )
 
     full_help_text = help_text_user
-    if ADMIN_ID and message.from_user.id == ADMIN_ID:
+    if is_admin(message.from_user.id):
         full_help_text += help_text_admin
 
     await message.reply(full_help_text, parse_mode=ParseMode.MARKDOWN_V2.value)
@@ -102,107 +120,273 @@ async def cmd_help(message: Message):
 async def cmd_check_rss(message: Message):
     """Обработчик команды /check_rss для проверки доступности RSS и количества новостей."""
     logger.info(f"Пользователь {message.from_user.id} вызвал /check_rss")
-    if message.from_user.id != ADMIN_ID:
+    if not is_admin(message.from_user.id):
         await message.reply("Эта команда доступна только администратору.")
         return
 
-    if not RSS_FEED_URL:
-        await message.reply("URL RSS-ленты не настроен в .env файле.")
+    # Ленты всех каналов (RSS_FEED_URL и feeds.txt входят в ленты канала по умолчанию)
+    feeds = get_channel_registry().feeds()
+    if not feeds:
+        await message.reply("RSS-ленты не настроены (feeds.txt, RSS_FEED_URL или ленты каналов).")
         return
 
-    await message.reply("Проверка RSS-ленты... ⏳")
+    await message.reply(f"Проверка RSS-лент ({len(feeds)})... ⏳")
     try:
-        # Используем существующий сервис для получения записей
-        # feed_items = await rss_service.fetch_rss_feed(RSS_FEED_URL) # Получаем все новости из ленты
-        feed_items = await rss_service.fetch_feed_entries() # Используем исправленную функцию
+        feed_items = await rss_service.fetch_feed_entries(feeds=feeds, conditional=False) # Ленты целиком: проверяется наличие записей
         if feed_items:
-            await message.reply(f"✅ RSS-лента доступна ({RSS_FEED_URL}). Найдено новостей: {len(feed_items)}")
+            await message.reply(f"✅ RSS-ленты доступны ({len(feeds)}). Найдено новостей: {len(feed_items)}")
         else:
-            await message.reply(f"RSS-лента ({RSS_FEED_URL}) доступна, но не содержит новостей или произошла ошибка при парсинге.")
+            await message.reply(f"RSS-ленты ({len(feeds)}) не содержат новостей или произошла ошибка при загрузке и разборе.")
     except Exception as e:
-        logger.error(f"Ошибка при проверке RSS-ленты {RSS_FEED_URL}: {e}", exc_info=True)
+        logger.error(f"Ошибка при проверке RSS-лент: {e}", exc_info=True)
         await message.reply(f"Произошла ошибка при проверке RSS: {e}")
 
 @router.message(Command("post_now"))
 async def cmd_post_now(message: Message, bot: Bot):
     """Обработчик команды /post_now. Принудительно постит последнюю новость."""
-    if not ADMIN_ID or message.from_user.id != ADMIN_ID:
+    if not is_admin(message.from_user.id):
         logger.warning(f"Попытка несанкционированного доступа к /post_now от user_id: {message.from_user.id}")
         return
 
     logger.info(f"Администратор {message.from_user.id} инициировал команду /post_now")
-    await telegram_service.post_latest_news(bot=bot, channel_id=TELEGRAM_CHANNEL_ID, posted_links_file=POSTED_LINKS_FILE)
-    await message.reply(markdown_v2_escape("Попытка немедленного постинга инициирована. Смотрите логи для деталей."), parse_mode=ParseMode.MARKDOWN_V2.value)
+    # Опрашиваем все ленты (не только те, которым пора) и сразу публикуем лучшую новость.
+    # Ход выполнения - одно сообщение администратору, которое обновляется (частые обновления объединяются)
+    sender = get_telegram_sender()
+    chat_id = message.chat.id
+    progress_key = f"post_now:{message.message_id}"
+
+    async def progress(text: str) -> None:
+        await sender.send_progress(bot, chat_id, progress_key, text)
+
+    try:
+        await scheduled_post_job(bot, max_posts=1, only_due=False, progress=progress)
+    finally:
+        sender.finish_progress(chat_id, progress_key)
+
+# Сколько новостей можно прогнать командой /dry_run и сколько постов из отчета показать в чате
+DRY_RUN_MAX_ITEMS = 50
+DRY_RUN_PREVIEW_POSTS = 3
+
+@router.message(Command("dry_run"))
+async def cmd_dry_run(message: Message, command: CommandObject, bot: Bot):
+    """Обработчик команды /dry_run N: теневой прогон последних N новостей без публикации."""
+    if not is_admin(message.from_user.id):
+        logger.warning(f"Попытка несанкционированного доступа к /dry_run от user_id: {message.from_user.id}")
+        return
+
+    try:
+        count = int(command.args) if command.args else 5
+    except ValueError:
+        await message.reply("Использование: /dry_run N (N - число последних новостей).", parse_mode=None)
+        return
+    count = max(1, min(count, DRY_RUN_MAX_ITEMS))
+    logger.info(f"Администратор {message.from_user.id} запустил теневой прогон по {count} новостям")
+
+    sender = get_telegram_sender()
+    chat_id = message.chat.id
+    progress_key = f"dry_run:{message.message_id}"
+
+    async def progress(text: str) -> None:
+        await sender.send_progress(bot, chat_id, progress_key, text)
+
+    try:
+        report = await run_dry_run(count, report_file=DEFAULT_REPORT_FILE, progress=progress)
+    except Exception as e:
+        logger.error(f"Ошибка теневого прогона: {e}", exc_info=True)
+        await message.reply(f"Ошибка теневого прогона: {html.escape(str(e))}", parse_mode=ParseMode.HTML.value)
+        return
+    finally:
+        sender.finish_progress(chat_id, progress_key)
+
+    await message.answer(f"<pre>{html.escape(format_report(report))}</pre>", parse_mode=ParseMode.HTML.value)
+    shown = 0
+    for item in report["items"]:
+        for post in item["posts"]:
+            if shown >= DRY_RUN_PREVIEW_POSTS:
+                break
+            header = f"<i>Канал {html.escape(post['channel'])}, превью без публикации:</i>\n\n"
+            await message.answer(header + post["text"], parse_mode=ParseMode.HTML.value)
+            shown += 1
+    if os.path.exists(DEFAULT_REPORT_FILE):
+        await message.answer_document(FSInputFile(DEFAULT_REPORT_FILE), caption="Полный отчет со всеми постами")
+
+@router.message(Command("catch_up"))
+async def cmd_catch_up(message: Message, command: CommandObject, bot: Bot):
+    """Обработчик команды /catch_up [часы] [режим]: догоняющая публикация пропущенных новостей."""
+    if not is_admin(message.from_user.id):
+        logger.warning(f"Попытка несанкционированного доступа к /catch_up от user_id: {message.from_user.id}")
+        return
+
+    hours: Optional[float] = None
+    mode: Optional[str] = None
+    for arg in (command.args or "").split():
+        if arg.lower() in VALID_CATCHUP_MODES:
+            mode = arg.lower()
+            continue
+        try:
+            hours = float(arg)
+        except ValueError:
+            await message.reply("Использование: /catch_up [часы] [auto|posts|digest].", parse_mode=None)
+            return
+    logger.info(f"Администратор {message.from_user.id} запустил догоняющий режим (часы: {hours or 'с начала простоя или QUEUE_MAX_AGE_HOURS'}, режим: {mode or 'по умолчанию'})")
+    since = time.time() - hours * 3600 if hours else None
+    # Ход выполнения и итог - одно обновляемое сообщение в этом чате
+    await run_catch_up_for_admin(bot, since=since, mode=mode, chat_id=message.chat.id)
+
+# Сколько проблемных лент и последних ошибок показывать в /status
+STATUS_MAX_FAILING_FEEDS = 5
+STATUS_MAX_ERRORS = 5
+
+def _format_duration(seconds: float) -> str:
+    """Коротко: 40с, 12м, 3ч 5м."""
+    seconds = max(0, int(seconds))
+    if seconds < 60:
+        return f"{seconds}с"
+    if seconds < 3600:
+        return f"{seconds // 60}м"
+    return f"{seconds // 3600}ч {seconds % 3600 // 60}м"
+
+
+def _ago(timestamp: Optional[float]) -> str:
+    return f"{_format_duration(time.time() - timestamp)} назад" if timestamp else "никогда"
+
+
+def _format_run_time(run_time: Optional[datetime]) -> str:
+    if run_time is None:
+        return "не запланирован"
+    if run_time.tzinfo:
+        return run_time.astimezone().strftime('%Y-%m-%d %H:%M:%S %Z')
+    return run_time.strftime('%Y-%m-%d %H:%M:%S') + " (UTC)"
+
 
 @router.message(Command("status"))
 async def cmd_status(message: Message, scheduler: AsyncIOScheduler, bot: Bot): # Добавили bot для DefaultBotProperties
-    """Обработчик команды /status. Показывает статус бота и его настройки."""
-    if not ADMIN_ID or message.from_user.id != ADMIN_ID:
+    """Обработчик команды /status.
+
+    Все значения берутся из RuntimeState, счетчиков метрик и окна задержек,
+    которые конвейер обновляет по ходу работы, поэтому ответ не зависит от
+    числа лент и размера истории публикаций.
+    """
+    if not is_admin(message.from_user.id):
         logger.warning(f"Попытка несанкционированного доступа к /status от user_id: {message.from_user.id}")
         return
 
-    status_lines = [f"🤖 *Статус бота AI News Poster*:\n"]
-    status_lines.append(f"*Состояние бота*: Активен ✅")
-    
-    # Проверка статуса автопостинга
-    autopost_job = scheduler.get_job("scheduled_post_job")
-    if autopost_job:
-        status_lines.append(f"*Автопостинг*: `Включен` ✅")
-        next_run_time = autopost_job.next_run_time
-        if next_run_time:
-            if next_run_time.tzinfo:
-                next_run_local = next_run_time.astimezone()
-                status_lines.append(f"  *Следующий пост*: `{next_run_local.strftime('%Y-%m-%d %H:%M:%S %Z')}`")
-            else:
-                status_lines.append(f"  *Следующий пост*: `{next_run_time.strftime('%Y-%m-%d %H:%M:%S')}` \(UTC\)")
+    settings = get_settings()
+    state = get_runtime_state()
+    channel_registry = get_channel_registry()
+    esc = html.escape
+    lines = ["🤖 <b>Статус бота AI News Poster</b>", ""]
+    lines.append(f"<b>Состояние бота</b>: активен ✅, работает {_format_duration(time.time() - state.started_at)}")
+
+    publish_job = state.jobs.get(PUBLISH_JOB_ID)
+    ingest_minutes, publish_minutes = autopost_intervals()
+    if publish_job:
+        lines.append(f"<b>Автопостинг</b>: включен ✅, публикация каждые {publish_minutes} мин, сбор каждые {ingest_minutes} мин")
+        lines.append(f"  Следующий пост: <code>{esc(_format_run_time(publish_job.next_run))}</code>")
+        if publish_job.last_error:
+            lines.append(f"  Последний запуск с ошибкой: {esc(publish_job.last_error)}")
     else:
-        status_lines.append(f"*Автопостинг*: `Выключен` ❌")
-        if POSTING_INTERVAL_MINUTES == 0:
-            status_lines.append(markdown_v2_escape(f"  (Интервал в .env: {POSTING_INTERVAL_MINUTES} минут - автопост отключен в конфиге)"))
-        else:
-            status_lines.append(markdown_v2_escape(f"  (Интервал в .env: {POSTING_INTERVAL_MINUTES} минут)"))
-
-    rss_feed_count = 1 if RSS_FEED_URL else 0
-    status_lines.append(f"*Количество RSS\-лент*: `{rss_feed_count}`")
-    status_lines.append(f"*Интервал автопостинга*: `{POSTING_INTERVAL_MINUTES} минут`")
-    status_lines.append(f"*Канал для постинга*: `{markdown_v2_escape(str(TELEGRAM_CHANNEL_ID))}`")
-    status_lines.append(f"*AI провайдер для текста*: `{markdown_v2_escape(AI_PROVIDER)}`")
-    if AI_PROVIDER == "openrouter":
-        status_lines.append(f"  *Модель OpenRouter*: `{markdown_v2_escape(OPENROUTER_CHAT_MODEL)}`")
-
-    status_lines.append(f"*Генерация изображений*: `{'Включена' if IMAGE_GENERATION_ENABLED else 'Выключена'}`")
-    if IMAGE_GENERATION_ENABLED:
-        status_lines.append(f"  *Приоритет источника изображений*: `{markdown_v2_escape(str(IMAGE_SOURCE_PRIORITY))}`")
-        status_lines.append(f"  *Модель OpenAI для изображений*: `{markdown_v2_escape(OPENAI_IMAGE_MODEL)}`")
-    
-    status_lines.append(f"*Файл с опубликованными ссылками*: `{markdown_v2_escape(POSTED_LINKS_FILE)}`")
-    status_lines.append(markdown_v2_escape(f"*Текущий ParseMode бота (по умолчанию)*: `{bot.default.parse_mode if bot.default else 'Не установлен'}`"))
+        disabled = " (отключен в конфиге)" if settings.posting_interval_minutes == 0 else ""
+        lines.append(f"<b>Автопостинг</b>: выключен ❌, публикация каждые {publish_minutes} мин{disabled}")
+    if settings.quiet_hours:
+        lines.append(f"<b>Тихие часы</b>: <code>{esc(settings.quiet_hours)}</code>")
+
+    # Ленты: число из реестра каналов, итоги опросов - из RuntimeState
+    feed_count = len(channel_registry.feeds())
+    counts = state.feed_status_counts
+    lines.append(
+        f"<b>RSS-ленты</b>: {feed_count}; последний опрос: ok {counts['ok']}, без изменений {counts['not_modified']}, "
+        f"с ошибкой {counts['error']}; последняя загрузка {_ago(state.last_feed_fetch)}"
+    )
+    failing = [(url, feed) for url, feed in state.feeds.items() if feed.status == "error"]
+    for url, feed in failing[:STATUS_MAX_FAILING_FEEDS]:
+        lines.append(f"  ⚠️ {esc(url)}: {esc(feed.error or '')} (ошибок подряд {feed.failures})")
+    if len(failing) > STATUS_MAX_FAILING_FEEDS:
+        lines.append(f"  ... и еще {len(failing) - STATUS_MAX_FAILING_FEEDS}")
+    if state.last_feed_memory:
+        peak_bytes, retained_bytes, entries = state.last_feed_memory
+        lines.append(
+            f"  Память опроса: пик {peak_bytes / 2**20:.1f} МБ, удерживается {retained_bytes / 2**20:.1f} МБ ({entries} записей)"
+        )
 
-    try:
-        next_run = scheduler.get_job("scheduled_post_job").next_run_time if scheduler.get_job("scheduled_post_job") else None
-        if next_run:
-            if next_run.tzinfo:
-                next_run_local = next_run.astimezone()
-                status_lines.append(f"*Следующий автоматический пост*: `{next_run_local.strftime('%Y-%m-%d %H:%M:%S %Z')}`")
-            else:
-                status_lines.append(f"*Следующий автоматический пост*: `{next_run.strftime('%Y-%m-%d %H:%M:%S')}` \(UTC\)")
-        else:
-            status_lines.append(f"*Следующий автоматический пост*: `Планировщик не активен или задача не найдена`")
-    except Exception as e:
-        logger.error(f"Ошибка при получении времени следующего запуска из APScheduler: {e}", exc_info=True)
-        # status_lines.append(markdown_v2_escape(f"*Следующий автоматический пост*: `Ошибка получения данных ({str(e)})`"))
-        # Строка выше заменена на блок автопостинга в начале функции
-        pass # Ошибка уже нерелевантна если автопост не активен или инфо уже есть
-        
-    posted_links = load_posted_links(POSTED_LINKS_FILE)
-    status_lines.append(f"*Количество уже опубликованных постов*: `{len(posted_links)}`")
+    lines.append(f"<b>Новостей в очереди на публикацию</b>: {len(get_candidate_queue())}")
+    if state.last_ingest:
+        ingest_time, added = state.last_ingest
+        lines.append(
+            f"<b>Сбор новостей</b>: запусков {state.ingest_runs}, добавлено {state.ingested_total}, "
+            f"последний {_ago(ingest_time)} (+{added})"
+        )
+    lines.append(f"<b>Опубликовано с запуска</b>: {state.posts_total}")
+
+    if len(channel_registry) == 1:
+        channel = channel_registry.default
+        lines.append(f"<b>Канал для постинга</b>: <code>{esc(str(channel.chat_id))}</code>, всего опубликовано {len(channel_registry.posted_links(channel))}")
+    else:
+        lines.append(f"<b>Каналы для постинга</b>: {len(channel_registry)}")
+    for channel in channel_registry:
+        if len(channel_registry) > 1:
+            feeds_info = f"{len(channel.feeds)} лент" if channel.feeds else "все ленты"
+            lines.append(
+                f"  • {esc(channel.name)} (<code>{esc(str(channel.chat_id))}</code>): {feeds_info}, "
+                f"изображения {esc(str(channel.image_source_priority))}, опубликовано {len(channel_registry.posted_links(channel))}"
+            )
+        last_post = state.last_posts.get(channel.name)
+        if last_post:
+            lines.append(f"    последний пост {_ago(last_post[0])}: {esc(last_post[1][:80])}")
+
+    dedupe = {labels[0]: int(value) for labels, value in DEDUPE_HITS.snapshot().items()}
+    if dedupe:
+        lines.append("<b>Отсеяно дублей</b>: " + ", ".join(f"{esc(where)} {count}" for where, count in sorted(dedupe.items())))
+    extractions = {labels[0]: int(value) for labels, value in ARTICLE_EXTRACTIONS.snapshot().items()}
+    if extractions:
+        lines.append("<b>Текст статей</b>: " + ", ".join(f"{esc(tier)} {count}" for tier, count in sorted(extractions.items())))
+
+    if state.coordination:
+        stats = state.coordination
+        lines.append(
+            f"<b>Экземпляры бота</b>: узел {esc(str(stats['node_id']))}, живых узлов {stats['nodes']}, "
+            f"публикатор {esc(str(stats['leader'] or 'не выбран'))}, в общей очереди {stats['pending']}"
+        )
 
-    await message.reply("\n".join(status_lines), parse_mode=ParseMode.MARKDOWN_V2.value)
+    latencies = RECENT_LATENCY.percentiles()
+    if latencies:
+        lines.append(f"<b>Задержки этапов</b> (последние {RECENT_LATENCY.size} измерений):")
+        table = [f"{'этап':<16} {'n':>4} {'p50, с':>8} {'p95, с':>8}"]
+        for stage, (count, (p50, p95)) in sorted(latencies.items()):
+            table.append(f"{stage:<16} {count:>4} {p50:>8.2f} {p95:>8.2f}")
+        lines.append(f"<pre>{esc(chr(10).join(table))}</pre>")
+
+    lines.append(f"<b>AI провайдер для текста</b>: <code>{esc(settings.ai_provider)}</code>")
+    llm = get_token_ledger().stats()
+    budget = f", бюджет израсходован на {llm['spent_ratio']:.0%}" if settings.llm_daily_token_budget or settings.llm_daily_cost_budget else ""
+    lines.append(
+        f"  Расход LLM за {llm['day']}: {llm['usage'].calls} запр., {llm['usage'].total_tokens} токенов "
+        f"(из кэша {llm['usage'].cached_tokens}), ${llm['usage'].cost:.4f}{budget}"
+    )
+    if settings.llm_cascade_models:
+        lines.append(f"  Каскад моделей: <code>{esc(settings.llm_cascade_models)}</code>")
+    if len(llm["models"]) > 1 or settings.llm_cascade_models:
+        lines.append("  По моделям: " + ", ".join(
+            f"{esc(model)} {usage.calls} запр. ${usage.cost:.4f}" for model, usage in llm["models"].items()
+        ))
+    if settings.ai_provider == "openrouter":
+        lines.append(f"  Модель OpenRouter: <code>{esc(settings.openrouter_chat_model)}</code>")
+    lines.append(f"<b>Генерация изображений</b>: {'включена' if settings.image_generation_enabled else 'выключена'}")
+    if settings.image_generation_enabled:
+        lines.append(f"  Приоритет источника изображений: <code>{esc(str(settings.image_source_priority))}</code>")
+        lines.append(f"  Модель OpenAI для изображений: <code>{esc(settings.openai_image_model)}</code>")
+
+    if state.errors:
+        lines.append(f"<b>Последние ошибки</b> ({len(state.errors)}):")
+        for timestamp, source, error in list(state.errors)[-STATUS_MAX_ERRORS:]:
+            lines.append(f"  {_ago(timestamp)} [{esc(source)}] {esc(error[:200])}")
+
+    await message.reply("\n".join(lines), parse_mode=ParseMode.HTML.value, disable_web_page_preview=True)
 
 @router.message(Command("post_latest_news"))
 async def cmd_post_latest_news(message: Message, bot: Bot):
     """Обработчик команды для постинга последней новости."""
-    if not ADMIN_ID or message.from_user.id != ADMIN_ID:
+    if not is_admin(message.from_user.id):
         logger.warning(f"Попытка несанкционированного доступа к /post_latest_news от user_id: {message.from_user.id}")
         await message.reply("Эта команда доступна только администратору.", parse_mode=None)
         return
@@ -221,10 +405,7 @@ async def cmd_post_latest_news(message: Message, bot: Bot):
     summary = news_item.get('summary') or news_item.get('description', "")
     
     # Попытка извлечь полный контент, если есть
-    content_detail = news_item.get('content')
-    full_content = None
-    if content_detail and isinstance(content_detail, list) and len(content_detail) > 0:
-        full_content = content_detail[0].get('value')
+    full_content = entry_content(news_item)
     
     # Попытка извлечь URL изображения из RSS
     rss_image_url: str | None = None
@@ -246,11 +427,13 @@ async def cmd_post_latest_news(message: Message, bot: Bot):
 
     await message.answer(f"Новость получена: \"{title}\". Обрабатываю с помощью AI...")
     
+    channel = get_channel_registry().default # Ручные команды публикуют в основной канал
     ai_result = await ai_service.reformat_news_for_channel(
         news_title=title,
         news_summary=summary,
         news_link=link,
-        news_content=full_content
+        news_content=full_content,
+        system_prompt=channel.prompt
     )
     
     if not ai_result:
@@ -278,7 +461,7 @@ async def cmd_post_latest_news(message: Message, bot: Bot):
     # Новая логика выбора изображения
     # В user_commands мы можем логировать в ответ пользователю, а не только в консоль
     await message.answer("Определяю изображение для поста согласно настройкам...")
-    final_image_url_to_post = await get_final_image_url(news_item, image_prompt)
+    final_image_url_to_post = await get_final_image_url(news_item, image_prompt, channel.image_source_priority)
 
     if final_image_url_to_post:
         await message.answer(f"Изображение для поста определено: {final_image_url_to_post}")
@@ -290,7 +473,8 @@ async def cmd_post_latest_news(message: Message, bot: Bot):
     success = await telegram_service.post_to_channel(
         bot=bot, 
         text=formatted_text, 
-        image_url=final_image_url_to_post
+        image_url=final_image_url_to_post,
+        chat_id=channel.chat_id
     )
     
     if success:
@@ -302,11 +486,12 @@ async def cmd_post_latest_news(message: Message, bot: Bot):
 @router.message(Command("start_autopost"))
 async def cmd_start_autopost(message: Message, scheduler: AsyncIOScheduler, bot: Bot):
     """Включает автоматический постинг новостей."""
-    if not ADMIN_ID or message.from_user.id != ADMIN_ID:
+    if not is_admin(message.from_user.id):
         logger.warning(f"Несанкционированный доступ к /start_autopost от {message.from_user.id}")
         return
 
-    if POSTING_INTERVAL_MINUTES is None or POSTING_INTERVAL_MINUTES <= 0:
+    posting_interval_minutes = get_settings().posting_interval_minutes
+    if posting_interval_minutes is None or posting_interval_minutes <= 0:
         await message.reply(
             markdown_v2_escape("Автопостинг не может быть запущен. "
                                "Установите POSTING_INTERVAL_MINUTES > 0 в вашем .env файле и перезапустите бота."),
@@ -314,38 +499,45 @@ async def cmd_start_autopost(message: Message, scheduler: AsyncIOScheduler, bot:
         )
         return
 
-    job = scheduler.get_job("scheduled_post_job")
+    coordinator = get_coordinator()
+    if coordinator:
+        coordinator.set_flag(AUTOPOST_FLAG, True) # Остальные экземпляры включат автопостинг на своем тике координации
+
+    job = scheduler.get_job(PUBLISH_JOB_ID)
     if job:
         await message.reply(markdown_v2_escape("Автопостинг уже включен."), parse_mode=ParseMode.MARKDOWN_V2.value)
     else:
-        scheduler.add_job(
-            telegram_service.post_latest_news,
-            'interval',
-            minutes=POSTING_INTERVAL_MINUTES,
-            args=[bot, TELEGRAM_CHANNEL_ID, POSTED_LINKS_FILE],
-            id="scheduled_post_job",
-            name="Scheduled News Posting",
-            replace_existing=True
-        )
+        # Сбор новостей и публикация - независимые задачи: сбор наполняет очередь,
+        # публикатор забирает из нее по одной лучшей новости в своем темпе
+        tick_minutes, publish_minutes = register_autopost_jobs(scheduler, bot)
         if not scheduler.running: # На случай если планировщик был остановлен как-то иначе
             scheduler.start()
             logger.info("Планировщик APScheduler запущен для автопостинга.")
         await message.reply(
-            markdown_v2_escape(f"Автопостинг включен с интервалом {POSTING_INTERVAL_MINUTES} минут."),
+            markdown_v2_escape(
+                f"Автопостинг включен: проверка лент каждые {tick_minutes} мин. "
+                f"(каждая лента опрашивается с учетом частоты ее обновлений), "
+                f"публикация одной новости каждые {publish_minutes} мин."
+            ),
             parse_mode=ParseMode.MARKDOWN_V2.value
         )
-        logger.info(f"Автопостинг включен администратором {message.from_user.id} с интервалом {POSTING_INTERVAL_MINUTES} мин.")
+        logger.info(
+            f"Автопостинг включен администратором {message.from_user.id}: сбор каждые {tick_minutes} мин., "
+            f"публикация каждые {publish_minutes} мин."
+        )
 
 @router.message(Command("stop_autopost"))
 async def cmd_stop_autopost(message: Message, scheduler: AsyncIOScheduler):
     """Выключает автоматический постинг новостей."""
-    if not ADMIN_ID or message.from_user.id != ADMIN_ID:
+    if not is_admin(message.from_user.id):
         logger.warning(f"Несанкционированный доступ к /stop_autopost от {message.from_user.id}")
         return
 
-    job = scheduler.get_job("scheduled_post_job")
-    if job:
-        scheduler.remove_job("scheduled_post_job")
+    coordinator = get_coordinator()
+    if coordinator:
+        coordinator.set_flag(AUTOPOST_FLAG, False)
+
+    if remove_autopost_jobs(scheduler):
         await message.reply(markdown_v2_escape("Автопостинг выключен."), parse_mode=ParseMode.MARKDOWN_V2.value)
         logger.info(f"Автопостинг выключен администратором {message.from_user.id}")
     else:
@@ -355,15 +547,21 @@ async def cmd_stop_autopost(message: Message, scheduler: AsyncIOScheduler):
 @router.message(Command("prepare_post"))
 async def cmd_prepare_post(message: Message, bot: Bot, state: FSMContext):
     """Готовит новость для постинга и показывает превью администратору."""
-    if not ADMIN_ID or message.from_user.id != ADMIN_ID:
+    if not is_admin(message.from_user.id):
         logger.warning(f"Несанкционированный доступ к /prepare_post от {message.from_user.id}")
         return
     
     await message.answer(markdown_v2_escape("Готовлю последнюю новость для превью... ⏳"), parse_mode=ParseMode.MARKDOWN_V2.value)
 
+    with start_trace("prepare_post", admin_id=message.from_user.id) as root:
+        await _prepare_post_preview(message, bot, state, root)
+
+async def _prepare_post_preview(message: Message, bot: Bot, state: FSMContext, root) -> None:
+    """Этапы /prepare_post внутри трассы: новость -> AI -> изображение -> превью."""
     try:
         # 1. Получаем последнюю новость (не опубликованную)
-        latest_news_items = await rss_service.get_latest_news(count=1) # Используем count=1 для получения одной новости
+        with span("fetch_feeds"):
+            latest_news_items = await rss_service.get_latest_news(count=1) # Используем count=1 для получения одной новости
         if not latest_news_items:
             await message.answer(markdown_v2_escape("Не удалось найти свежие новости в RSS-ленте для подготовки."), parse_mode=ParseMode.MARKDOWN_V2.value)
             return
@@ -371,25 +569,27 @@ async def cmd_prepare_post(message: Message, bot: Bot, state: FSMContext):
         news_item = latest_news_items[0] # Берем первую (и единственную) новость
         title = news_item.get('title', "Без заголовка")
         link = news_item.get('link', "")
+        root.set(link=link, title=title)
         summary = news_item.get('summary') or news_item.get('description', "")
-        content_detail = news_item.get('content')
-        full_content = None
-        if content_detail and isinstance(content_detail, list) and len(content_detail) > 0:
-            full_content = content_detail[0].get('value')
+        full_content = entry_content(news_item)
 
         # Проверяем, не был ли этот пост уже опубликован (на всякий случай, хотя get_latest_news должен это учитывать)
-        posted_links = load_posted_links(POSTED_LINKS_FILE)
-        if link and link in posted_links:
+        channel_registry = get_channel_registry()
+        channel = channel_registry.default # Превью готовится для основного канала
+        if link and channel_registry.is_posted(channel, link):
             await message.answer(markdown_v2_escape(f"Эта новость уже была опубликована: [{markdown_v2_escape(title)}]({link})"), parse_mode=ParseMode.MARKDOWN_V2.value)
             return
 
         # 2. Реформатируем с помощью AI
-        ai_result = await ai_service.reformat_news_for_channel(
-            news_title=title,
-            news_summary=summary,
-            news_link=link,
-            news_content=full_content
-        )
+        with span("llm_reformat", input_chars=len(full_content or summary or "")) as s:
+            ai_result = await ai_service.reformat_news_for_channel(
+                news_title=title,
+                news_summary=summary,
+                news_link=link,
+                news_content=full_content,
+                system_prompt=channel.prompt
+            )
+            s.set(ok=bool(ai_result))
         if not ai_result:
             await message.answer(markdown_v2_escape("Не удалось обработать новость с помощью AI для превью."), parse_mode=ParseMode.MARKDOWN_V2.value)
             return
@@ -397,7 +597,8 @@ async def cmd_prepare_post(message: Message, bot: Bot, state: FSMContext):
         formatted_text, image_prompt = ai_result
 
         # 3. Получаем URL изображения
-        final_image_url_to_post = await get_final_image_url(news_item, image_prompt) # Передаем оригинальный news_item
+        with span("image"):
+            final_image_url_to_post = await get_final_image_url(news_item, image_prompt, channel.image_source_priority) # Передаем оригинальный news_item
 
         # 4. Сохраняем данные в FSM
         await state.set_state(PreparePostStates.awaiting_confirmation)
@@ -405,7 +606,9 @@ async def cmd_prepare_post(message: Message, bot: Bot, state: FSMContext):
             prepared_text=formatted_text, 
             prepared_image_url=final_image_url_to_post,
             news_link=link, # Сохраняем ссылку для отметки как опубликованной
-            news_title=title # Для логов и сообщений
+            news_title=title, # Для логов и сообщений
+            news_summary=summary, # Для обучения фильтра релевантности по решению администратора
+            trace_id=current_trace_id() # Публикация после подтверждения продолжит ту же трассу
         )
         
         # 5. Отправляем превью администратору
@@ -420,22 +623,23 @@ async def cmd_prepare_post(message: Message, bot: Bot, state: FSMContext):
             # TODO: Добавить кнопки "Редактировать AI" и "Новое изображение"
         ])
 
-        if final_image_url_to_post:
-            # Используем bot.send_photo, так как message.answer_photo нет, а message.reply_photo требует фото из файла/ID
-            await bot.send_photo(
-                chat_id=message.chat.id,
-                photo=final_image_url_to_post,
-                caption=preview_prefix + formatted_text, # AI now provides HTML, prefix is plain
-                parse_mode=ParseMode.HTML.value, # Use HTML for preview caption
-                reply_markup=confirm_kb
-            )
-        else:
-            await message.answer(
-                preview_prefix + formatted_text, # AI now provides HTML, prefix is plain
-                parse_mode=ParseMode.HTML.value, # Use HTML for preview message
-                reply_markup=confirm_kb,
-                disable_web_page_preview=False
-            )
+        with span("send_preview"):
+            if final_image_url_to_post:
+                # Используем bot.send_photo, так как message.answer_photo нет, а message.reply_photo требует фото из файла/ID
+                await bot.send_photo(
+                    chat_id=message.chat.id,
+                    photo=final_image_url_to_post,
+                    caption=preview_prefix + formatted_text, # AI now provides HTML, prefix is plain
+                    parse_mode=ParseMode.HTML.value, # Use HTML for preview caption
+                    reply_markup=confirm_kb
+                )
+            else:
+                await message.answer(
+                    preview_prefix + formatted_text, # AI now provides HTML, prefix is plain
+                    parse_mode=ParseMode.HTML.value, # Use HTML for preview message
+                    reply_markup=confirm_kb,
+                    disable_web_page_preview=False
+                )
         await message.answer("Выберите действие для подготовленного поста.", parse_mode=None) # Plain text for this simple message
 
     except Exception as e:
@@ -465,17 +669,23 @@ async def cq_publish_prepared_post(query: CallbackQuery, callback_data: PostConf
     logger.info(f"Публикация подтверждена администратором {query.from_user.id}. Текст: {prepared_post_text[:50]}... URL: {prepared_image_url}")
 
     try:
-        success = await telegram_service.post_to_channel(
-            bot=bot,
-            text=prepared_post_text,
-            image_url=prepared_image_url,
-            # channel_id is already handled by telegram_service using config
-        )
+        # Продолжаем трассу, начатую при подготовке превью
+        channel_registry = get_channel_registry()
+        channel = channel_registry.default
+        with start_trace("publish_prepared_post", trace_id=user_data.get("trace_id"), link=original_news_link) as root:
+            success = await telegram_service.post_to_channel(
+                bot=bot,
+                text=prepared_post_text,
+                image_url=prepared_image_url,
+                chat_id=channel.chat_id
+            )
+            root.set(posted=success)
 
         if success:
             # Save the link as posted
-            save_posted_link(POSTED_LINKS_FILE, original_news_link) 
+            channel_registry.mark_posted(channel, original_news_link)
             logger.info(f"Ссылка {original_news_link} сохранена как опубликованная после подтверждения.")
+            get_relevance_classifier().learn(user_data.get("news_title", ""), user_data.get("news_summary", ""), relevant=True)
             
             confirmation_message = f"✅ Пост опубликован!\n\n{prepared_post_text[:300]}..."
             if query.message.content_type == ContentType.PHOTO:
@@ -506,6 +716,9 @@ async def cq_publish_prepared_post(query: CallbackQuery, callback_data: PostConf
 async def cq_cancel_prepared_post(query: CallbackQuery, callback_data: PostConfirmationCallback, state: FSMContext):
     """Handles the 'Cancel' action from the confirmation inline keyboard."""
     logger.info(f"Публикация отменена администратором {query.from_user.id}")
+    user_data = await state.get_data()
+    if user_data.get("news_title"):
+        get_relevance_classifier().learn(user_data["news_title"], user_data.get("news_summary", ""), relevant=False)
     cancel_message = "Публикация отменена администратором. 🛑"
     
     if query.message.content_type == ContentType.PHOTO:
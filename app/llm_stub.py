@@ -0,0 +1,184 @@
+"""Локальная OpenAI/OpenRouter-совместимая заглушка LLM с воспроизведением фикстур.
+
+Отвечает на POST /v1/chat/completions (OPENAI_BASE_URL=http://host:port/v1) и
+/api/v1/chat/completions (OPENROUTER_BASE_URL=http://host:port/api/v1):
+
+- ответ берется из каталога фикстур по ключу запроса (см. app.services.llm_fixtures;
+  записать каталог можно реальным прогоном с LLM_RECORD_DIR);
+- если такого запроса не записано, отдается следующий записанный ответ по кругу,
+  а без фикстур - синтетический пост по заголовку из запроса (с --strict - ошибка 404);
+- задержка ответа задается --latency и --jitter, а доля ответов с ошибкой
+  (429, 500, 503 по умолчанию) - --error-rate: так проверяются пропускная
+  способность и поведение генерации (повторы клиента, каскад моделей) при сбоях.
+
+GET /stats возвращает счетчики: запросы, воспроизведенные ответы, подстановки,
+промахи и внесенные ошибки по кодам.
+
+Запуск из корня проекта:
+
+    LLM_RECORD_DIR=llm_fixtures python -m app.dry_run 20      # запись с реальным API
+    python -m app.llm_stub --fixtures llm_fixtures --latency 0.8 --jitter 0.4 --error-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8766/v1 python -m app.dry_run 20
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from aiohttp import web
+
+from app.services.llm_fixtures import LLMFixtureStore
+from app.services.llm_usage import count_message_tokens, count_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8766
+DEFAULT_ERROR_STATUSES = (429, 500, 503)
+_TITLE_RE = re.compile(r"^Заголовок:\s*(.+)$", re.MULTILINE)
+
+
+def _error_body(status: int, message: str) -> Dict[str, Any]:
+    error_type = "rate_limit_error" if status == 429 else ("invalid_request_error" if status < 500 else "server_error")
+    return {"error": {"message": message, "type": error_type, "code": status}}
+
+
+def synthetic_completion(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Правдоподобный ответ chat completions по заголовку новости из запроса (HTML или JSON по response_format)."""
+    messages = payload.get("messages") or []
+    user_text = next((m.get("content") for m in reversed(messages) if m.get("role") == "user"), "") or ""
+    match = _TITLE_RE.search(user_text if isinstance(user_text, str) else "")
+    title = (match.group(1).strip() if match else "Новость об ИИ")[:60].rstrip(".")
+    teaser = "Разработчики представили обновление, которое заметно упрощает работу с языковыми моделями. Первые отзывы пользователей сдержанно положительные."
+    body = "Главное изменение касается того, как модель следует инструкциям: короткие промпты с одним-двумя примерами дают более стабильный результат, а стоимость запросов снижается."
+    hashtags = ["ИИ", "LLM", "PromptEngineering"]
+    if (payload.get("response_format") or {}).get("type") == "json_object":
+        content = json.dumps(
+            {"title": title, "teaser": teaser, "body": body, "hashtags": hashtags, "image_prompt": f"Illustration for: {title}"},
+            ensure_ascii=False,
+        )
+    else:
+        content = f"<b>🤖 {title}</b>\n\n{teaser}\n\n{body}\n\n" + " ".join(f"#{tag}" for tag in hashtags)
+    model = payload.get("model", "stub")
+    prompt_tokens = count_message_tokens(messages, model)
+    completion_tokens = count_tokens(content, model)
+    return {
+        "id": f"chatcmpl-stub{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+class LLMReplayStub:
+    """Обработчик chat completions: воспроизведение фикстур, задержки и внесение ошибок."""
+
+    def __init__(
+        self,
+        store: Optional[LLMFixtureStore] = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_statuses: Sequence[int] = DEFAULT_ERROR_STATUSES,
+        strict: bool = False,
+        fallback: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses) or DEFAULT_ERROR_STATUSES
+        self.strict = strict
+        # Ответ на незаписанный запрос; по умолчанию - записанные ответы по кругу или synthetic_completion
+        self.fallback = fallback
+        self._random = random.Random(seed)
+        recorded = store.responses() if store is not None else []
+        self._recorded = itertools.cycle(recorded) if recorded else None
+        self.stats: Counter = Counter()
+
+    def add_routes(self, app: web.Application) -> None:
+        app.router.add_post("/v1/chat/completions", self.handle)
+        app.router.add_post("/api/v1/chat/completions", self.handle)
+        app.router.add_get("/stats", self.handle_stats)
+
+    def _delay(self) -> float:
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    async def handle(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        self.stats["requests"] += 1
+        delay = self._delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            status = self._random.choice(self.error_statuses)
+            self.stats[f"error_{status}"] += 1
+            return web.json_response(_error_body(status, f"Injected error {status} (llm_stub)"), status=status)
+
+        response = self.store.lookup(payload) if self.store is not None else None
+        if response is not None:
+            self.stats["replayed"] += 1
+        elif self.strict:
+            self.stats["missed"] += 1
+            return web.json_response(_error_body(404, "No recorded response for this request (llm_stub --strict)"), status=404)
+        else:
+            self.stats["fallback"] += 1
+            if self.fallback is not None:
+                response = self.fallback(payload)
+            elif self._recorded is not None:
+                response = next(self._recorded)
+            else:
+                response = synthetic_completion(payload)
+        return web.json_response(dict(response, created=int(time.time())))
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.stats))
+
+
+def _status_list(raw: str) -> list:
+    return [int(code) for code in raw.split(",") if code.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI/OpenRouter-совместимая заглушка LLM с воспроизведением фикстур")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--fixtures", help="Каталог фикстур (записанный с LLM_RECORD_DIR)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Средняя задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Разброс задержки (равномерно ±jitter), сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов с ошибкой (0..1)")
+    parser.add_argument("--error-statuses", default="429,500,503", help="Коды внесенных ошибок через запятую")
+    parser.add_argument("--strict", action="store_true", help="404 на незаписанный запрос вместо подстановки")
+    parser.add_argument("--seed", type=int, help="Seed для задержек и ошибок (воспроизводимый прогон)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    store = LLMFixtureStore(args.fixtures) if args.fixtures else None
+    stub = LLMReplayStub(
+        store=store,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_statuses=_status_list(args.error_statuses),
+        strict=args.strict,
+        seed=args.seed,
+    )
+    app = web.Application(client_max_size=20 * 1024 * 1024)
+    stub.add_routes(app)
+    fixtures_info = f"{len(store)} фикстур из {args.fixtures}" if store is not None else "без фикстур (синтетические ответы)"
+    logger.info(f"Заглушка LLM на http://{args.host}:{args.port}/v1: {fixtures_info}.")
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
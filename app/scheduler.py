@@ -1,94 +1,238 @@
+import asyncio
 import logging
-import os # Добавлен os для работы с файлами
-from collections import deque # Для FIFO очереди при ограничении файла
 from aiogram import Bot
-import aiohttp # Added for ClientSession
-from datetime import datetime # For type hinting and default date
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone # For type hinting and default date
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
 
 from app.services import rss_service, ai_service, telegram_service
-from app.services.content_fetch_service import fetch_article_content 
+from app.services.content_fetch_service import extract_from_feed, fetch_article_content, get_article_content
 from app.services.rss_service import get_entry_published_datetime
-from app.config import OPENAI_IMAGE_MODEL, POSTED_LINKS_FILE, MAX_POSTED_LINKS_IN_FILE
+from app.services.post_queue import CandidateQueue, parse_source_weights
+from app.services.channels import Channel, get_channel_registry, group_by_style
+from app.services.coordination import AUTOPOST_FLAG, get_coordinator
+from app.services.feed_content import entry_content
+from app.services.llm_usage import get_token_ledger, track_post_usage
+from app.services.relevance_service import get_relevance_classifier
+from app.services.runtime_state import get_runtime_state
+from app.services.story_clustering import entry_lead, get_story_clusterer
+from app.config import get_settings
 from app.utils.image_utils import get_final_image_url
+from app.utils.metrics import DEDUPE_HITS, POSTS, QUEUE_DEPTH
+from app.utils.tracing import span, start_trace
 
 logger = logging.getLogger(__name__)
 
-# Используем deque для хранения ссылок в памяти, чтобы легко управлять размером FIFO
-POSTED_NEWS_LINKS: deque[str] = deque(maxlen=MAX_POSTED_LINKS_IN_FILE) 
+def is_link_posted(link: str) -> bool:
+    """Проверяет, опубликована ли ссылка во всех каналах (дубли учитываются отдельно по каждому каналу)."""
+    return get_channel_registry().is_posted_everywhere(link)
 
-def load_posted_links():
-    """Загружает ранее опубликованные ссылки из файла в память."""
-    global POSTED_NEWS_LINKS
-    if os.path.exists(POSTED_LINKS_FILE):
-        try:
-            with open(POSTED_LINKS_FILE, 'r', encoding='utf-8') as f:
-                # Читаем все строки, удаляя переносы строк
-                links_from_file = [line.strip() for line in f if line.strip()]
-                # Загружаем в deque, он сам ограничит количество до maxlen
-                POSTED_NEWS_LINKS = deque(links_from_file, maxlen=MAX_POSTED_LINKS_IN_FILE)
-                logger.info(f"Загружено {len(POSTED_NEWS_LINKS)} ссылок из {POSTED_LINKS_FILE}.")
-        except Exception as e:
-            logger.error(f"Ошибка при загрузке ссылок из {POSTED_LINKS_FILE}: {e}", exc_info=True)
-    else:
-        logger.info(f"Файл {POSTED_LINKS_FILE} не найден. Начинаем с чистого списка опубликованных ссылок.")
+# Идентификаторы задач APScheduler: сбор новостей и публикация работают независимо
+INGEST_JOB_ID = "feed_ingest_job"
+PUBLISH_JOB_ID = "publish_job"
+AUTOPOST_JOB_IDS = (INGEST_JOB_ID, PUBLISH_JOB_ID)
 
-def save_posted_link(link: str):
-    """Добавляет ссылку в память и сохраняет текущий список (ограниченный) в файл."""
-    global POSTED_NEWS_LINKS
-    if link not in POSTED_NEWS_LINKS: # Добавляем, только если ее там нет (хотя deque сам справится с дублями при добавлении)
-        POSTED_NEWS_LINKS.append(link) # deque сам удалит старый элемент, если maxlen достигнут
-        try:
-            # Перезаписываем файл текущим содержимым deque
-            with open(POSTED_LINKS_FILE, 'w', encoding='utf-8') as f:
-                for l_item in POSTED_NEWS_LINKS:
-                    f.write(f"{l_item}\n")
-            logger.debug(f"Ссылка {link} добавлена и список сохранен в {POSTED_LINKS_FILE}.")
-        except Exception as e:
-            logger.error(f"Ошибка при сохранении ссылки в {POSTED_LINKS_FILE}: {e}", exc_info=True)
+# Для скольких лучших кандидатов узлы-владельцы заранее загружают статьи (режим нескольких экземпляров)
+PREFETCH_LOOKAHEAD = 5
+COORDINATION_JOB_ID = "coordination_job"
+
+# Сколько кандидатов подряд публикатор может попробовать за один запуск,
+# если предыдущие не удалось обработать (ошибка AI, ошибка Telegram)
+PUBLISH_MAX_ATTEMPTS = 3
+
+# Теневой режим (/dry_run, app/dry_run.py): конвейер выполняется полностью, но посты не отправляются
+# в Telegram и не отмечаются опубликованными, а складываются в этот список
+_dry_run_posts: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("dry_run_posts", default=None)
+# В теневом режиме картинки не генерируются: берется только изображение из RSS
+_DRY_RUN_IMAGE_POLICY = {"rss_then_ai": "rss_only", "ai_then_rss": "rss_only", "ai_only": "none"}
+
+@contextmanager
+def dry_run_mode() -> Iterator[List[Dict[str, Any]]]:
+    """Включает теневой режим для process_and_post_news внутри блока; возвращает список "опубликованных" постов."""
+    posts: List[Dict[str, Any]] = []
+    token = _dry_run_posts.set(posts)
+    try:
+        yield posts
+    finally:
+        _dry_run_posts.reset(token)
+
+class PostThrottle:
+    """Интервал между отправками в один канал (догоняющий режим, app/catch_up.py)."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def wait(self, key: str) -> None:
+        """Ждет, пока с прошлой отправки в канал key пройдет interval секунд."""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            last = self._last.get(key)
+            if last is not None:
+                delay = last + self.interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self._last[key] = loop.time()
 
-# Загружаем ссылки один раз при инициализации модуля
-load_posted_links()
+# Пейсинг отправки: посты, подготовленные параллельно, уходят в каждый канал не чаще раза в интервал
+_post_throttle: ContextVar[Optional[PostThrottle]] = ContextVar("post_throttle", default=None)
 
-async def process_and_post_news(bot: Bot, news_item: dict, http_session: aiohttp.ClientSession):
-    """Обрабатывает одну новость и постит ее, если она новая."""
+@contextmanager
+def throttled_posting(throttle: PostThrottle) -> Iterator[PostThrottle]:
+    """Включает пейсинг отправки для process_and_post_news внутри блока."""
+    token = _post_throttle.set(throttle)
+    try:
+        yield throttle
+    finally:
+        _post_throttle.reset(token)
+
+# Очередь кандидатов: сборщик кладет сюда новые записи, публикатор забирает лучшие.
+# Дорогая работа (загрузка статьи, AI) выполняется только для извлеченных из очереди записей.
+_candidate_queue: Optional[CandidateQueue] = None
+
+def get_candidate_queue() -> CandidateQueue:
+    global _candidate_queue
+    if _candidate_queue is None:
+        settings = get_settings()
+        _candidate_queue = CandidateQueue(
+            freshness_half_life=settings.queue_freshness_half_life_hours * 3600,
+            source_weights=parse_source_weights(settings.source_weights),
+            max_size=settings.queue_max_size,
+            max_age=settings.queue_max_age_hours * 3600,
+            is_posted=is_link_posted,
+        )
+        QUEUE_DEPTH.set_function(lambda: len(_candidate_queue))
+    return _candidate_queue
+
+def parse_quiet_hours(raw: str) -> Optional[Tuple[int, int]]:
+    """Разбирает строку тихих часов вида "23-7" в пару (начало, конец)."""
+    if not raw or "-" not in raw:
+        return None
+    start_str, _, end_str = raw.partition("-")
+    try:
+        start, end = int(start_str) % 24, int(end_str) % 24
+    except ValueError:
+        logger.warning(f"Некорректное значение QUIET_HOURS: '{raw}'. Тихие часы отключены.")
+        return None
+    return (start, end) if start != end else None
+
+def in_quiet_hours(now: Optional[datetime] = None) -> bool:
+    """Проверяет, попадает ли текущее время в тихие часы (QUIET_HOURS, часовой пояс BOT_TIMEZONE)."""
+    settings = get_settings()
+    quiet_hours = parse_quiet_hours(settings.quiet_hours)
+    if not quiet_hours:
+        return False
+    now = now or datetime.now(ZoneInfo(settings.bot_timezone))
+    start, end = quiet_hours
+    if start < end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end # Интервал через полночь, например 23-7
+
+def is_relevant_news(news_item: dict) -> bool:
+    """Дешевая локальная проверка релевантности по заголовку и краткому описанию."""
+    if not get_settings().relevance_filter_enabled:
+        return True
+    title = news_item.get('title', "")
+    relevant, score = get_relevance_classifier().is_relevant(title, news_item.get('summary') or news_item.get('description', ""))
+    if not relevant:
+        logger.info(f"Новость \"{title}\" отфильтрована как нерелевантная (оценка {score:.2f}).")
+    return relevant
+
+async def process_and_post_news(bot: Bot, news_item: dict) -> bool:
+    """Обрабатывает одну новость и постит ее во все каналы, где она еще не публиковалась.
+
+    Вся обработка идет в отдельной трассе (см. app.utils.tracing) со спаном на каждый этап.
+
+    Returns:
+        True, если пост был опубликован хотя бы в одном канале.
+    """
+    extra = {"dry_run": True} if _dry_run_posts.get() is not None else {}
+    with start_trace("process_and_post_news", link=news_item.get('link', ""), title=news_item.get('title', ""), **extra) as root:
+        with track_post_usage() as usage:
+            posted = await _process_and_post_news(bot, news_item)
+        root.set(posted=posted, llm_calls=usage.calls, llm_tokens=usage.total_tokens, llm_cost=round(usage.cost, 6))
+        if usage.calls:
+            logger.info(
+                f"Расход LLM на новость \"{news_item.get('title', '')}\": {usage.calls} запр., "
+                f"{usage.prompt_tokens} (из них из кэша {usage.cached_tokens}) + {usage.completion_tokens} токенов, ${usage.cost:.5f}."
+            )
+        return posted
+
+async def _process_and_post_news(bot: Bot, news_item: dict) -> bool:
     title = news_item.get('title', "Без заголовка")
     link = news_item.get('link', "")
     summary_from_rss = news_item.get('summary') or news_item.get('description', "")
 
     if not link: # Если нет ссылки, мы не можем отследить уникальность
         logger.warning(f"Новость \"{title}\" не имеет ссылки, пропускаем.")
-        return
+        return False
 
-    if link in POSTED_NEWS_LINKS:
-        logger.info(f"Новость \"{title}\" ({link}) уже была опубликована, пропускаем.")
-        return
+    # Каналы, подписанные на ленту этой новости и еще не публиковавшие ее
+    # (в теневом режиме - все подписанные: важно увидеть, каким получился бы пост)
+    channel_registry = get_channel_registry()
+    if _dry_run_posts.get() is not None:
+        targets = [channel for channel in channel_registry if channel.accepts(news_item)]
+    else:
+        targets = channel_registry.pending_channels(news_item)
+    if not targets:
+        logger.info(f"Новость \"{title}\" ({link}) уже была опубликована во всех каналах, пропускаем.")
+        DEDUPE_HITS.inc(where="posted")
+        return False
+
+    # Запись из сюжета нескольких лент: пост строится по самой полной записи сюжета
+    # (из лент, на которые подписаны все каналы-получатели), остальные идут модели как источники
+    clusterer = get_story_clusterer()
+    story = clusterer.story_for(link) if clusterer is not None else None
+    related: List[Any] = []
+    if story and len(story.members) > 1:
+        news_item = story.representative(eligible=lambda member: all(c.accepts(member) for c in targets))
+        related = [member for member in story.members if member is not news_item]
+        title = news_item.get('title', "Без заголовка")
+        link = news_item.get('link', "")
+        summary_from_rss = news_item.get('summary') or news_item.get('description', "")
+        logger.info(f"Новость \"{title}\" публикуется как сюжет из {len(story.members)} записей разных лент.")
+    related_sources = [
+        {"title": member.get('title', ""), "source": member.get('feed_source_url'), "excerpt": entry_lead(member)}
+        for member in related
+    ]
+
+    # Отсекаем нерелевантные новости до загрузки статьи и обращения к AI
+    with span("relevance") as s:
+        relevant = is_relevant_news(news_item)
+        s.set(relevant=relevant)
+    if not relevant:
+        return False
 
     logger.info(f"Получена новая новость для постинга: \"{title}\". ({link})")
     
-    # Attempt to fetch full article content from the web page
-    fetched_full_content = None
-    if link: # Ensure we have a link to fetch
-        fetched_full_content = await fetch_article_content(link, http_session)
-        if fetched_full_content:
-            logger.info(f"Успешно извлечено полное содержимое для новости: {title[:50]}...")
-        else:
-            logger.warning(f"Не удалось извлечь полное содержимое для новости: {title[:50]}... Будет использовано краткое описание из RSS.")
-    
-    # Use fetched full content if available, otherwise fall back to RSS summary/content
-    # The existing logic for 'full_content' from RSS feed's 'content' field can be a secondary fallback
-    content_from_rss_detail = news_item.get('content')
-    rss_full_content_value = None
-    if content_from_rss_detail and isinstance(content_from_rss_detail, list) and len(content_from_rss_detail) > 0:
-        rss_full_content_value = content_from_rss_detail[0].get('value')
+    # Текст статьи берется с самого дешевого подходящего уровня: содержимое ленты,
+    # загруженное другим экземпляром, метаданные страницы и только затем readability
+    with span("article_fetch") as s:
+        # При работе нескольких экземпляров статью мог заранее загрузить узел-владелец ссылки
+        coordinator = get_coordinator()
+        article = await get_article_content(
+            news_item, prefetched=coordinator.get_content if coordinator else None
+        )
+        s.set(tier=article.tier if article else "none", chars=len(article.content if article else ""))
+    if article:
+        logger.info(f"Извлечено содержимое для новости ({article.tier}): {title[:50]}...")
+    else:
+        logger.warning(f"Не удалось извлечь полное содержимое для новости: {title[:50]}... Будет использовано краткое описание из RSS.")
+
+    # Запасные варианты: поле content из RSS, затем краткое описание
+    rss_full_content_value = entry_content(news_item)
 
-    # Priority: 1. Fetched full content, 2. RSS full content field, 3. RSS summary
-    final_content_for_ai = fetched_full_content or rss_full_content_value or summary_from_rss
+    final_content_for_ai = (article.content if article else None) or rss_full_content_value or summary_from_rss
 
     # Get publication date and source for the AI
     publication_date = get_entry_published_datetime(news_item)
     if not publication_date:
         logger.warning(f"Не удалось определить дату публикации для новости '{title}'. Используем текущую дату.")
-        publication_date = datetime.now() # Fallback to current date
+        publication_date = datetime.now(timezone.utc) # Fallback to current date
 
     source_info = news_item.get('feed_source_url') # This was added in rss_service
     if not source_info:
@@ -116,86 +260,362 @@ async def process_and_post_news(bot: Bot, news_item: dict, http_session: aiohttp
                 rss_image_url = enclosure.href
                 break
 
-    ai_result = await ai_service.reformat_news_for_channel(
-        news_title=title,
-        news_summary=summary_from_rss, # We can still pass the original summary for context if AI needs it
-        news_link=link,
-        news_content=final_content_for_ai, # Pass the potentially richer content
-        publication_date=publication_date, # Pass the publication date
-        source_name=source_info           # Pass the source information
+    # Статья загружена и разобрана один раз; текст генерируется один раз на стиль (промпт),
+    # а публикуется в каждый канал группы
+    posted_any = False
+    for channels in group_by_style(targets):
+        style_channels = ", ".join(c.name for c in channels)
+        with span("llm_reformat", input_chars=len(final_content_for_ai or ""), channels=style_channels, sources=1 + len(related)) as s:
+            ai_result = await ai_service.reformat_news_for_channel(
+                news_title=title,
+                news_summary=summary_from_rss, # We can still pass the original summary for context if AI needs it
+                news_link=link,
+                news_content=final_content_for_ai, # Pass the potentially richer content
+                publication_date=publication_date, # Pass the publication date
+                source_name=source_info,          # Pass the source information
+                system_prompt=channels[0].prompt, # Промпт (стиль) каналов группы
+                related_sources=related_sources
+            )
+            s.set(ok=bool(ai_result))
+
+        if not ai_result:
+            logger.error(f"Не удалось обработать новость \"{title}\" с помощью AI для каналов: {style_channels}. Пропускаем.")
+            continue
+
+        formatted_text, image_prompt = ai_result
+        images: Dict[str, Optional[str]] = {} # Политика изображений -> URL, чтобы не генерировать картинку дважды
+        for channel in channels:
+            if await _post_to_channel(bot, channel, news_item, formatted_text, image_prompt, images):
+                posted_any = True
+                if _dry_run_posts.get() is None:
+                    # Ссылки остальных записей сюжета тоже опубликованы: после перезапуска их не перепостить
+                    for member in related:
+                        if member.get('link'):
+                            channel_registry.mark_posted(channel, member['link'])
+    if story and posted_any and _dry_run_posts.get() is None:
+        story.posted = True
+    return posted_any
+
+async def _post_to_channel(
+    bot: Bot,
+    channel: Channel,
+    news_item: dict,
+    formatted_text: str,
+    image_prompt: str,
+    images: Dict[str, Optional[str]],
+) -> bool:
+    """Выбирает изображение по политике канала и публикует готовый текст в канал."""
+    title = news_item.get('title', "Без заголовка")
+    dry_run_posts = _dry_run_posts.get()
+    policy = channel.image_source_priority
+    if dry_run_posts is not None:
+        policy = _DRY_RUN_IMAGE_POLICY.get(policy, policy)
+    if policy not in images:
+        with span("image", channel=channel.name) as s:
+            images[policy] = await get_final_image_url(news_item, image_prompt, policy)
+            s.set(has_image=bool(images[policy]))
+
+    if dry_run_posts is not None:
+        dry_run_posts.append({
+            "channel": channel.name,
+            "chat_id": channel.chat_id,
+            "title": title,
+            "link": news_item['link'],
+            "text": formatted_text,
+            "image_url": images[policy],
+            "image_prompt": image_prompt,
+        })
+        return True
+
+    throttle = _post_throttle.get()
+    if throttle is not None:
+        await throttle.wait(channel.name)
+
+    # Захват перед отправкой: другой экземпляр бота не опубликует эту же новость в канал
+    coordinator = get_coordinator()
+    if coordinator and not coordinator.claim(channel.name, news_item['link']):
+        logger.info(f"Новость \"{title}\" уже публикуется в канал {channel.name} другим экземпляром, пропускаем.")
+        DEDUPE_HITS.inc(where="claim")
+        return False
+
+    logger.info(f"Публикую пост \"{title}\" в канал {channel.name}...")
+    with span("telegram_send", channel=channel.name) as s:
+        success = await telegram_service.post_to_channel(
+            bot=bot,
+            text=formatted_text,
+            image_url=images[policy],
+            chat_id=channel.chat_id
+        )
+        s.set(ok=success)
+
+    if success:
+        logger.info(f"Пост \"{title}\" успешно опубликован в канале {channel.name}!")
+        get_channel_registry().mark_posted(channel, news_item['link']) # Дубли учитываются отдельно по каналам
+        POSTS.inc(channel=channel.name)
+        get_runtime_state().record_post(channel.name, title)
+    else:
+        logger.error(f"Не удалось опубликовать пост \"{title}\" в канале {channel.name}.")
+        if coordinator:
+            coordinator.release_claim(channel.name, news_item['link'])
+    return success
+
+
+async def ingest_job(only_due: bool = True, shared: bool = True) -> int:
+    """Задание сбора новостей: опрашивает ленты и кладет новые записи в очередь кандидатов.
+
+    При работе нескольких экземпляров (COORDINATION_DB) и shared=True узел опрашивает
+    только свои ленты (по консистентному хешу) и кладет записи в общую таблицу
+    кандидатов, откуда их забирает публикатор.
+
+    Returns:
+        Количество добавленных в очередь записей.
+    """
+    logger.info("Сбор новостей: опрос RSS-лент...")
+    # Ленты всех каналов опрашиваются одним проходом, общие ленты - один раз
+    feeds = get_channel_registry().feeds()
+    coordinator = get_coordinator() if shared else None
+    if coordinator:
+        feeds = coordinator.owned(feeds)
+        if not feeds:
+            logger.info(f"Сбор новостей: узлу {coordinator.node_id} не досталось ни одной ленты.")
+            return 0
+    entries = await rss_service.fetch_feed_entries(only_due=only_due, feeds=feeds, conditional=True)
+    relevant_entries = [entry for entry in entries if is_relevant_news(entry)]
+    if coordinator:
+        fresh_entries = [entry for entry in relevant_entries if not is_link_posted(entry.get('link', ""))]
+        added = coordinator.add_candidates(fresh_entries)
+        DEDUPE_HITS.inc(len(relevant_entries) - added, where="queue")
+        get_runtime_state().record_ingest(added)
+        logger.info(f"Сбор новостей: в общую очередь добавлено {added} из {len(entries)} записей ({len(feeds)} лент узла).")
+        return added
+    added = enqueue_candidates(relevant_entries)
+    get_runtime_state().record_ingest(added)
+    logger.info(f"Сбор новостей: добавлено {added} из {len(entries)} записей, в очереди {len(get_candidate_queue())}.")
+    return added
+
+def enqueue_candidates(entries: List[Any]) -> int:
+    """Кладет записи в очередь кандидатов, склеивая записи об одном событии в сюжеты.
+
+    Запись уже известного сюжета в очередь не попадает, если сюжет уже ждет публикации
+    или опубликован: она только пополняет сюжет (см. app.services.story_clustering).
+
+    Returns:
+        Количество добавленных в очередь записей.
+    """
+    candidate_queue = get_candidate_queue()
+    clusterer = get_story_clusterer()
+    added = 0
+    for entry in entries:
+        link = entry.get('link')
+        if clusterer is not None and link and link not in clusterer:
+            story, is_new = clusterer.add(entry)
+            if not is_new and (story.posted or story.queued_link in candidate_queue):
+                DEDUPE_HITS.inc(where="story")
+                continue
+            story.queued_link = link # Новый сюжет или сюжет, выпавший из очереди без публикации
+        if candidate_queue.push(entry):
+            added += 1
+        else:
+            DEDUPE_HITS.inc(where="queue")
+    return added
+
+async def publish_next(bot: Bot) -> bool:
+    """Забирает из очереди лучшего кандидата и публикует его.
+
+    Если кандидат не опубликован (ошибка AI или Telegram), пробует следующий,
+    но не более PUBLISH_MAX_ATTEMPTS раз за вызов.
+    """
+    candidate_queue = get_candidate_queue()
+    channel_registry = get_channel_registry()
+    attempts = 0
+    while attempts < PUBLISH_MAX_ATTEMPTS:
+        news_item = candidate_queue.pop_best()
+        if news_item is None:
+            logger.info("Публикатор: очередь кандидатов пуста.")
+            return False
+        if not channel_registry.pending_channels(news_item):
+            DEDUPE_HITS.inc(where="posted") # Уже опубликована во всех своих каналах: не считаем попыткой
+            continue
+        attempts += 1
+        try:
+            if await process_and_post_news(bot, news_item):
+                return True
+        except Exception as e:
+            title_for_log = news_item.get('title', 'N/A')
+            logger.error(f"Ошибка при обработке новости \"{title_for_log}\" в publish_next: {e}", exc_info=True)
+    return False
+
+def pull_shared_candidates() -> int:
+    """Публикатор: переносит кандидатов из общей таблицы в свою очередь и просит загрузить лучшие статьи."""
+    coordinator = get_coordinator()
+    if not coordinator or not coordinator.is_leader:
+        return 0
+    candidate_queue = get_candidate_queue()
+    added = enqueue_candidates(coordinator.pull_candidates())
+    # Статьи с достаточным текстом в ленте загружать заранее незачем
+    coordinator.want_content([
+        entry.get('link') for entry in candidate_queue.peek(PREFETCH_LOOKAHEAD) if not extract_from_feed(entry)
+    ])
+    return added
+
+async def publish_job(bot: Bot):
+    """Задание публикатора: публикует одну лучшую новость из очереди с учетом тихих часов.
+
+    После простоя дольше CATCHUP_AFTER_MINUTES вместо одной новости запускается
+    догоняющий режим (app/catch_up.py) с отчетом администратору.
+    """
+    from app.catch_up import get_catch_up_state, run_catch_up_for_admin # Импорт здесь: app.catch_up импортирует этот модуль
+
+    coordinator = get_coordinator()
+    if coordinator and not coordinator.is_leader:
+        logger.debug(f"Публикатор: узел {coordinator.node_id} не лидер, публикацией занимается другой экземпляр.")
+        return
+    pull_shared_candidates()
+    catch_up_state = get_catch_up_state()
+    catch_up_state.record_run() # В том числе в тихие часы: ночная пауза простоем не считается
+    if get_token_ledger().exhausted():
+        logger.info(f"Публикатор: дневной бюджет LLM исчерпан, публикация отложена. В очереди {len(get_candidate_queue())}.")
+        return
+    if in_quiet_hours():
+        logger.info(
+            f"Публикатор: тихие часы ({get_settings().quiet_hours}), публикация отложена. "
+            f"В очереди {len(get_candidate_queue())}."
+        )
+        return
+    if catch_up_state.pending_since is not None:
+        await run_catch_up_for_admin(bot)
+        return
+    await publish_next(bot)
+
+def autopost_intervals() -> Tuple[int, int]:
+    """Интервалы (в минутах) задачи сбора и задачи публикации."""
+    # Сбор запускается часто (тик), но каждая лента опрашивается по своему адаптивному расписанию
+    settings = get_settings()
+    ingest_minutes = max(1, min(settings.posting_interval_minutes, settings.feed_poll_tick_minutes))
+    publish_minutes = max(1, settings.publish_interval_minutes)
+    return ingest_minutes, publish_minutes
+
+def register_autopost_jobs(scheduler, bot: Bot) -> Tuple[int, int]:
+    """Регистрирует задачи сбора и публикации в APScheduler.
+
+    Returns:
+        Интервалы (в минутах) задачи сбора и задачи публикации.
+    """
+    ingest_minutes, publish_minutes = autopost_intervals()
+    scheduler.add_job(
+        ingest_job,
+        'interval',
+        minutes=ingest_minutes,
+        id=INGEST_JOB_ID,
+        name="Feed Ingestion",
+        replace_existing=True,
+        next_run_time=datetime.now(timezone.utc), # Первый сбор сразу, чтобы очередь не пустовала
     )
-    
-    if not ai_result:
-        logger.error(f"Не удалось обработать новость \"{title}\" с помощью AI. Пропускаем.")
+    scheduler.add_job(
+        publish_job,
+        'interval',
+        minutes=publish_minutes,
+        args=[bot],
+        id=PUBLISH_JOB_ID,
+        name="Scheduled News Posting",
+        replace_existing=True,
+    )
+    return ingest_minutes, publish_minutes
+
+def remove_autopost_jobs(scheduler) -> bool:
+    """Удаляет задачи автопостинга. Возвращает True, если хотя бы одна была активна."""
+    removed = False
+    for job_id in AUTOPOST_JOB_IDS:
+        if scheduler.get_job(job_id):
+            scheduler.remove_job(job_id)
+            removed = True
+    return removed
+
+async def coordination_job(scheduler, bot: Bot) -> None:
+    """Тик координации нескольких экземпляров.
+
+    Heartbeat и аренда публикатора, синхронизация задач автопостинга с общим флагом
+    (/start_autopost на любом экземпляре включает его на всех), перенос кандидатов
+    лидером и предварительная загрузка запрошенных лидером статей, принадлежащих этому узлу.
+    """
+    coordinator = get_coordinator()
+    if coordinator is None:
         return
-        
-    formatted_text, image_prompt = ai_result
-    # final_image_url_to_post = rss_image_url # <--- Старая логика
-
-    # # Если картинки из RSS нет, ИЛИ если мы хотим всегда генерировать новую через DALL-E (можно сделать опционально)
-    # # Сейчас: если нет из RSS, но есть промпт от AI и DALL-E настроен, генерируем.
-    # if not final_image_url_to_post and image_prompt and OPENAI_IMAGE_MODEL:
-    #     logger.info(f"Генерирую изображение для поста \"{title}\" (промпт: {image_prompt[:100]}...)")
-    #     generated_dalle_url = await ai_service.generate_image_with_dalle(image_prompt)
-    #     if generated_dalle_url:
-    #         final_image_url_to_post = generated_dalle_url
-    #         logger.info(f"Изображение для \"{title}\" сгенерировано.")
-    #     else:
-    #         logger.warning(f"Не удалось сгенерировать изображение для \"{title}\". Пост будет без картинки от DALL-E.")
-    # elif rss_image_url:
-    #      logger.info(f"Использую изображение из RSS-ленты для \"{title}\".")
-    # else:
-    #     logger.info(f"Изображение для поста \"{title}\" не найдено и не будет сгенерировано.")
-
-    # Новая логика выбора изображения
-    final_image_url_to_post = await get_final_image_url(news_item, image_prompt)
-
-    logger.info(f"Публикую пост \"{title}\" в канал...")
-    
-    success = await telegram_service.post_to_channel(
-        bot=bot, 
-        text=formatted_text, 
-        image_url=final_image_url_to_post
+    is_leader = coordinator.tick()
+    get_runtime_state().coordination = coordinator.stats() # Для /status без запросов к базе
+
+    autopost = coordinator.get_flag(AUTOPOST_FLAG)
+    if autopost and not scheduler.get_job(PUBLISH_JOB_ID):
+        register_autopost_jobs(scheduler, bot)
+        logger.info(f"Узел {coordinator.node_id}: автопостинг включен (общий флаг).")
+    elif autopost is False and remove_autopost_jobs(scheduler):
+        logger.info(f"Узел {coordinator.node_id}: автопостинг выключен (общий флаг).")
+
+    if is_leader:
+        pull_shared_candidates()
+        coordinator.prune_candidates(get_settings().queue_max_age_hours * 3600)
+
+    links = coordinator.wanted_links()
+    if links:
+        # Статьи загружаются параллельно; очередь к каждому хосту соблюдает http_fetcher
+        contents = await asyncio.gather(*(fetch_article_content(link) for link in links))
+        for link, content in zip(links, contents):
+            coordinator.store_content(link, content)
+        logger.info(f"Узел {coordinator.node_id}: заранее загружено статей: {len(links)}.")
+
+def register_coordination_job(scheduler, bot: Bot) -> bool:
+    """Регистрирует тик координации, если задан COORDINATION_DB. Возвращает True, если задача добавлена."""
+    coordinator = get_coordinator()
+    if coordinator is None:
+        return False
+    scheduler.add_job(
+        coordination_job,
+        'interval',
+        seconds=max(1.0, coordinator.lease_seconds / 3), # Аренда продлевается с запасом
+        args=[scheduler, bot],
+        id=COORDINATION_JOB_ID,
+        name="Coordination",
+        replace_existing=True,
+        max_instances=1,
+        next_run_time=datetime.now(timezone.utc),
     )
-    
-    if success:
-        logger.info(f"Пост \"{title}\" успешно опубликован в канале!")
-        save_posted_link(link) # <--- Сохраняем ссылку после успешного поста
-    else:
-        logger.error(f"Не удалось опубликовать пост \"{title}\" в канале.")
+    return True
 
+async def scheduled_post_job(
+    bot: Bot,
+    max_posts: int = 5,
+    only_due: bool = True,
+    progress: Optional[Callable[[str], Awaitable[None]]] = None,
+):
+    """Полный цикл без пейсинга: собрать новости и сразу опубликовать до max_posts лучших.
 
-async def scheduled_post_job(bot: Bot):
-    """Задание, выполняемое планировщиком для постинга новостей."""
-    # load_posted_links() # Можно и здесь, если нужна перезагрузка при каждом запуске задачи, но лучше при старте модуля
-    logger.info("Запуск задачи по расписанию: проверка новых новостей...")
-    
-    # Мы можем получать несколько последних новостей и обрабатывать их все
-    # Это полезно, если RSS-лента обновляется часто, а бот проверяет реже
-    latest_news_items = await rss_service.get_latest_news(count=5) # Берем, например, 5 последних
-    
-    if not latest_news_items:
+    Используется для ручного постинга (/post_now); в режиме автопостинга сбор и
+    публикация выполняются раздельно задачами ingest_job и publish_job.
+
+    Args:
+        progress: Необязательный колбэк для сообщений о ходе выполнения (например, администратору).
+    """
+    async def report(text: str) -> None:
+        if progress is not None:
+            await progress(text)
+
+    logger.info("Запуск полного цикла: проверка новых новостей и публикация...")
+    await report("Сбор новостей из RSS-лент... ⏳")
+    # Ручной цикл опрашивает все ленты сам, даже при нескольких экземплярах: от двойной
+    # публикации защищает захват (канал, ссылка) перед отправкой
+    added = await ingest_job(only_due=only_due, shared=False)
+
+    if not len(get_candidate_queue()):
         logger.info("Планировщик: Свежие новости в RSS-ленте не найдены.")
+        await report("Свежих новостей не найдено.")
         return
+    await report(f"Новых записей: {added}, в очереди: {len(get_candidate_queue())}. Публикую... ⏳")
 
-    # Новости в RSS обычно идут от новых к старым.
-    # Чтобы постить в хронологическом порядке (старые сначала, если их несколько новых),
-    # можно их развернуть. Но для постинга одной самой свежей это не нужно.
-    # Если мы обрабатываем несколько, и хотим постить самую новую из пачки, то первая и так самая новая.
-    # Если же мы хотим опубликовать все 5 (если они новые), то лучше их развернуть.
-    # Для текущей задачи, мы будем обрабатывать каждую из 5 новостей,
-    # и функция process_and_post_news сама проверит, была ли она уже опубликована.
-    
-    # Create aiohttp.ClientSession here to reuse for all articles in this job run
-    async with aiohttp.ClientSession() as http_session:
-        processed_count = 0
-        for news_item in reversed(latest_news_items): # Обрабатываем от старых к новым из полученной пачки
-            try:
-                # Pass the session to process_and_post_news
-                await process_and_post_news(bot, news_item, http_session)
-                processed_count += 1
-            except Exception as e:
-                title_for_log = news_item.get('title', 'N/A')
-                logger.error(f"Ошибка при обработке новости \"{title_for_log}\" в scheduled_post_job: {e}", exc_info=True)
-        
-        logger.info(f"Планировщик: завершил проверку новостей. Обработано {processed_count} элементов.") 
\ No newline at end of file
+    published_count = 0
+    for _ in range(max_posts):
+        if not await publish_next(bot):
+            break
+        published_count += 1
+        await report(f"Опубликовано {published_count} из {max_posts}...")
+    logger.info(f"Планировщик: завершил проверку новостей. Опубликовано {published_count} постов.")
+    await report(f"Готово. Опубликовано постов: {published_count}.")
@@ -1,26 +1,16 @@
-import openai
 import logging
-from typing import Optional, Tuple
-import requests # Added for OpenRouter
-import json     # Added for OpenRouter
-import asyncio  # Moved import to top
-import httpx # Добавили httpx
+from typing import Callable, Optional, Tuple
 import re # For HTML cleaning
+import time
 import html # For HTML cleaning
-from datetime import datetime # For build_messages
-from bs4 import BeautifulSoup # For extracting excerpt from HTML
-
-from app.config import (
-    OPENAI_API_KEY, 
-    OPENAI_IMAGE_MODEL,
-    AI_PROVIDER,
-    OPENROUTER_API_KEY,
-    OPENROUTER_CHAT_MODEL,
-    OPENROUTER_SITE_URL,
-    OPENROUTER_SITE_NAME,
-    PROXY_URL,
-    OPENAI_CHAT_MODEL
-)
+from datetime import datetime, timedelta, timezone # For build_messages
+
+from app.config import get_settings
+from app.services.llm_fixtures import get_llm_recorder
+from app.services.llm_usage import count_message_tokens, count_tokens, get_token_ledger
+from app.utils.metrics import FAILURES, RECENT_LATENCY, STAGE_LATENCY, track_stage
+from app.utils.partial_json import parse_partial_json
+from app.utils.tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -90,15 +80,32 @@ def clean_for_tg_html(raw_html: str) -> str:
     return text.strip()
 
 
-# Инициализация http клиента с учетом прокси (если он задан)
-proxies_config = {"http://": PROXY_URL, "https://": PROXY_URL} if PROXY_URL else None
-if proxies_config:
-    httpx_client = httpx.AsyncClient(proxies=proxies_config)
-else:
-    httpx_client = httpx.AsyncClient()
-
-if OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
+# Глобальные клиенты создаются лениво, при первом обращении к AI, а не при импорте модуля.
+# httpx и openai тоже импортируются только здесь: это заметно ускоряет старт бота.
+_httpx_client = None
+_openai_client = None
+
+def get_httpx_client():
+    """Возвращает общий httpx.AsyncClient (с прокси, если он задан), создавая его при первом вызове."""
+    global _httpx_client
+    if _httpx_client is None or _httpx_client.is_closed:
+        import httpx
+        proxy_url = get_settings().proxy_url
+        _httpx_client = httpx.AsyncClient(proxy=proxy_url or None, timeout=60.0)
+    return _httpx_client
+
+def get_openai_client():
+    """Возвращает общий openai.AsyncOpenAI, работающий поверх общего httpx клиента."""
+    global _openai_client
+    if _openai_client is None or _openai_client._client.is_closed:
+        import openai
+        settings = get_settings()
+        _openai_client = openai.AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url or None,
+            http_client=get_httpx_client(),
+        )
+    return _openai_client
 
 # --- New Unified Prompt and Helper Functions ---
 
@@ -124,17 +131,67 @@ about AI and prompt-engineering.
 5. Пиши всегда на русском, даже если исходник другой.
 """
 
-def build_messages(news_title: str, excerpt: str, publication_date: datetime, source_name: str) -> list[dict]:
-    """Prepares the list of messages for the AI model based on the new unified prompt structure."""
+# The same rules as UNIFIED_PROMPT, but the model returns the parts of the post as JSON
+# and the Telegram HTML is rendered locally (see render_structured_post)
+STRUCTURED_PROMPT = \
+"""
+You are a professional Russian copy-writer for a Telegram channel
+about AI and prompt-engineering.
+
+== OUTPUT ==
+Reply with a single JSON object and nothing else:
+{"title": "...", "teaser": "...", "body": "...", "hashtags": ["...", "..."], "image_prompt": "..."}
+
+- title: короткий заголовок ≤ 70 символов, без точки в конце, без эмодзи
+- teaser: 2-3 предложения, цепляющих читателя
+- body: что полезного, кто/зачем, без лишних деталей
+- hashtags: 3-5 штук в CamelCase, без «#»
+- image_prompt: one English sentence describing an illustration for the post
+
+== RULES ==
+1. title, teaser, body and hashtags together: MAX 800 characters.
+2. Plain text; inside teaser and body ONLY tags <b>, <i>, <u>, <s> are allowed. No other tags, no links.
+3. Пиши всегда на русском (кроме image_prompt), даже если исходник другой.
+"""
+# JSON keys and the image prompt on top of the post text
+STRUCTURED_EXTRA_TOKENS = 120
+
+# Other outlets' takes on the same story (story clustering) passed along with the main excerpt
+MAX_RELATED_SOURCES = 4
+RELATED_EXCERPT_CHARS = 300
+
+def build_messages(
+    news_title: str,
+    excerpt: str,
+    publication_date: datetime,
+    source_name: str,
+    system_prompt: str | None = None,
+    related_sources: list[dict] | None = None,
+) -> list[dict]:
+    """Prepares the list of messages for the AI model. system_prompt overrides UNIFIED_PROMPT (per-channel style).
+
+    Everything static (the system prompt) comes first and everything that varies per news item
+    goes into the last message, so consecutive calls share the longest possible prefix and
+    providers can serve it from their prompt cache. The excerpt is capped at 1200 chars to save tokens.
+
+    related_sources are other feeds' entries about the same event ({"title", "source", "excerpt"});
+    the model gets them in the same call to write one consolidated post.
+    """
     user_msg_content = f"""
 Заголовок: {news_title}
 Источник: {source_name}
 Дата: {publication_date.strftime('%Y-%m-%d')}
-Текст: {excerpt[:1200]}   # передаём не больше, чтобы не тратить токены
+Текст: {excerpt[:1200]}
 """
+    if related_sources:
+        lines = [
+            f"- {item.get('source') or 'Неизвестный источник'}: {item.get('title', '')}. {(item.get('excerpt') or '')[:RELATED_EXCERPT_CHARS]}"
+            for item in related_sources[:MAX_RELATED_SOURCES]
+        ]
+        user_msg_content += "\nЭто же событие в других источниках (сведи факты в один пост):\n" + "\n".join(lines) + "\n"
     return [
-        {"role": "system", "content": UNIFIED_PROMPT},
-        {"role": "user",   "content": user_msg_msg_content.strip()},
+        {"role": "system", "content": system_prompt or UNIFIED_PROMPT},
+        {"role": "user",   "content": user_msg_content.strip()},
     ]
 
 def balance_specific_tag(text: str, tag_name: str) -> str:
@@ -174,109 +231,251 @@ def sanitize_ai_response(text: str) -> str:
     # Final truncation
     return text[:900]
 
-async def _generate_post_from_llm(messages: list) -> str | None:
+# Local checks of a generated post against the UNIFIED_PROMPT rules (see validate_post)
+MAX_POST_CHARS = 900
+MAX_TITLE_CHARS = 70
+MIN_HASHTAGS, MAX_HASHTAGS = 3, 5
+ALLOWED_TAGS = {"b", "i", "u", "s"}
+MIN_CYRILLIC_SHARE = 0.5 # Product names stay in Latin, so the bar is a majority, not all letters
+_HTML_TAG_RE = re.compile(r"<\s*/?\s*([a-zA-Z][\w-]*)[^>]*>")
+_HASHTAG_RE = re.compile(r"#\w+")
+_TITLE_PREFIX_RE = re.compile(r"^[^\w\[«\"]*(\[RETRO\]\s*)?", re.IGNORECASE)
+
+def validate_post(text: str, strict: bool = True) -> list[str]:
+    """Checks raw model output against the UNIFIED_PROMPT rules. Returns the problems found (empty if the post is fine).
+
+    Length and tags are checked always. strict adds the rules of the unified format: Russian text,
+    a bold title of at most 70 symbols without a trailing period, 3-5 #CamelCase hashtags.
+    Channel-specific prompts define their own format, so they are validated with strict=False.
+    """
+    problems = []
+    if len(text) > MAX_POST_CHARS:
+        problems.append(f"too long: {len(text)} chars")
+    forbidden = sorted({name.lower() for name in _HTML_TAG_RE.findall(text)} - ALLOWED_TAGS)
+    if forbidden:
+        problems.append(f"forbidden tags: {', '.join(forbidden)}")
+    if not strict:
+        return problems
+
+    plain = html.unescape(_HTML_TAG_RE.sub("", text))
+    letters = [c for c in _HASHTAG_RE.sub("", plain) if c.isalpha()]
+    cyrillic = sum(1 for c in letters if "а" <= c.lower() <= "я" or c in "ёЁ")
+    if not letters or cyrillic / len(letters) < MIN_CYRILLIC_SHARE:
+        problems.append("not in Russian")
+
+    title_line = next((line.strip() for line in text.splitlines() if line.strip()), "")
+    title = _TITLE_PREFIX_RE.sub("", html.unescape(_HTML_TAG_RE.sub("", title_line)).strip(), count=1)
+    if not title_line.lower().startswith("<b>"):
+        problems.append("title is not bold")
+    if len(title) > MAX_TITLE_CHARS:
+        problems.append(f"title too long: {len(title)} chars")
+    if title.endswith("."):
+        problems.append("title ends with a period")
+
+    hashtags = _HASHTAG_RE.findall(plain)
+    if not MIN_HASHTAGS <= len(hashtags) <= MAX_HASHTAGS:
+        problems.append(f"{len(hashtags)} hashtags")
+    elif any(not (tag[1].isupper() or tag[1].isdigit()) for tag in hashtags):
+        problems.append("hashtags are not CamelCase")
+    return problems
+
+# --- Structured output (STRUCTURED_PROMPT) rendered into the UNIFIED_PROMPT format ---
+RETRO_AFTER_DAYS = 3
+_ESCAPED_ALLOWED_TAG_RE = re.compile(r"&lt;(/?)(b|i|u|s)&gt;", re.IGNORECASE)
+_SENTENCE_END_RE = re.compile(r"[.!?…](?=\s)")
+_COMPLETE_TEXT_RE = re.compile(r"[.!?…»\")]\s*(</[bius]>\s*)*$")
+
+def parse_structured_post(raw: str | None) -> dict | None:
+    """Parses the model's JSON reply (tolerating fences, trailing commas and truncation). None if it has no title and text."""
+    fields = parse_partial_json(raw)
+    if not isinstance(fields, dict):
+        return None
+    if not _field_text(fields.get("title")) or not (_field_text(fields.get("teaser")) or _field_text(fields.get("body"))):
+        return None
+    return fields
+
+def _field_text(value) -> str:
+    if isinstance(value, list): # Some models return paragraphs as a list
+        return "\n\n".join(_field_text(item) for item in value if _field_text(item))
+    return str(value).strip() if value is not None else ""
+
+def _inline_html(text: str) -> str:
+    """Escapes text for Telegram HTML, keeping only the <b>, <i>, <u>, <s> tags."""
+    text = _ESCAPED_ALLOWED_TAG_RE.sub(lambda m: f"<{m.group(1)}{m.group(2).lower()}>", html.escape(text, quote=False))
+    for tag in ALLOWED_TAGS:
+        text = balance_specific_tag(text, tag)
+    return text
+
+def _trim_html(text: str, limit: int) -> str:
+    """Shortens escaped text to limit chars, preferably at a sentence end, without cutting tags or entities."""
+    if len(text) <= limit:
+        return text
+    cut = text[:max(0, limit - 1 - len("</b></i></u></s>"))]
+    cut = re.sub(r"<[^>]*$|&\w*$", "", cut)
+    sentence_ends = [m.end() for m in _SENTENCE_END_RE.finditer(cut + " ")]
+    if sentence_ends and sentence_ends[-1] > len(cut) // 2:
+        cut = cut[:sentence_ends[-1]]
+    else:
+        cut = cut.rsplit(" ", 1)[0].rstrip(",;:—-") + "…"
+    cut = re.sub(r"<[^>]*$|&\w*$", "", cut)
+    for tag in ALLOWED_TAGS:
+        cut = balance_specific_tag(cut, tag)
+    return cut
+
+def _hashtag(value) -> str:
+    words = re.findall(r"\w+", str(value))
+    return "#" + "".join(word[:1].upper() + word[1:] for word in words) if words else ""
+
+def render_structured_post(fields: dict, publication_date: datetime | None = None) -> str:
+    """Builds the Telegram HTML post of the UNIFIED_PROMPT format from the structured reply.
+
+    The title is plain text cut to 70 chars without a trailing period, «[RETRO] » is added here
+    for news older than 3 days, hashtags get the #CamelCase form (at most 5), and the body
+    (then the teaser) is shortened at a sentence end to fit 900 chars.
+    """
+    title = re.sub(r"\s+", " ", _HTML_TAG_RE.sub("", _field_text(fields.get("title")))).strip().rstrip(".").strip()
+    if len(title) > MAX_TITLE_CHARS:
+        title = title[:MAX_TITLE_CHARS - 1].rsplit(" ", 1)[0].rstrip(",;:—-.") + "…"
+    if publication_date and datetime.now(timezone.utc) - publication_date.astimezone(timezone.utc) > timedelta(days=RETRO_AFTER_DAYS):
+        title = f"[RETRO] {title}"
+    head = f"<b>🤖 {html.escape(title, quote=False)}</b>"
+
+    raw_hashtags = fields.get("hashtags") or []
+    if isinstance(raw_hashtags, str):
+        raw_hashtags = raw_hashtags.split(",") if "," in raw_hashtags else raw_hashtags.split()
+    hashtags = list(dict.fromkeys(tag for tag in map(_hashtag, raw_hashtags) if tag))[:MAX_HASHTAGS]
+    tail = " ".join(hashtags)
+
+    teaser, body = (_inline_html(_field_text(fields.get(name))) for name in ("teaser", "body"))
+    # A reply cut off by max_tokens ends mid-sentence: drop the unfinished sentence
+    teaser, body = (_trim_html(part, len(part) - 1) if part and not _COMPLETE_TEXT_RE.search(part) else part for part in (teaser, body))
+    separators = 2 * (len([part for part in (teaser, body, tail) if part]))
+    available = MAX_POST_CHARS - len(head) - len(tail) - separators
+    if len(teaser) + len(body) > available:
+        body = _trim_html(body, max(0, available - len(teaser))) if len(teaser) < available * 2 // 3 else ""
+        teaser = _trim_html(teaser, available - len(body))
+    return "\n\n".join(part for part in (head, teaser, body, tail) if part)
+
+def _usage_field(obj, name: str):
+    """Reads a field from a usage object (openai model) or dict (raw JSON)."""
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+def record_token_usage(provider: str, model: str, usage, messages: list, response_text: str | None) -> None:
+    """Accounts the call in the token ledger: provider-reported usage, or a local estimate if there is none."""
+    prompt_tokens = _usage_field(usage, "prompt_tokens") if usage else None
+    completion_tokens = _usage_field(usage, "completion_tokens") if usage else None
+    if prompt_tokens is None or completion_tokens is None:
+        prompt_tokens = count_message_tokens(messages, model)
+        completion_tokens = count_tokens(response_text or "", model)
+        logger.debug(f"{provider} returned no usage, tokens estimated locally: {prompt_tokens}+{completion_tokens}")
+    details = _usage_field(usage, "prompt_tokens_details") if usage else None
+    cached_tokens = (_usage_field(details, "cached_tokens") if details else None) or 0
+    get_token_ledger().record(provider, model, prompt_tokens, cached_tokens, completion_tokens)
+
+def with_prompt_cache_hint(messages: list, model: str) -> list:
+    """Marks the system prompt as a cache breakpoint for OpenRouter models that need explicit caching.
+
+    OpenAI-style providers cache long prefixes automatically. Anthropic models behind OpenRouter
+    only cache parts marked with cache_control.
+    """
+    if not model.startswith("anthropic/") or not messages or messages[0].get("role") != "system":
+        return messages
+    system = messages[0]
+    cached_system = {
+        "role": "system",
+        "content": [{"type": "text", "text": system["content"], "cache_control": {"type": "ephemeral"}}],
+    }
+    return [cached_system] + messages[1:]
+
+def _fallback_models() -> list[str]:
+    return [model.strip() for model in get_settings().llm_fallback_models.split(",") if model.strip()]
+
+def _record_fixture(request_body: dict, response_json: Callable[[], dict]) -> None:
+    """Saves the exchange for replay by app.llm_stub when LLM_RECORD_DIR is set."""
+    recorder = get_llm_recorder()
+    if recorder is not None:
+        recorder.record(request_body, response_json())
+
+def _cascade_models() -> list[str]:
+    return [model.strip() for model in get_settings().llm_cascade_models.split(",") if model.strip()]
+
+@track_stage("llm")
+async def _generate_post_from_llm(messages: list, model: str | None = None, json_mode: bool = False) -> str | None:
     """
     Internal function to generate post text from the LLM (OpenAI or OpenRouter).
+    model is set by the cascade (a tier's model); otherwise the daily budget picks it.
+    json_mode requests a JSON object reply (STRUCTURED_PROMPT) and leaves room for its keys.
     """
+    import httpx
+
+    settings = get_settings()
+    ai_provider = settings.ai_provider
     ai_response_text = None
+    if model is not None:
+        if get_token_ledger().exhausted():
+            logger.warning(f"Daily LLM budget is exhausted, the request to {ai_provider} is not sent.")
+            FAILURES.inc(reason="llm_budget")
+            return None
+    else:
+        primary_model = settings.openai_chat_model if ai_provider == "openai" else settings.openrouter_chat_model
+        # The daily budget picks the model: the primary one, a cheaper fallback, or none at all
+        model = get_token_ledger().choose_model(primary_model, _fallback_models())
+        if model is None:
+            logger.warning(f"Daily LLM budget is exhausted, the request to {ai_provider} is not sent.")
+            FAILURES.inc(reason="llm_budget")
+            return None
+        if model != primary_model:
+            logger.info(f"LLM budget is {get_token_ledger().spent_ratio():.0%} spent, using the cheaper model {model}.")
     try:
-        if AI_PROVIDER == "openai":
-            if not OPENAI_API_KEY:
+        if ai_provider == "openai":
+            if not settings.openai_api_key:
                 logger.error("OpenAI API key is not configured.")
                 return None
-            logger.info(f"Sending request to OpenAI model: {OPENAI_CHAT_MODEL}")
-            
-            # Using the openai library
-            # Ensure you have the latest openai library installed and configured
-            # For openai < 1.0
-            # response = await asyncio.to_thread(
-            #     openai.ChatCompletion.create,
-            #     model=OPENAI_CHAT_MODEL,
-            #     messages=messages,
-            #     temperature=0.7, # Adjust as needed
-            #     max_tokens=400  # Max output tokens
-            # )
-            # ai_response_text = response.choices[0].message['content'].strip()
-
-            # For openai >= 1.0.0 (using a client, ideally initialized globally)
-            # temp_openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY) # Should be global or passed
-            # async with temp_openai_client as client:
-            #     response = await client.chat.completions.create(
-            #         model=OPENAI_CHAT_MODEL,
-            #         messages=messages,
-            #         temperature=0.7,
-            #         max_tokens=400 
-            #     )
-            # ai_response_text = response.choices[0].message.content.strip()
-            
-            # Fallback to synchronous version if asyncio version causes issues with httpx_client structure
-            # This is simpler to integrate with the existing httpx_client for OpenRouter
-            # but ideally OpenAI calls would use its own async client.
-            # For now, keeping it simple and similar to OpenRouter flow.
-            
-            payload = {
-                "model": OPENAI_CHAT_MODEL,
+            logger.info(f"Sending request to OpenAI model: {model}")
+
+            request_params = {
+                "model": model,
                 "messages": messages,
                 "temperature": 0.7,
-                "max_tokens": 400
-            }
-            headers = {
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json"
+                "max_tokens": 400 + (STRUCTURED_EXTRA_TOKENS if json_mode else 0),
             }
-            # Note: OpenAI's official Python client is preferred.
-            # Using httpx here for consistency if the main client isn't fully async or for simplicity.
-            # This assumes the OpenAI API endpoint structure.
-            # It's better to use the official openai.AsyncOpenAI() client.
-            # For now, this is a placeholder if we want to use httpx_client for everything.
-            # It will likely require adjustment or using the official OpenAI library directly.
-            #
-            # Given the previous structure and user's code, let's assume a direct openai call is fine.
-            # The user has `openai.api_key = OPENAI_API_KEY` at the top.
-            # We'll use the older `openai.ChatCompletion.create` for now as it's simpler
-            # with the existing top-level API key setup and doesn't require client management here.
-            # If the user has openai >1.0, this will need to be updated.
-            
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,  # Uses default ThreadPoolExecutor
-                lambda: openai.ChatCompletion.create(
-                    model=OPENAI_CHAT_MODEL,
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=400
-                )
-            )
-            ai_response_text = response.choices[0]['message']['content'].strip()
-
+            if json_mode:
+                request_params["response_format"] = {"type": "json_object"}
+            response = await get_openai_client().chat.completions.create(**request_params)
+            if not response.choices or not response.choices[0].message or not response.choices[0].message.content:
+                logger.error(f"OpenAI response missing expected content: {response}")
+                return None
+            ai_response_text = response.choices[0].message.content.strip()
+            record_token_usage(ai_provider, model, response.usage, messages, ai_response_text)
+            _record_fixture(request_params, lambda: response.model_dump(mode="json", exclude_none=True))
 
-        elif AI_PROVIDER == "openrouter":
-            if not OPENROUTER_API_KEY:
+        elif ai_provider == "openrouter":
+            if not settings.openrouter_api_key:
                 logger.error("OpenRouter API key is not configured.")
                 return None
             
-            logger.info(f"Sending request to OpenRouter model: {OPENROUTER_CHAT_MODEL}")
+            logger.info(f"Sending request to OpenRouter model: {model}")
             request_body = {
-                "model": OPENROUTER_CHAT_MODEL,
-                "messages": messages,
-                "max_tokens": 350, # As per user's spec
+                "model": model,
+                "messages": with_prompt_cache_hint(messages, model),
+                "max_tokens": 350 + (STRUCTURED_EXTRA_TOKENS if json_mode else 0), # As per user's spec
                 "temperature": 0.8, # As per user's spec
-                # Add site URL and name if available and model supports it
-                "site_url": OPENROUTER_SITE_URL, 
-                "site_name": OPENROUTER_SITE_NAME,
             }
-            # Filter out None values from request_body for site_url and site_name
-            request_body = {k: v for k, v in request_body.items() if v is not None and v != ""}
-
+            if json_mode:
+                request_body["response_format"] = {"type": "json_object"}
 
             headers = {
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "HTTP-Referer": OPENROUTER_SITE_URL or "", 
-                "X-Title": OPENROUTER_SITE_NAME or "",
+                "Authorization": f"Bearer {settings.openrouter_api_key}",
                 "Content-Type": "application/json"
             }
+            # (Опционально) URL и название сайта для рейтинга OpenRouter
+            if settings.openrouter_site_url:
+                headers["HTTP-Referer"] = settings.openrouter_site_url
+            if settings.openrouter_site_name:
+                headers["X-Title"] = settings.openrouter_site_name
             
-            response = await httpx_client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
+            response = await get_httpx_client().post(
+                f"{settings.openrouter_base_url.rstrip('/')}/chat/completions",
                 json=request_body,
                 headers=headers
             )
@@ -284,46 +483,77 @@ async def _generate_post_from_llm(messages: list) -> str | None:
             data = response.json()
             if data.get("choices") and data["choices"][0].get("message"):
                 ai_response_text = data["choices"][0]["message"]["content"].strip()
+                record_token_usage(ai_provider, model, data.get("usage"), messages, ai_response_text)
+                _record_fixture(request_body, lambda: data)
             else:
                 logger.error(f"OpenRouter response missing expected content: {data}")
                 return None
         else:
-            logger.error(f"Unknown AI_PROVIDER: {AI_PROVIDER}")
+            logger.error(f"Unknown AI_PROVIDER: {ai_provider}")
             return None
 
-        logger.info(f"AI response received successfully from {AI_PROVIDER}.")
+        logger.info(f"AI response received successfully from {ai_provider}.")
         return ai_response_text
 
     except httpx.HTTPStatusError as e:
-        logger.error(f"HTTP error calling {AI_PROVIDER} API: {e.response.status_code} - {e.response.text}", exc_info=False)
+        logger.error(f"HTTP error calling {ai_provider} API: {e.response.status_code} - {e.response.text}", exc_info=False)
+        FAILURES.inc(reason="llm_http")
         return None
     except httpx.RequestError as e:
-        logger.error(f"Request error calling {AI_PROVIDER} API: {e}", exc_info=False)
+        logger.error(f"Request error calling {ai_provider} API: {e}", exc_info=False)
+        FAILURES.inc(reason="llm_http")
         return None
-    except openai.error.OpenAIError as e: # Catch OpenAI specific errors
-        logger.error(f"OpenAI API error: {e}", exc_info=False)
-        return None
-    except Exception as e:
-        logger.error(f"Unexpected error in _generate_post_from_llm with {AI_PROVIDER}: {e}", exc_info=True)
+    except Exception as e: # Including openai.OpenAIError (openai is imported lazily)
+        logger.error(f"Unexpected error in _generate_post_from_llm with {ai_provider}: {e}", exc_info=True)
+        FAILURES.inc(reason="llm_error")
         return None
 
-async def reformat_news_for_channel(
-    news_title: str, 
-    news_summary: str, # Kept for now, but excerpt from news_content is primary
-    news_link: str, 
-    news_content: str | None, # This is the full HTML from readability
-    publication_date: datetime, 
-    source_name: str
-) -> tuple[str | None, str | None]:
-    """
-    Reformats a news item for the Telegram channel using the new unified prompt.
-    Returns (formatted_text, image_prompt). Image prompt is currently always "SKIP".
-    """
-    logger.info(f"Reformatting news for channel: '{news_title[:50]}...' from {source_name}")
+async def _generate_with_cascade(messages: list, validate: Callable[[str], list[str]], json_mode: bool = False) -> str | None:
+    """Generates the post with the LLM_CASCADE_MODELS tiers, cheapest first.
 
-    excerpt = ""
+    Each tier's output is checked by validate (problems found, see validate_post); the next,
+    stronger tier is called only if the check fails or the tier returned nothing. Latency lands
+    in STAGE_LATENCY/RECENT_LATENCY as stage "llm:<model>" (outcome ok, rejected or empty),
+    cost in LLM_COST by model. Past LLM_BUDGET_DEGRADE_AT of the daily budget there is no
+    escalation. If no tier passes, the last output is returned as is.
+    Without LLM_CASCADE_MODELS this is a single call to the configured model.
+    """
+    models = _cascade_models()
+    if not models:
+        return await _generate_post_from_llm(messages, json_mode=json_mode)
+
+    ledger = get_token_ledger()
+    last_output = None
+    for tier, model in enumerate(models):
+        if tier > 0 and ledger.spent_ratio() >= ledger.degrade_at:
+            logger.info(f"LLM budget is {ledger.spent_ratio():.0%} spent, not escalating to {model}.")
+            break
+        start = time.perf_counter()
+        with span("llm_tier", tier=tier, model=model) as s:
+            output = await _generate_post_from_llm(messages, model=model, json_mode=json_mode)
+            problems = validate(output) if output else ["no output"]
+            outcome = "empty" if not output else ("rejected" if problems else "ok")
+            s.set(outcome=outcome, problems=problems)
+        duration = time.perf_counter() - start
+        STAGE_LATENCY.observe(duration, stage=f"llm:{model}", outcome=outcome)
+        RECENT_LATENCY.observe(f"llm:{model}", duration)
+        if outcome == "ok":
+            if tier > 0:
+                logger.info(f"Post accepted from cascade tier {tier} ({model}).")
+            return output
+        last_output = output or last_output
+        if tier + 1 < len(models):
+            logger.info(f"Cascade tier {tier} ({model}) rejected: {'; '.join(problems)}. Escalating.")
+    if last_output:
+        logger.warning("No cascade tier produced a valid post, using the last output.")
+    return last_output
+
+def extract_excerpt(news_content: str | None, news_summary: str | None) -> str:
+    """Extracts a plain-text excerpt (up to 1200 chars) for the prompt from article HTML or the RSS summary."""
     if news_content:
         try:
+            from bs4 import BeautifulSoup # Imported lazily: only needed when content is actually processed
+
             soup = BeautifulSoup(news_content, 'html.parser')
             # Get text, join paragraphs with newlines, strip extra whitespace
             paragraphs = [p.get_text(strip=True) for p in soup.find_all(['p', 'div'])] # Basic extraction
@@ -333,312 +563,98 @@ async def reformat_news_for_channel(
             
             excerpt = text_content[:1200] # Truncate for the prompt
             logger.info(f"Extracted excerpt of {len(excerpt)} chars for AI.")
+            return excerpt
         except Exception as e:
             logger.error(f"Error parsing news_content with BeautifulSoup: {e}", exc_info=True)
             # Fallback to RSS summary if full content parsing fails
-            excerpt = news_summary[:1200] if news_summary else ""
             logger.warning("Falling back to RSS summary for excerpt due to parsing error.")
-    elif news_summary:
-        excerpt = news_summary[:1200]
+            return news_summary[:1200] if news_summary else ""
+    if news_summary:
         logger.info("Using RSS summary as excerpt (no full content provided).")
-    else:
-        logger.warning("No news_content or news_summary available to create an excerpt for AI.")
-        # If there's truly no content, AI might struggle. Title alone is not enough.
-        return None, "SKIP" # Or handle as an error
+        return news_summary[:1200]
+    return ""
+
+async def reformat_news_for_channel(
+    news_title: str, 
+    news_summary: str, # Kept for now, but excerpt from news_content is primary
+    news_link: str, 
+    news_content: str | None = None, # This is the full HTML from readability (or the RSS content)
+    publication_date: datetime | None = None, 
+    source_name: str | None = None,
+    system_prompt: str | None = None, # Channel-specific prompt; None means UNIFIED_PROMPT
+    related_sources: list[dict] | None = None # Same story from other feeds, see build_messages
+) -> Optional[Tuple[str, str]]:
+    """
+    Reformats a news item for the Telegram channel using the unified (or channel-specific) prompt.
+    Returns (formatted_text, image_prompt) or None if the post could not be generated.
+    The image prompt is "SKIP" unless AI image generation is enabled.
+    """
+    source_name = source_name or "Неизвестный источник"
+    publication_date = publication_date or datetime.now(timezone.utc)
+    logger.info(f"Reformatting news for channel: '{news_title[:50]}...' from {source_name}")
 
+    excerpt = extract_excerpt(news_content, news_summary)
     if not excerpt.strip(): # Ensure excerpt is not just whitespace
+        # If there's truly no content, AI might struggle. Title alone is not enough.
         logger.warning(f"Excerpt for '{news_title[:50]}...' is empty after processing. Cannot generate post.")
-        return None, "SKIP"
+        FAILURES.inc(reason="empty_excerpt")
+        return None
 
+    # Structured output applies to the unified format; channel prompts define their own HTML
+    structured = system_prompt is None and get_settings().llm_structured_output
     messages = build_messages(
         news_title=news_title,
         excerpt=excerpt,
         publication_date=publication_date,
-        source_name=source_name
+        source_name=source_name,
+        system_prompt=STRUCTURED_PROMPT if structured else system_prompt,
+        related_sources=related_sources
     )
 
-    raw_ai_output = await _generate_post_from_llm(messages)
+    def validate(raw: str) -> list[str]:
+        if not structured:
+            return validate_post(raw, strict=system_prompt is None)
+        fields = parse_structured_post(raw)
+        return validate_post(render_structured_post(fields, publication_date)) if fields else ["unparseable JSON reply"]
+
+    raw_ai_output = await _generate_with_cascade(messages, validate, json_mode=structured)
 
     if not raw_ai_output:
         logger.error(f"AI failed to generate content for: {news_title[:50]}...")
-        return None, "SKIP"
-
-    sanitized_html_post = sanitize_ai_response(raw_ai_output)
-    
-    logger.info(f"Successfully reformatted news: '{news_title[:50]}...'")
-    # Image prompt is "SKIP" as per current strategy
-    return sanitized_html_post, "SKIP" 
-
-# (Optional) DALL-E image generation - can be kept if used elsewhere or removed
-# For now, it's not called by the main reformat_news_for_channel flow.
-async def generate_image_with_dalle(prompt: str) -> str | None:
-    # ... (existing DALL-E code remains unchanged for now)
-    if not OPENAI_API_KEY or not OPENAI_IMAGE_MODEL:
-        logger.warning("OpenAI API key or DALL-E model not configured. Skipping image generation.")
-        return None
-    if prompt.strip().upper() == "SKIP":
-        logger.info("Image prompt is 'SKIP', skipping DALL-E generation.")
-        return None
-
-    logger.info(f"Generating image with DALL-E, prompt: '{prompt[:100]}...'")
-    try:
-        # Using asyncio.to_thread for the blocking OpenAI call
-        # For openai < 1.0
-        # response = await asyncio.to_thread(
-        #     openai.Image.create,
-        #     prompt=prompt,
-        #     n=1,
-        #     size="1024x1024", # or "1792x1024" / "1024x1792" for DALL-E 3 if supported
-        #     model=OPENAI_IMAGE_MODEL # Ensure this is dall-e-3 if using those sizes
-        # )
-        # image_url = response['data'][0]['url']
-        
-        # For openai >= 1.0.0 (using a client)
-        # temp_openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
-        # async with temp_openai_client as client:
-        #     response = await client.images.generate(
-        #         model=OPENAI_IMAGE_MODEL,
-        #         prompt=prompt,
-        #         n=1,
-        #         size="1024x1024" # DALL-E 3 supports "1024x1024", "1792x1024", or "1024x1792"
-        #     )
-        # image_url = response.data[0].url
-
-        # Using the older openai.Image.create for simplicity with current API key setup
-        response = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: openai.Image.create(
-                prompt=prompt,
-                n=1,
-                size="1024x1024",
-                model=OPENAI_IMAGE_MODEL 
-            )
-        )
-        image_url = response['data'][0]['url']
-
-        logger.info(f"Image generated successfully: {image_url}")
-        return image_url
-    except openai.error.OpenAIError as e:
-        logger.error(f"OpenAI API error during image generation: {e}", exc_info=True)
-        return None
-    except Exception as e:
-        logger.error(f"Unexpected error during DALL-E image generation: {e}", exc_info=True)
-        return None
-
-async def close_httpx_client():
-    """Closes the global httpx client."""
-    if httpx_client and not httpx_client.is_closed:
-        await httpx_client.aclose()
-        logger.info("HTTPX client closed.")
-
-# Remove old, unused constants and functions if they are fully replaced
-# TG_ALLOWED_TAGS_SET - No longer needed as sanitize_ai_response handles allowed tags implicitly
-# SYSTEM_PROMPT_NEWS_HTML - Replaced by UNIFIED_PROMPT
-# clean_for_tg_html - Replaced by sanitize_ai_response
-
-# Configure OpenAI API key if using OpenAI
-if AI_PROVIDER == "openai" and OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
-    # For openai >= 1.0.0, client instantiation is preferred
-    # openai_client = openai.OpenAI(api_key=OPENAI_API_KEY) # If using client
-
-# Global httpx client for OpenRouter (and potentially OpenAI if we switch to httpx for it)
-httpx_client = httpx.AsyncClient(proxies=PROXY_URL if PROXY_URL else None, timeout=60.0)
-
-# Инициализация http клиента с учетом прокси (если он задан)
-proxies_config = {"http://": PROXY_URL, "https://": PROXY_URL} if PROXY_URL else None
-if proxies_config:
-    httpx_client = httpx.AsyncClient(proxies=proxies_config)
-else:
-    httpx_client = httpx.AsyncClient()
-
-if OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
-
-async def _reformat_news_openai(full_prompt: str, news_title: str) -> Optional[Tuple[str, str]]:
-    if not OPENAI_API_KEY:
-        logger.error("OpenAI API ключ не настроен для OpenAI провайдера.")
-        return None
-    logger.info("Отправка запроса к OpenAI API для реформатирования новости...")
-    try:
-        client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=httpx_client)
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Ты — ИИ-ассистент, помогающий готовить посты для Telegram-канала. Форматируй ответ строго для Telegram HTML. Разрешенные теги: <b>, <i>, <u>, <s>, <a href=\"URL\">, <tg-spoiler>. НЕ ИСПОЛЬЗУЙ теги <p>, <br>, <code>, или <pre>. Вместо <p> или <br> используй один или два символа новой строки (\n) для разделения абзацев. Заголовок новости выдели тегом <b>. Промпт для изображения должен быть АБСОЛЮТНО ПОСЛЕДНЕЙ строкой и не должен содержать никакого HTML."},
-                {"role": "user", "content": full_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1500 # Increased max_tokens slightly
-        )
-        
-        if not response.choices or not response.choices[0].message or not response.choices[0].message.content:
-            logger.error(f"Получен пустой или некорректный ответ от OpenAI API для новости: {news_title}")
-            return None
-
-        ai_response_text = response.choices[0].message.content.strip()
-        lines = ai_response_text.split('\n')
-        
-        image_prompt = f"Abstract representation of AI and news: {news_title}" # Default fallback
-        main_html_content = ai_response_text # Assume all is content initially
-
-        if len(lines) > 1:
-            last_line = lines[-1].strip()
-            # Check if the last line looks like a prompt and not part of HTML
-            if len(last_line.split()) > 1 and not '<' in last_line and not '>' in last_line and any(c.isalpha() for c in last_line):
-                potential_prompt_text = "\n".join(lines[:-1]).strip()
-                # Further check if the text *before* the last line ends sanely (e.g., not mid-HTML tag)
-                if potential_prompt_text and (potential_prompt_text.endswith(('.', '!', '?', '</code>', '</a>')) or not potential_prompt_text.endswith('>')) :
-                    main_html_content = potential_prompt_text
-                    image_prompt = last_line
-                    logger.info("Промпт для изображения выделен из ответа OpenAI.")
-                else:
-                    logger.warning("Последняя строка похожа на промпт, но текст перед ней обрывается. Используется запасной промпт.")
-            else:
-                logger.warning("Не удалось четко выделить промпт для изображения из ответа OpenAI (возможно, он часть HTML или отсутствует), используется запасной.")
-        else:
-            logger.warning("Ответ OpenAI слишком короткий для выделения отдельного промпта, используется запасной.")
-
-        formatted_text = clean_for_tg_html(main_html_content)
-        logger.info("Новость успешно реформатирована OpenAI и очищена для Telegram HTML.")
-        return formatted_text, image_prompt
-
-    except openai.APIConnectionError as e:
-        logger.error(f"Ошибка соединения с OpenAI API: {e}", exc_info=True)
-        return None
-    except openai.RateLimitError as e:
-        logger.error(f"Превышен лимит запросов к OpenAI API: {e}", exc_info=True)
-        return None
-    except openai.APIStatusError as e:
-        logger.error(f"Ошибка статуса OpenAI API (код {e.status_code}): {e.response}", exc_info=True)
-        return None
-    except Exception as e:
-        logger.error(f"Непредвиденная ошибка при взаимодействии с OpenAI API для реформатирования: {e}", exc_info=True)
         return None
 
-async def _reformat_news_openrouter(full_prompt: str, news_title: str) -> Optional[Tuple[str, str]]:
-    if not OPENROUTER_API_KEY:
-        logger.error("OpenRouter API ключ не настроен для OpenRouter провайдера.")
+    fields = parse_structured_post(raw_ai_output) if structured else None
+    if fields:
+        html_post = render_structured_post(fields, publication_date)
+    elif structured and raw_ai_output.lstrip().startswith(("{", "```")):
+        logger.error(f"AI returned unparseable JSON for: {news_title[:50]}...")
+        FAILURES.inc(reason="llm_unparseable")
         return None
-    if not OPENROUTER_CHAT_MODEL:
-        logger.error("Модель чата для OpenRouter не настроена.")
-        return None
-
-    logger.info(f"Отправка запроса к OpenRouter API (модель: {OPENROUTER_CHAT_MODEL}) для реформатирования новости...")
-    
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    if OPENROUTER_SITE_URL:
-        headers["HTTP-Referer"] = OPENROUTER_SITE_URL
-    if OPENROUTER_SITE_NAME:
-        headers["X-Title"] = OPENROUTER_SITE_NAME
-        
-    data = {
-        "model": OPENROUTER_CHAT_MODEL,
-        "messages": [
-            {"role": "system", "content": "Ты — ИИ-ассистент, помогающий готовить посты для Telegram-канала. Форматируй ответ строго для Telegram HTML. Разрешенные теги: <b>, <i>, <u>, <s>, <a href=\"URL\">, <tg-spoiler>. НЕ ИСПОЛЬЗУЙ теги <p>, <br>, <code>, или <pre>. Вместо <p> или <br> используй один или два символа новой строки (\n) для разделения абзацев. Заголовок новости выдели тегом <b>. Промпт для изображения должен быть АБСОЛЮТНО ПОСЛЕДНЕЙ строкой и не должен содержать никакого HTML."},
-            {"role": "user", "content": full_prompt}
-        ],
-        "temperature": 0.7,
-        "max_tokens": 1500 # Increased max_tokens slightly
-    }
-
-    try:
-        loop = asyncio.get_event_loop()
-        response_obj = await loop.run_in_executor(
-            None, 
-            lambda: requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                data=json.dumps(data),
-                timeout=60
-            )
-        )
-        response_obj.raise_for_status()
-        response_data = response_obj.json()
-
-        if not response_data.get('choices') or not response_data['choices'][0].get('message') or not response_data['choices'][0]['message'].get('content'):
-            logger.error(f"Получен пустой или некорректный ответ от OpenRouter API для новости: {news_title}. Ответ: {response_data}")
-            return None
-
-        ai_response_text = response_data['choices'][0]['message']['content'].strip()
-        lines = ai_response_text.split('\n')
-
-        image_prompt = f"Abstract representation of AI and news: {news_title}" # Default fallback
-        main_html_content = ai_response_text # Assume all is content initially
-
-        if len(lines) > 1:
-            last_line = lines[-1].strip()
-            if len(last_line.split()) > 1 and not '<' in last_line and not '>' in last_line and any(c.isalpha() for c in last_line):
-                potential_prompt_text = "\n".join(lines[:-1]).strip()
-                if potential_prompt_text and (potential_prompt_text.endswith(('.', '!', '?', '</code>', '</a>')) or not potential_prompt_text.endswith('>')):
-                    main_html_content = potential_prompt_text
-                    image_prompt = last_line
-                    logger.info("Промпт для изображения выделен из ответа OpenRouter.")
-                else:
-                    logger.warning("Последняя строка похожа на промпт, но текст перед ней обрывается. Используется запасной промпт для OpenRouter.")
-            else:
-                logger.warning("Не удалось четко выделить промпт для изображения из ответа OpenRouter, используется запасной.")
-        else:
-            logger.warning("Ответ OpenRouter слишком короткий для выделения отдельного промпта, используется запасной.")
-            
-        formatted_text = clean_for_tg_html(main_html_content)
-        logger.info("Новость успешно реформатирована OpenRouter и очищена для Telegram HTML.")
-        return formatted_text, image_prompt
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка при запросе к OpenRouter API: {e}", exc_info=True)
-        return None
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка декодирования JSON ответа от OpenRouter: {e}. Ответ: {response_obj.text if 'response_obj' in locals() else 'N/A'}", exc_info=True)
-        return None
-    except Exception as e:
-        logger.error(f"Непредвиденная ошибка при взаимодействии с OpenRouter API: {e}", exc_info=True)
-        return None
-
-async def reformat_news_for_channel(news_title: str, news_summary: str, news_link: str, news_content: Optional[str] = None) -> Optional[Tuple[str, str]]:
-    prompt_parts = [
-        f"Ты — редактор Telegram-канала на тему AI и промпт-инжиниринга. Твоя задача — подготовить пост на основе следующей новости.",
-        f"Новость:",
-        f"- Заголовок: {news_title}",
-        f"- Краткое содержание: {news_summary}"
-    ]
-    if news_content:
-        prompt_parts.append(f"- Полный текст (если нужно для контекста, используй кратко): {news_content[:1000]}...")
-    
-    prompt_parts.extend([
-        f"- Ссылка на источник: {news_link}",
-        f"Пожалуйста, сделай следующее (весь ответ, КРОМЕ ПОСЛЕДНЕЙ СТРОКИ с промптом для изображения, должен быть в формате HTML, строго для Telegram):",
-        "1. Напиши привлекательный и информативный текст для поста. Используй подходящие по теме эмодзи.",
-        "2. Формат HTML должен быть совместим с Telegram: разрешены только теги <b>, <i>, <u>, <s>, <a href=\"URL\">текст ссылки</a>, <tg-spoiler>. Заголовок новости выдели тегом <b>.",
-        "3. НЕ ИСПОЛЬЗУЙ теги <p>, <br>, <code>, или <pre>. Вместо <p> или <br> используй один или два символа новой строки (\n) для разделения абзацев или смысловых блоков.",
-        f"4. В конце основного текста (перед хештегами) добавь ссылку на источник в формате <a href=\"{news_link}\">Читать дальше</a>. Убедись, что ссылка {news_link} правильная и кликабельная.",
-        "5. После ссылки на источник добавь 3-5 релевантных хештегов (если они подходят). Обычным текстом, без специальных тегов для хештегов.",
-        "6. АБСОЛЮТНО ПОСЛЕДНЕЙ СТРОКОЙ (после всего HTML-контента и хештегов) предложи текстовый промпт (на английском языке) для генерации изображения к этому посту. Промпт должен быть ярким, описывающим суть новости или ключевую идею. Пример: 'Futuristic AI brain connected to a network, digital art'. НЕ ПИШИ НИЧЕГО КРОМЕ САМОГО ПРОМПТА для изображения на этой строке, и НЕ ИСПОЛЬЗУЙ HTML для этой строки промпта.",
-        f"Стиль канала: экспертный, но увлекательный. Целевая аудитория: интересующиеся AI, разработчики, промпт-инженеры."
-    ])
-    full_prompt = "\n".join(prompt_parts)
-
-    if AI_PROVIDER == "openai":
-        return await _reformat_news_openai(full_prompt, news_title)
-    elif AI_PROVIDER == "openrouter":
-        return await _reformat_news_openrouter(full_prompt, news_title)
     else:
-        logger.error(f"Неизвестный AI провайдер: {AI_PROVIDER}. Проверьте конфигурацию.")
-        return None
+        if structured:
+            logger.warning("AI ignored the JSON format, using its reply as HTML.")
+        html_post = sanitize_ai_response(raw_ai_output)
+
+    logger.info(f"Successfully reformatted news: '{news_title[:50]}...'")
+    image_prompt = "SKIP"
+    if get_settings().image_generation_enabled:
+        # The structured reply carries its own image prompt; otherwise use a generic one
+        image_prompt = _field_text((fields or {}).get("image_prompt")) or f"Abstract representation of AI and news: {news_title}"
+    return html_post, image_prompt
 
 async def generate_image_with_dalle(prompt: str) -> Optional[str]:
-    if not openai.api_key or not OPENAI_IMAGE_MODEL:
+    settings = get_settings()
+    if not settings.openai_api_key or not settings.openai_image_model:
         logger.error("OpenAI API ключ или модель для изображений не настроены.")
         return None
+    if prompt.strip().upper() == "SKIP":
+        logger.info("Image prompt is 'SKIP', skipping DALL-E generation.")
+        return None
 
     logger.info(f"Запрос на генерацию изображения DALL-E с промптом: {prompt}")
     try:
-        client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=httpx_client)
-        response = await client.images.generate(
-            model=OPENAI_IMAGE_MODEL,
+        response = await get_openai_client().images.generate(
+            model=settings.openai_image_model,
             prompt=prompt,
             n=1,
             size="1024x1024"
@@ -650,19 +666,14 @@ async def generate_image_with_dalle(prompt: str) -> Optional[str]:
         image_url = response.data[0].url
         logger.info(f"Изображение успешно сгенерировано: {image_url}")
         return image_url
-    except openai.APIConnectionError as e:
-        logger.error(f"Ошибка соединения с DALL-E API: {e}", exc_info=True)
-        return None
-    except openai.RateLimitError as e:
-        logger.error(f"Превышен лимит запросов к DALL-E API: {e}", exc_info=True)
-        return None
-    except openai.APIStatusError as e:
-        logger.error(f"Ошибка статуса DALL-E API (код {e.status_code}): {e.response}", exc_info=True)
-        return None
-    except Exception as e:
-        logger.error(f"Непредвиденная ошибка при генерации изображения DALL-E: {e}", exc_info=True)
+    except Exception as e: # openai.APIConnectionError, RateLimitError, APIStatusError и прочие
+        logger.error(f"Ошибка при генерации изображения DALL-E ({type(e).__name__}): {e}", exc_info=True)
         return None
 
 async def close_httpx_client():
-    await httpx_client.aclose()
-    logger.info("Глобальный httpx клиент успешно закрыт.") 
\ No newline at end of file
+    """Closes the global httpx client (if it was ever created)."""
+    global _openai_client
+    if _httpx_client is not None and not _httpx_client.is_closed:
+        await _httpx_client.aclose()
+        logger.info("Глобальный httpx клиент успешно закрыт.")
+    _openai_client = None
@@ -0,0 +1,238 @@
+"""Реестр каналов для публикации.
+
+Один процесс бота может вести несколько каналов (разные языки или стиль поверх
+пересекающихся лент). Каналы описываются в CHANNELS_FILE (по умолчанию
+channels.json):
+
+    {"channels": [
+        {"name": "ru", "chat_id": "@ai_news_ru"},
+        {"name": "en", "chat_id": -1001234567890,
+         "feeds": ["https://example.com/rss"],
+         "prompt_file": "prompts/en.txt",
+         "image_source_priority": "rss_only"}
+    ]}
+
+feeds - ленты канала (пусто - все ленты из FEEDS), prompt / prompt_file -
+системный промпт для LLM (пусто - стандартный), image_source_priority - как
+IMAGE_SOURCE_PRIORITY, posted_links_file - файл опубликованных ссылок канала.
+
+Без файла каналов реестр состоит из одного канала "default", собранного из
+TELEGRAM_CHANNEL_ID, FEEDS, IMAGE_SOURCE_PRIORITY и POSTED_LINKS_FILE, то есть
+бот работает как раньше.
+"""
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Protocol, Tuple, Union
+
+from app.config import VALID_IMAGE_PRIORITIES, Settings, get_settings
+from app.services.posted_links import PostedLinks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHANNEL_NAME = "default"
+
+
+@dataclass(frozen=True)
+class Channel:
+    """Канал для публикации: куда постить, из каких лент, каким промптом и с какими картинками."""
+
+    name: str
+    chat_id: Optional[Union[int, str]]
+    feeds: Tuple[str, ...] = ()
+    # Системный промпт LLM; None - стандартный ai_service.UNIFIED_PROMPT
+    prompt: Optional[str] = None
+    image_source_priority: str = "rss_then_ai"
+    posted_links_file: str = "posted_links.txt"
+
+    @property
+    def style(self) -> str:
+        """Ключ генерации: каналы с одинаковым промптом получают один и тот же текст поста."""
+        return self.prompt or ""
+
+    def accepts(self, entry: Any) -> bool:
+        """Подписан ли канал на ленту, из которой пришла запись."""
+        return not self.feeds or entry.get("feed_source_url") in self.feeds
+
+
+def default_channel(settings: Settings) -> Channel:
+    """Единственный канал из плоских настроек (TELEGRAM_CHANNEL_ID и т.д.)."""
+    return Channel(
+        name=DEFAULT_CHANNEL_NAME,
+        chat_id=settings.telegram_channel_id,
+        image_source_priority=settings.image_source_priority,
+        posted_links_file=settings.posted_links_file,
+    )
+
+
+def _parse_chat_id(raw: Any) -> Optional[Union[int, str]]:
+    if isinstance(raw, str) and raw.lstrip('-').isdigit():
+        return int(raw)
+    return raw
+
+
+def _read_prompt(spec: Dict[str, Any], base_dir: str) -> Optional[str]:
+    if spec.get("prompt"):
+        return spec["prompt"]
+    prompt_file = spec.get("prompt_file")
+    if not prompt_file:
+        return None
+    path = prompt_file if os.path.isabs(prompt_file) else os.path.join(base_dir, prompt_file)
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip() or None
+
+
+def parse_channels(data: Any, settings: Settings, base_dir: str = ".") -> List[Channel]:
+    """Собирает каналы из разобранного JSON ({"channels": [...]} или просто списка)."""
+    specs = data.get("channels", []) if isinstance(data, dict) else data
+    channels: List[Channel] = []
+    seen_names = set()
+    for i, spec in enumerate(specs or []):
+        name = str(spec.get("name") or f"channel{i + 1}")
+        if name in seen_names:
+            raise ValueError(f"Канал '{name}' описан в файле каналов дважды")
+        seen_names.add(name)
+        chat_id = _parse_chat_id(spec.get("chat_id"))
+        if chat_id is None:
+            raise ValueError(f"У канала '{name}' не указан chat_id")
+        image_priority = str(spec.get("image_source_priority") or settings.image_source_priority).lower()
+        if image_priority not in VALID_IMAGE_PRIORITIES:
+            logger.warning(
+                f"Некорректный image_source_priority '{image_priority}' у канала '{name}'. "
+                f"Используется {settings.image_source_priority}."
+            )
+            image_priority = settings.image_source_priority
+        posted_links_file = spec.get("posted_links_file") or (
+            settings.posted_links_file if i == 0 else f"posted_links_{name}.txt"
+        )
+        channels.append(Channel(
+            name=name,
+            chat_id=chat_id,
+            feeds=tuple(spec.get("feeds") or ()),
+            prompt=_read_prompt(spec, base_dir),
+            image_source_priority=image_priority,
+            posted_links_file=posted_links_file,
+        ))
+    return channels
+
+
+def load_channels(settings: Settings) -> List[Channel]:
+    """Читает каналы из CHANNELS_FILE; без файла возвращает один канал из плоских настроек."""
+    path = settings.channels_file
+    if not path or not os.path.exists(path):
+        return [default_channel(settings)]
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    channels = parse_channels(data, settings, base_dir=os.path.dirname(os.path.abspath(path)))
+    if not channels:
+        logger.warning(f"В файле каналов {path} нет ни одного канала, используется TELEGRAM_CHANNEL_ID.")
+        return [default_channel(settings)]
+    logger.info(f"Загружено каналов из {path}: {', '.join(c.name for c in channels)}")
+    return channels
+
+
+class Claims(Protocol):
+    """Общий для нескольких экземпляров бота учет публикаций (см. coordination.Coordinator)."""
+
+    def is_claimed(self, channel: str, link: str) -> bool: ...
+
+
+class ChannelRegistry:
+    """Каналы и их состояние дублей (опубликованные ссылки хранятся отдельно для каждого канала).
+
+    claims - общий учет публикаций при работе нескольких экземпляров: ссылка считается
+    опубликованной в канале, если ее опубликовал (захватил) любой из них.
+    """
+
+    def __init__(
+        self,
+        channels: List[Channel],
+        global_feeds: List[str],
+        posted_links_capacity: int = 1_000_000,
+        posted_links_error_rate: float = 0.001,
+        claims: Optional[Claims] = None,
+    ):
+        if not channels:
+            raise ValueError("Нужен хотя бы один канал")
+        self.channels = list(channels)
+        self.global_feeds = list(global_feeds)
+        self.claims = claims
+        self._posted: Dict[str, PostedLinks] = {}
+        for channel in self.channels:
+            # Каналы с общим файлом делят и список ссылок
+            existing = next((p for p in self._posted.values() if p.file_path == channel.posted_links_file), None)
+            self._posted[channel.name] = existing or PostedLinks(
+                channel.posted_links_file, capacity=posted_links_capacity, error_rate=posted_links_error_rate
+            )
+
+    def __iter__(self):
+        return iter(self.channels)
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    @property
+    def default(self) -> Channel:
+        """Основной канал: для ручных команд администратора (/prepare_post и т.п.)."""
+        return self.channels[0]
+
+    def get(self, name: str) -> Optional[Channel]:
+        return next((c for c in self.channels if c.name == name), None)
+
+    def feeds(self) -> List[str]:
+        """Объединение лент всех каналов: каждая лента опрашивается один раз."""
+        result: List[str] = []
+        for channel in self.channels:
+            for feed in channel.feeds or self.global_feeds:
+                if feed not in result:
+                    result.append(feed)
+        return result
+
+    def posted_links(self, channel: Channel) -> PostedLinks:
+        return self._posted[channel.name]
+
+    def is_posted(self, channel: Channel, link: str) -> bool:
+        if link in self._posted[channel.name]:
+            return True
+        return self.claims is not None and self.claims.is_claimed(channel.name, link)
+
+    def mark_posted(self, channel: Channel, link: str) -> None:
+        self._posted[channel.name].add(link)
+
+    def is_posted_everywhere(self, link: str) -> bool:
+        """Опубликована ли ссылка во всех каналах (тогда запись больше никому не нужна)."""
+        return all(self.is_posted(channel, link) for channel in self.channels)
+
+    def pending_channels(self, entry: Any) -> List[Channel]:
+        """Каналы, подписанные на ленту записи, в которых она еще не опубликована."""
+        link = entry.get("link")
+        return [c for c in self.channels if c.accepts(entry) and not self.is_posted(c, link)]
+
+
+_channel_registry: Optional[ChannelRegistry] = None
+
+
+def get_channel_registry() -> ChannelRegistry:
+    """Реестр каналов, загружаемый из настроек при первом обращении."""
+    global _channel_registry
+    if _channel_registry is None:
+        from app.services.coordination import get_coordinator
+
+        settings = get_settings()
+        _channel_registry = ChannelRegistry(
+            load_channels(settings),
+            settings.feeds,
+            posted_links_capacity=settings.posted_links_capacity,
+            posted_links_error_rate=settings.posted_links_error_rate,
+            claims=get_coordinator(),
+        )
+    return _channel_registry
+
+
+def group_by_style(channels: List[Channel]) -> List[List[Channel]]:
+    """Группирует каналы с одинаковым промптом (по порядку первого появления)."""
+    groups: Dict[str, List[Channel]] = {}
+    for channel in channels:
+        groups.setdefault(channel.style, []).append(channel)
+    return list(groups.values())
@@ -1,61 +1,219 @@
+"""Article text extraction in tiers, from cheapest to most expensive.
+
+1. ``feed``: the entry's embedded ``content[0].value`` (or summary) when its
+   plain text is at least ARTICLE_MIN_CHARS long - no network, no parsing.
+2. ``meta``: the page is fetched and JSON-LD ``articleBody`` or
+   ``og:description`` / ``description`` is taken from a single lxml parse.
+3. ``readability``: full readability extraction (the CPU-heavy step), run in a
+   worker thread so it does not block the event loop.
+
+Every extraction is counted in ARTICLE_EXTRACTIONS by the tier that produced it
+(plus ``prefetched`` for content loaded by another replica and ``none`` when
+nothing usable was found).
+"""
 import asyncio
+import json
 import logging
+import re
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+
 import aiohttp
-from readability import Document
-from bs4 import BeautifulSoup
+
+from app.config import get_settings
+from app.services.feed_content import entry_content, entry_content_chars
+from app.services.http_fetcher import PoliteFetcher, RobotsDisallowed, get_http_fetcher
+from app.utils.metrics import ARTICLE_EXTRACTIONS, FAILURES, track_stage
 
 logger = logging.getLogger(__name__)
 
-async def fetch_article_content(url: str, session: aiohttp.ClientSession) -> str | None:
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def text_length(html_or_text: Optional[str]) -> int:
+    """Length of the visible text (tags stripped, whitespace collapsed)."""
+    if not html_or_text:
+        return 0
+    return len(_SPACE_RE.sub(" ", _TAG_RE.sub(" ", html_or_text)).strip())
+
+
+def _min_chars(min_chars: Optional[int]) -> int:
+    return get_settings().article_min_chars if min_chars is None else min_chars
+
+
+def extract_from_feed(entry: Any, min_chars: Optional[int] = None) -> Optional[str]:
+    """Tier 1: the feed's own content, if it is long enough to stand in for the article."""
+    threshold = _min_chars(min_chars)
+    candidates = []
+    # Spilled content is only read back from the cache when its known length is enough
+    content_chars = entry_content_chars(entry)
+    if content_chars is None or content_chars >= threshold:
+        candidates.append(entry_content(entry))
+    candidates.append(entry.get("summary") or entry.get("description"))
+    for candidate in candidates:
+        if candidate and text_length(candidate) >= threshold:
+            return candidate
+    return None
+
+
+def _json_ld_bodies(node: Any) -> Iterator[str]:
+    if isinstance(node, list):
+        for item in node:
+            yield from _json_ld_bodies(item)
+    elif isinstance(node, dict):
+        body = node.get("articleBody")
+        if isinstance(body, str) and body.strip():
+            yield body.strip()
+        for key in ("@graph", "mainEntity", "mainEntityOfPage"):
+            if key in node:
+                yield from _json_ld_bodies(node[key])
+
+
+def extract_metadata(html_content: str) -> Optional[str]:
+    """Tier 2: JSON-LD articleBody, else og:description / meta description (longest wins)."""
+    import lxml.html
+    from lxml import etree
+
+    try:
+        tree = lxml.html.fromstring(html_content)
+    except (etree.ParserError, ValueError) as e:
+        logger.debug(f"Could not parse HTML for metadata: {e}")
+        return None
+
+    candidates = []
+    for script in tree.xpath('//script[@type="application/ld+json"]/text()'):
+        try:
+            candidates.extend(_json_ld_bodies(json.loads(script)))
+        except ValueError:
+            continue
+    if not candidates:
+        candidates = [
+            value.strip()
+            for value in tree.xpath(
+                '//meta[@property="og:description" or @name="og:description" or @name="description"]/@content'
+            )
+            if value.strip()
+        ]
+    return max(candidates, key=len) if candidates else None
+
+
+def _readability_summary(html_content: str) -> Optional[str]:
+    # Imported lazily: readability pulls in lxml and is slow to import
+    from readability import Document
+
+    return Document(html_content).summary() or None
+
+
+class ExtractedArticle(NamedTuple):
+    content: str
+    # Which tier produced the content: feed, prefetched, meta or readability
+    tier: str
+
+
+@track_stage("article_fetch")
+async def fetch_article(
+    url: str,
+    fetcher: Optional[PoliteFetcher] = None,
+    min_chars: Optional[int] = None,
+) -> Optional[ExtractedArticle]:
     """
-    Fetches the main article content from a given URL.
+    Fetches an article page and extracts its main content (tiers 2 and 3).
 
     Args:
         url: The URL of the article.
-        session: An aiohttp.ClientSession instance for making HTTP requests.
+        fetcher: Shared HTTP client with per-host politeness (default: get_http_fetcher()).
+        min_chars: Metadata text shorter than this falls through to readability
+            (default: ARTICLE_MIN_CHARS).
 
     Returns:
-        The cleaned HTML content of the main article, or None if fetching/parsing fails.
+        The article body (plain text from metadata or HTML from readability) with its tier,
+        or None if fetching/parsing fails.
     """
     if not url:
-        logger.warning("No URL provided to fetch_article_content.")
+        logger.warning("No URL provided to fetch_article.")
         return None
 
     logger.info(f"Attempting to fetch full article content from: {url}")
+    article = None
     try:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=20)) as response:
+        async with (fetcher or get_http_fetcher()).get(url, timeout=aiohttp.ClientTimeout(total=20)) as response:
             response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
             html_content = await response.text()
-            
-            if not html_content:
-                logger.warning(f"No HTML content received from {url}")
-                return None
-
-            # Use readability to extract the main content
-            doc = Document(html_content)
-            article_html_summary = doc.summary() # This gives HTML of the main article
-
-            if not article_html_summary:
-                logger.warning(f"Readability could not extract main content from {url}")
-                return None
-
-            # At this point, article_html_summary contains the HTML of the main article.
-            # We can use BeautifulSoup to further clean or transform it if needed.
-            # For now, let's return the direct HTML output from readability.
-            # Example: Convert to plain text (stripping all HTML tags)
-            # soup = BeautifulSoup(article_html_summary, 'html.parser')
-            # plain_text_content = soup.get_text(separator='\n', strip=True)
-            # return plain_text_content
-            
-            logger.info(f"Successfully extracted main content from {url} using readability.")
-            return article_html_summary
 
+        if not html_content:
+            logger.warning(f"No HTML content received from {url}")
+        else:
+            metadata = extract_metadata(html_content)
+            if metadata and text_length(metadata) >= _min_chars(min_chars):
+                logger.info(f"Extracted article body from page metadata: {url}")
+                article = ExtractedArticle(metadata, "meta")
+            else:
+                try:
+                    article_html_summary = await asyncio.to_thread(_readability_summary, html_content)
+                except Exception as e:
+                    logger.error(f"Readability failed on {url}: {e}", exc_info=True)
+                    FAILURES.inc(reason="article_error")
+                    article_html_summary = None
+                if article_html_summary:
+                    logger.info(f"Successfully extracted main content from {url} using readability.")
+                    article = ExtractedArticle(article_html_summary, "readability")
+                else:
+                    logger.warning(f"Readability could not extract main content from {url}")
+                    # A short description is still better than nothing
+                    article = ExtractedArticle(metadata, "meta") if metadata else None
+    except RobotsDisallowed:
+        logger.info(f"robots.txt disallows fetching {url}, using feed content only.")
+        FAILURES.inc(reason="article_robots")
     except aiohttp.ClientError as e:
         logger.error(f"aiohttp error while fetching article {url}: {e}", exc_info=False) # exc_info=False for brevity
-        return None
+        FAILURES.inc(reason="article_http")
     except Exception as e:
         logger.error(f"Unexpected error fetching or parsing article {url}: {e}", exc_info=True)
-        return None
+        FAILURES.inc(reason="article_error")
+    ARTICLE_EXTRACTIONS.inc(tier=article.tier if article else "none")
+    return article
+
+
+async def fetch_article_content(
+    url: str,
+    fetcher: Optional[PoliteFetcher] = None,
+    min_chars: Optional[int] = None,
+) -> str | None:
+    """Like fetch_article, but returns only the content (or None)."""
+    article = await fetch_article(url, fetcher, min_chars)
+    return article.content if article else None
+
+
+async def get_article_content(
+    entry: Any,
+    fetcher: Optional[PoliteFetcher] = None,
+    prefetched: Optional[Callable[[str], Optional[str]]] = None,
+    min_chars: Optional[int] = None,
+) -> Optional[ExtractedArticle]:
+    """
+    Extracts the article for a feed entry using the cheapest tier that works.
+
+    Args:
+        entry: The feed entry (needs ``link``; ``content``/``summary`` are used for tier 1).
+        fetcher: HTTP client for the page fetch, used only when the feed content is too short.
+        prefetched: Optional lookup of content already fetched by another replica (by link);
+            an empty result (that replica's fetch failed) falls through to the page fetch.
+        min_chars: Plain-text length that makes feed content or metadata good enough.
+    """
+    feed_content = extract_from_feed(entry, min_chars)
+    if feed_content:
+        ARTICLE_EXTRACTIONS.inc(tier="feed")
+        return ExtractedArticle(feed_content, "feed")
+
+    link = entry.get("link")
+    if prefetched is not None and link:
+        content = prefetched(link)
+        # "" means the other replica's fetch failed: treat it as a miss and try the page ourselves
+        if content:
+            ARTICLE_EXTRACTIONS.inc(tier="prefetched")
+            return ExtractedArticle(content, "prefetched")
+
+    return await fetch_article(link, fetcher, min_chars)
 
 # Example usage (for testing this service directly)
 # if __name__ == '__main__':
@@ -63,9 +221,9 @@ async def fetch_article_content(url: str, session: aiohttp.ClientSession) -> str
 #         # Example URL - replace with a real article URL for testing
 #         test_url = "https://www.wired.com/story/our-minds-are-no-match-for-our-digital-media/"
         
-#         # It's good practice to create the session once and pass it around
-#         async with aiohttp.ClientSession() as session:
-#             content = await fetch_article_content(test_url, session)
+#         # The shared fetcher keeps one session (and its connections) for the whole process
+#         content = await fetch_article_content(test_url)
+#         await close_http_fetcher()
         
 #         if content:
 #             print(f"--- Extracted Content from {test_url} ---")
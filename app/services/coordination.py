@@ -0,0 +1,305 @@
+"""Координация нескольких экземпляров бота через общую базу SQLite.
+
+Если задан COORDINATION_DB (файл на общем для реплик диске), экземпляры бота:
+
+* регистрируются в таблице nodes и периодически обновляют heartbeat;
+* выбирают одного публикатора через аренду (lease) с истечением срока: только
+  лидер забирает кандидатов и публикует, при падении лидера аренду через
+  COORDINATION_LEASE_SECONDS подхватывает другой экземпляр;
+* делят опрос лент и загрузку статей по консистентному хешированию (HashRing)
+  среди живых узлов: больше узлов - больше пропускная способность сбора;
+* складывают найденные записи в общую таблицу candidates, откуда лидер
+  переносит их в свою очередь; статьи для лучших кандидатов заранее загружает
+  узел-владелец ссылки;
+* перед отправкой "захватывают" пару (канал, ссылка) в таблице posted, поэтому
+  даже при смене лидера одна новость не публикуется в канал дважды.
+
+Без COORDINATION_DB бот работает как одиночный процесс, а get_coordinator()
+возвращает None.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.config import get_settings
+from app.services.feed_parser import as_feedparser_dict
+from app.utils.dates import PUBLISHED_CACHE_KEY
+
+logger = logging.getLogger(__name__)
+
+PUBLISHER_LEASE = "publisher"
+AUTOPOST_FLAG = "autopost"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS flags (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS candidates (
+    link TEXT PRIMARY KEY,
+    entry TEXT NOT NULL,
+    node_id TEXT NOT NULL,
+    created REAL NOT NULL,
+    queued INTEGER NOT NULL DEFAULT 0,
+    wanted INTEGER NOT NULL DEFAULT 0,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS candidates_queued ON candidates (queued);
+CREATE TABLE IF NOT EXISTS posted (
+    channel TEXT NOT NULL,
+    link TEXT NOT NULL,
+    node_id TEXT NOT NULL,
+    claimed REAL NOT NULL,
+    PRIMARY KEY (channel, link)
+);
+"""
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class HashRing:
+    """Консистентное хеширование: при добавлении/уходе узла переезжает ~1/N ключей."""
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 64):
+        self.nodes = sorted(set(nodes))
+        self._ring: List[Tuple[int, str]] = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._keys = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+# --- Сериализация записей лент для общей таблицы ---
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def serialize_entry(entry: Any) -> str:
+    return json.dumps(entry, ensure_ascii=False, default=_json_default)
+
+
+def deserialize_entry(raw: str) -> Any:
+    """Восстанавливает запись как FeedParserDict (с доступом к полям через атрибуты)."""
+    entry = as_feedparser_dict(json.loads(raw))
+    published = entry.get(PUBLISHED_CACHE_KEY)
+    if isinstance(published, str):
+        entry[PUBLISHED_CACHE_KEY] = datetime.fromisoformat(published)
+    return entry
+
+
+class Coordinator:
+    """Лидерство, разбиение работы и общие дедупликация/кандидаты поверх одного файла SQLite."""
+
+    def __init__(self, db_path: str, node_id: Optional[str] = None, lease_seconds: float = 30.0):
+        self.db_path = db_path
+        self.node_id = node_id or default_node_id()
+        self.lease_seconds = lease_seconds
+        self._is_leader = False
+        self._ring: Optional[HashRing] = None
+        # Автокоммит: каждая операция - короткая отдельная транзакция
+        self._db = sqlite3.connect(db_path, timeout=10.0, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    # --- Узлы и лидерство ---
+
+    def heartbeat(self, now: Optional[float] = None) -> List[str]:
+        """Отмечает узел живым и возвращает список живых узлов (с ним самим)."""
+        now = time.time() if now is None else now
+        self._db.execute(
+            "INSERT INTO nodes (node_id, heartbeat) VALUES (?, ?) "
+            "ON CONFLICT(node_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+            (self.node_id, now),
+        )
+        rows = self._db.execute("SELECT node_id FROM nodes WHERE heartbeat >= ?", (now - self.lease_seconds,))
+        nodes = [row[0] for row in rows]
+        if self._ring is None or self._ring.nodes != sorted(nodes):
+            if self._ring is not None:
+                logger.info(f"Состав узлов изменился: {', '.join(sorted(nodes))}")
+            self._ring = HashRing(nodes)
+        return nodes
+
+    def try_acquire_lease(self, name: str = PUBLISHER_LEASE, now: Optional[float] = None) -> bool:
+        """Берет или продлевает аренду. True, если узел ее держит."""
+        now = time.time() if now is None else now
+        self._db.execute(
+            "INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires "
+            "WHERE leases.holder = excluded.holder OR leases.expires < ?",
+            (name, self.node_id, now + self.lease_seconds, now),
+        )
+        row = self._db.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()
+        return bool(row) and row[0] == self.node_id
+
+    def release_lease(self, name: str = PUBLISHER_LEASE) -> None:
+        self._db.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, self.node_id))
+        if name == PUBLISHER_LEASE:
+            self._is_leader = False
+
+    def tick(self, now: Optional[float] = None) -> bool:
+        """Heartbeat и продление аренды публикатора. Возвращает True, если узел - лидер."""
+        self.heartbeat(now)
+        was_leader = self._is_leader
+        self._is_leader = self.try_acquire_lease(PUBLISHER_LEASE, now)
+        if self._is_leader and not was_leader:
+            logger.info(f"Узел {self.node_id} стал публикатором.")
+            # Очередь прежнего лидера потеряна: заново забираем всех неопубликованных кандидатов
+            self._db.execute("UPDATE candidates SET queued = 0")
+        elif was_leader and not self._is_leader:
+            logger.warning(f"Узел {self.node_id} потерял роль публикатора.")
+        return self._is_leader
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader
+
+    def owns(self, key: str) -> bool:
+        """Принадлежит ли ключ (URL ленты или статьи) этому узлу."""
+        if self._ring is None:
+            self.heartbeat()
+        owner = self._ring.owner(key)
+        return owner is None or owner == self.node_id
+
+    def owned(self, keys: Sequence[str]) -> List[str]:
+        return [key for key in keys if self.owns(key)]
+
+    # --- Общие флаги ---
+
+    def set_flag(self, name: str, value: bool) -> None:
+        self._db.execute(
+            "INSERT INTO flags (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (name, "1" if value else "0"),
+        )
+
+    def get_flag(self, name: str) -> Optional[bool]:
+        row = self._db.execute("SELECT value FROM flags WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0] == "1"
+
+    # --- Кандидаты ---
+
+    def add_candidates(self, entries: Iterable[Any], now: Optional[float] = None) -> int:
+        """Кладет записи в общую таблицу (повторные ссылки игнорируются). Возвращает число новых."""
+        now = time.time() if now is None else now
+        rows = [(entry["link"], serialize_entry(entry), self.node_id, now) for entry in entries if entry.get("link")]
+        before = self._db.total_changes
+        self._db.executemany(
+            "INSERT OR IGNORE INTO candidates (link, entry, node_id, created) VALUES (?, ?, ?, ?)", rows
+        )
+        return self._db.total_changes - before
+
+    def pull_candidates(self) -> List[Any]:
+        """Забирает еще не взятые лидером записи (и помечает их взятыми)."""
+        rows = self._db.execute("SELECT link, entry FROM candidates WHERE queued = 0").fetchall()
+        if rows:
+            self._db.executemany("UPDATE candidates SET queued = 1 WHERE link = ?", [(link,) for link, _ in rows])
+        entries = []
+        for link, raw in rows:
+            try:
+                entries.append(deserialize_entry(raw))
+            except (ValueError, TypeError) as e:
+                logger.error(f"Не удалось восстановить кандидата {link} из общей таблицы: {e}")
+        return entries
+
+    def want_content(self, links: Sequence[str]) -> None:
+        """Просит узлы-владельцы заранее загрузить статьи для этих ссылок."""
+        self._db.executemany("UPDATE candidates SET wanted = 1 WHERE link = ? AND content IS NULL", [(link,) for link in links])
+
+    def wanted_links(self, limit: int = 10) -> List[str]:
+        """Запрошенные лидером ссылки без загруженной статьи, принадлежащие этому узлу."""
+        rows = self._db.execute("SELECT link FROM candidates WHERE wanted = 1 AND content IS NULL").fetchall()
+        return [row[0] for row in rows if self.owns(row[0])][:limit]
+
+    def store_content(self, link: str, content: Optional[str]) -> None:
+        # Пустая строка - загрузка не удалась; лидер сам возьмет текст из RSS
+        self._db.execute("UPDATE candidates SET content = ?, wanted = 0 WHERE link = ?", (content or "", link))
+
+    def get_content(self, link: str) -> Optional[str]:
+        """Заранее загруженная статья: None - не загружалась, "" - загрузка не удалась."""
+        row = self._db.execute("SELECT content FROM candidates WHERE link = ?", (link,)).fetchone()
+        return row[0] if row else None
+
+    def prune_candidates(self, max_age: float, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        return self._db.execute("DELETE FROM candidates WHERE created < ?", (now - max_age,)).rowcount
+
+    # --- Публикации ---
+
+    def claim(self, channel: str, link: str, now: Optional[float] = None) -> bool:
+        """Захватывает публикацию ссылки в канал. False - ее уже захватил кто-то другой."""
+        now = time.time() if now is None else now
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO posted (channel, link, node_id, claimed) VALUES (?, ?, ?, ?)",
+            (channel, link, self.node_id, now),
+        )
+        return cursor.rowcount == 1
+
+    def release_claim(self, channel: str, link: str) -> None:
+        """Снимает захват после неудачной отправки, чтобы новость можно было опубликовать позже."""
+        self._db.execute("DELETE FROM posted WHERE channel = ? AND link = ? AND node_id = ?", (channel, link, self.node_id))
+
+    def is_claimed(self, channel: str, link: str) -> bool:
+        row = self._db.execute("SELECT 1 FROM posted WHERE channel = ? AND link = ?", (channel, link)).fetchone()
+        return row is not None
+
+    def stats(self) -> Dict[str, Any]:
+        """Сводка для /status."""
+        now = time.time()
+        live = self._db.execute("SELECT COUNT(*) FROM nodes WHERE heartbeat >= ?", (now - self.lease_seconds,)).fetchone()[0]
+        leader = self._db.execute(
+            "SELECT holder FROM leases WHERE name = ? AND expires >= ?", (PUBLISHER_LEASE, now)
+        ).fetchone()
+        pending = self._db.execute("SELECT COUNT(*) FROM candidates WHERE queued = 0").fetchone()[0]
+        return {"node_id": self.node_id, "nodes": live, "leader": leader[0] if leader else None, "pending": pending}
+
+
+_coordinator: Optional[Coordinator] = None
+_coordinator_configured = False
+
+
+def get_coordinator() -> Optional[Coordinator]:
+    """Координатор из настроек COORDINATION_DB (None - одиночный режим)."""
+    global _coordinator, _coordinator_configured
+    if not _coordinator_configured:
+        settings = get_settings()
+        if settings.coordination_db:
+            _coordinator = Coordinator(
+                settings.coordination_db,
+                node_id=settings.node_id or None,
+                lease_seconds=settings.coordination_lease_seconds,
+            )
+            logger.info(f"Координация через {settings.coordination_db}, узел {_coordinator.node_id}.")
+        _coordinator_configured = True
+    return _coordinator
@@ -0,0 +1,164 @@
+"""Крупное содержимое записей лент хранится вне памяти.
+
+Поле content (полный текст статьи в ленте) - самая тяжелая часть записи:
+десятки килобайт HTML на запись, а записи сотен лент живут в очереди
+кандидатов между тиками. Если текст длиннее FEED_CONTENT_INLINE_CHARS,
+он переносится в SQLite (FEED_CONTENT_CACHE_FILE) по ссылке записи. В
+записи остаются только длина видимого текста (для выбора уровня извлечения
+статьи и "богатства" записи в сюжете) и отметка о переносе, а сам текст
+читается с диска через entry_content() только для той новости, которая
+действительно публикуется.
+
+Кэш общий для перезапусков; записи старше QUEUE_MAX_AGE_HOURS удаляются.
+Узел, получивший запись из общей таблицы кандидатов (COORDINATION_DB), может
+не найти ее текст у себя - тогда статья загружается со страницы, как для
+записей без content.
+"""
+import logging
+import sqlite3
+import time
+from typing import Any, Iterable, List, Optional
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Длина видимого текста content и отметка, что сам текст перенесен в кэш
+CONTENT_CHARS_KEY = "_content_chars"
+CONTENT_SPILLED_KEY = "_content_spilled"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feed_content (
+    link TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS feed_content_stored_at ON feed_content (stored_at);
+"""
+
+
+class FeedContentStore:
+    """Текст записей лент в SQLite по ссылке записи."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, timeout=10.0, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def put_many(self, items: Iterable[tuple]) -> None:
+        """Сохраняет пары (ссылка, текст) одной транзакцией."""
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO feed_content (link, value, stored_at) VALUES (?, ?, ?)",
+                [(link, value, now) for link, value in items],
+            )
+
+    def get(self, link: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM feed_content WHERE link = ?", (link,)).fetchone()
+        return row[0] if row else None
+
+    def prune(self, max_age_seconds: float) -> int:
+        """Удаляет тексты старше max_age_seconds; возвращает число удаленных."""
+        cursor = self._db.execute("DELETE FROM feed_content WHERE stored_at < ?", (time.time() - max_age_seconds,))
+        return cursor.rowcount
+
+
+_feed_content_store: Optional[FeedContentStore] = None
+_feed_content_store_configured = False
+
+
+def get_feed_content_store() -> Optional[FeedContentStore]:
+    """Кэш текста записей (None - перенос выключен, FEED_CONTENT_CACHE_FILE не задан)."""
+    global _feed_content_store, _feed_content_store_configured
+    if not _feed_content_store_configured:
+        path = get_settings().feed_content_cache_file
+        if path:
+            try:
+                _feed_content_store = FeedContentStore(path)
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось открыть кэш текста записей {path}, текст остается в памяти: {e}")
+        _feed_content_store_configured = True
+    return _feed_content_store
+
+
+def _inline_content(entry: Any) -> Optional[str]:
+    content = entry.get("content")
+    if content and isinstance(content, list):
+        return content[0].get("value")
+    return None
+
+
+def spill_entry_content(entries: List[Any]) -> int:
+    """Переносит длинный content записей в кэш; возвращает число перенесенных.
+
+    Длина видимого текста запоминается в записи в любом случае, чтобы ее не
+    приходилось считать (или читать текст с диска) при ранжировании.
+    """
+    from app.services.content_fetch_service import text_length
+
+    settings = get_settings()
+    store = get_feed_content_store()
+    spilled = []
+    for entry in entries:
+        value = _inline_content(entry)
+        if not value:
+            continue
+        entry[CONTENT_CHARS_KEY] = text_length(value)
+        link = entry.get("link")
+        if store is not None and link and len(value) > settings.feed_content_inline_chars:
+            spilled.append((link, value))
+            entry["content"] = None
+            entry[CONTENT_SPILLED_KEY] = True
+    if not spilled:
+        return 0
+    try:
+        store.put_many(spilled)
+    except sqlite3.Error as e:
+        # Текст возвращается в записи: без него новость пришлось бы загружать со страницы
+        logger.error(f"Ошибка при записи текста записей в кэш {store.db_path}: {e}")
+        values = dict(spilled)
+        for entry in entries:
+            if entry.get(CONTENT_SPILLED_KEY) and entry.get("link") in values:
+                entry["content"] = [{"type": "text/html", "value": values[entry["link"]]}]
+                del entry[CONTENT_SPILLED_KEY]
+        return 0
+    return len(spilled)
+
+
+def entry_content(entry: Any) -> Optional[str]:
+    """Текст content записи: из самой записи или из кэша, если он был перенесен."""
+    value = _inline_content(entry)
+    if value or not entry.get(CONTENT_SPILLED_KEY):
+        return value
+    store = get_feed_content_store()
+    if store is None or not entry.get("link"):
+        return None
+    try:
+        return store.get(entry["link"])
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при чтении текста записи {entry['link']} из кэша: {e}")
+        return None
+
+
+def entry_content_chars(entry: Any) -> Optional[int]:
+    """Длина видимого текста content без чтения кэша (None - не посчитана)."""
+    return entry.get(CONTENT_CHARS_KEY)
+
+
+def prune_feed_content() -> None:
+    """Удаляет из кэша тексты записей, которые уже не могут быть в очереди."""
+    store = get_feed_content_store()
+    if store is None:
+        return
+    try:
+        removed = store.prune(get_settings().queue_max_age_hours * 3600)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при очистке кэша текста записей: {e}")
+        return
+    if removed:
+        logger.info(f"Из кэша текста записей удалено устаревших текстов: {removed}.")
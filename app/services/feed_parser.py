@@ -0,0 +1,272 @@
+"""Разбор RSS/Atom лент: быстрый путь на lxml и запасной feedparser.
+
+feedparser написан на чистом Python и медленно разбирает большие ленты, а в
+пуле потоков еще и конкурирует за GIL с event loop. Поэтому байты ленты
+разбираются в пуле процессов (см. rss_service), а корректные RSS 2.0 и Atom -
+быстрым парсером на lxml, который достает только нужные боту поля: заголовок,
+ссылку, guid, даты, описание, содержимое и медиа. Некорректно сформированные
+("bozo") ленты, RSS 1.0/RDF и все прочее разбирает feedparser.
+
+parse_feed_bytes возвращает обычные dict/list (их можно передать между
+процессами) с уже компактными записями (compact_entry); as_feedparser_dict в
+основном процессе превращает их в FeedParserDict с доступом к полям через
+атрибуты, как у feedparser.
+"""
+import logging
+from typing import Any, Dict, List, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+_ATOM = "{http://www.w3.org/2005/Atom}"
+_CONTENT = "{http://purl.org/rss/1.0/modules/content/}"
+_DC = "{http://purl.org/dc/elements/1.1/}"
+_MEDIA = "{http://search.yahoo.com/mrss/}"
+_SY = "{http://purl.org/rss/1.0/modules/syndication/}"
+_XHTML_XMLNS = ' xmlns="http://www.w3.org/1999/xhtml"'
+
+
+class UnsupportedFeed(Exception):
+    """Лента не подходит для быстрого пути (будет разобрана feedparser)."""
+
+
+def _text(element: Any, path: str) -> Optional[str]:
+    child = element.find(path)
+    if child is None or child.text is None:
+        return None
+    return child.text.strip()
+
+
+def _sanitize(value: str) -> str:
+    """Очищает HTML тем же санитайзером, что и feedparser (без script, style, обработчиков событий).
+
+    Иначе одна и та же лента давала бы разные записи в зависимости от того,
+    какой парсер ее разобрал, а фильтр релевантности и сюжеты видели бы сырую разметку.
+    """
+    from feedparser.sanitizer import _sanitize_html
+
+    return _sanitize_html(value, "utf-8", "text/html")
+
+
+def _media(item: Any, entry: Dict[str, Any]) -> None:
+    contents = [dict(el.attrib) for el in item.iter(f"{_MEDIA}content") if el.get("url")]
+    if contents:
+        entry["media_content"] = contents
+    thumbnails = [dict(el.attrib) for el in item.iter(f"{_MEDIA}thumbnail") if el.get("url")]
+    if thumbnails:
+        entry["media_thumbnail"] = thumbnails
+
+
+def _rss_item(item: Any) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {}
+    title = _text(item, "title")
+    if title is not None:
+        entry["title"] = title
+    link = _text(item, "link")
+    guid = item.find("guid")
+    guid_text = guid.text.strip() if guid is not None and guid.text else None
+    if guid_text:
+        entry["id"] = guid_text
+        # Как в feedparser: guid без isPermaLink="false" служит ссылкой, если <link> нет
+        if not link and guid.get("isPermaLink", "true").lower() != "false":
+            link = guid_text
+    links: List[Dict[str, str]] = []
+    if link:
+        entry["link"] = link
+        links.append({"rel": "alternate", "type": "text/html", "href": link})
+    published = _text(item, "pubDate") or _text(item, f"{_DC}date")
+    if published:
+        entry["published"] = published
+    description = _text(item, "description")
+    if description is not None:
+        entry["summary"] = _sanitize(description)
+    encoded = _text(item, f"{_CONTENT}encoded")
+    if encoded:
+        entry["content"] = [{"type": "text/html", "value": _sanitize(encoded)}]
+    enclosures = []
+    for enclosure in item.findall("enclosure"):
+        url = enclosure.get("url")
+        if url:
+            enclosures.append({"href": url, "type": enclosure.get("type", ""), "length": enclosure.get("length", "")})
+            links.append({"rel": "enclosure", "type": enclosure.get("type", ""), "href": url})
+    if enclosures:
+        entry["enclosures"] = enclosures
+    entry["links"] = links
+    _media(item, entry)
+    return entry
+
+
+def _atom_text(element: Any) -> Optional[str]:
+    if element is None:
+        return None
+    if element.get("type") == "xhtml":
+        from lxml import etree
+
+        div = element.find("{http://www.w3.org/1999/xhtml}div")
+        container = div if div is not None else element
+        inner = (container.text or "") + "".join(etree.tostring(child, encoding="unicode") for child in container)
+        return inner.replace(_XHTML_XMLNS, "").strip()
+    return (element.text or "").strip()
+
+
+def _atom_entry(item: Any) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {}
+    title = _atom_text(item.find(f"{_ATOM}title"))
+    if title is not None:
+        entry["title"] = title
+    entry_id = _text(item, f"{_ATOM}id")
+    if entry_id:
+        entry["id"] = entry_id
+    links: List[Dict[str, str]] = []
+    enclosures = []
+    for link in item.findall(f"{_ATOM}link"):
+        href = link.get("href")
+        if not href:
+            continue
+        rel = link.get("rel", "alternate")
+        links.append({"rel": rel, "type": link.get("type", ""), "href": href})
+        if rel == "alternate" and "link" not in entry:
+            entry["link"] = href
+        elif rel == "enclosure":
+            enclosures.append({"href": href, "type": link.get("type", ""), "length": link.get("length", "")})
+    entry["links"] = links
+    if enclosures:
+        entry["enclosures"] = enclosures
+    published = _text(item, f"{_ATOM}published")
+    updated = _text(item, f"{_ATOM}updated")
+    if published:
+        entry["published"] = published
+    if updated:
+        entry["updated"] = updated
+    summary_element = item.find(f"{_ATOM}summary")
+    summary = _atom_text(summary_element)
+    if summary is not None:
+        entry["summary"] = _sanitize(summary) if summary_element.get("type") in ("html", "xhtml") else summary
+    content = item.find(f"{_ATOM}content")
+    if content is not None:
+        content_type = content.get("type", "text")
+        value = _atom_text(content)
+        if content_type in ("html", "xhtml"):
+            content_type, value = "text/html", _sanitize(value)
+        entry["content"] = [{"type": content_type, "value": value}]
+    _media(item, entry)
+    return entry
+
+
+def parse_fast(data: bytes) -> Dict[str, Any]:
+    """Строгий разбор RSS 2.0/Atom на lxml. Бросает UnsupportedFeed, если нужен feedparser."""
+    from lxml import etree
+
+    parser = etree.XMLParser(resolve_entities=False, no_network=True, recover=False, remove_comments=True)
+    try:
+        root = etree.fromstring(data, parser)
+    except (etree.XMLSyntaxError, ValueError) as e:
+        raise UnsupportedFeed(f"XML: {e}") from e
+
+    if root.tag == "rss":
+        channel = root.find("channel")
+        if channel is None:
+            raise UnsupportedFeed("RSS без <channel>")
+        feed = {"title": _text(channel, "title") or "", "link": _text(channel, "link") or ""}
+        for key, path in (("ttl", "ttl"), ("sy_updateperiod", f"{_SY}updatePeriod"), ("sy_updatefrequency", f"{_SY}updateFrequency")):
+            value = _text(channel, path)
+            if value:
+                feed[key] = value
+        entries = [_rss_item(item) for item in channel.iterfind("item")]
+        version = "rss20"
+    elif root.tag == f"{_ATOM}feed":
+        feed = {"title": _atom_text(root.find(f"{_ATOM}title")) or ""}
+        entries = [_atom_entry(item) for item in root.iterfind(f"{_ATOM}entry")]
+        version = "atom10"
+    else:
+        raise UnsupportedFeed(f"корневой элемент {root.tag}")
+    return {"bozo": False, "bozo_exception": None, "feed": feed, "entries": entries, "version": version, "parser": "lxml"}
+
+
+def _plain(value: Any) -> Any:
+    """FeedParserDict -> dict рекурсивно (для передачи между процессами)."""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+def parse_with_feedparser(data: bytes, response_headers: Optional[Mapping[str, str]] = None) -> Dict[str, Any]:
+    import feedparser
+
+    parsed = feedparser.parse(data, response_headers=dict(response_headers or {}))
+    return {
+        "bozo": bool(parsed.bozo),
+        "bozo_exception": str(parsed.bozo_exception) if parsed.bozo else None,
+        "feed": _plain(parsed.get("feed", {})),
+        "entries": _plain(parsed.entries),
+        "version": parsed.get("version", ""),
+        "parser": "feedparser",
+    }
+
+
+def _url_items(items: Any, url_key: str) -> List[Dict[str, str]]:
+    result = []
+    for item in items or []:
+        if isinstance(item, dict) and item.get(url_key):
+            result.append({key: item[key] for key in (url_key, "rel", "type", "medium") if item.get(key)})
+    return result
+
+
+def compact_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Оставляет в записи только поля, которые использует бот.
+
+    feedparser кладет в запись много лишнего: *_detail с копиями заголовка и
+    описания, *_parsed, авторов, теги, все ссылки. Компактная запись содержит
+    заголовок, ссылку, id, даты (разобранная дата сразу кэшируется), описание,
+    первый content и ссылки на изображения. Выполняется в процессе пула, поэтому
+    тяжелые поля не передаются в основной процесс.
+    """
+    from app.utils.dates import PUBLISHED_CACHE_KEY, normalize_entry_date
+
+    compact: Dict[str, Any] = {key: entry[key] for key in ("title", "link", "id", "published", "updated") if entry.get(key)}
+    summary = entry.get("summary") or entry.get("description")
+    if summary:
+        compact["summary"] = summary
+    content = entry.get("content")
+    if content and isinstance(content, list) and isinstance(content[0], dict) and content[0].get("value"):
+        compact["content"] = [{"type": content[0].get("type", "text/html"), "value": content[0]["value"]}]
+    media_content = _url_items(entry.get("media_content"), "url")
+    if media_content:
+        compact["media_content"] = media_content
+    media_thumbnail = _url_items(entry.get("media_thumbnail"), "url")
+    if media_thumbnail:
+        compact["media_thumbnail"] = media_thumbnail
+    enclosures = _url_items(entry.get("enclosures"), "href")
+    if enclosures:
+        compact["enclosures"] = enclosures
+    # Из всех ссылок записи боту нужны только картинки (основная ссылка уже в link)
+    compact["links"] = [link for link in _url_items(entry.get("links"), "href") if link.get("type", "").startswith("image/")]
+    normalize_entry_date(entry)
+    compact[PUBLISHED_CACHE_KEY] = entry[PUBLISHED_CACHE_KEY]
+    return compact
+
+
+def parse_feed_bytes(data: bytes, response_headers: Optional[Mapping[str, str]] = None, fast_path: bool = True) -> Dict[str, Any]:
+    """Разбирает ленту и сжимает записи (compact_entry). Функция верхнего уровня: выполняется в процессе пула."""
+    parsed = None
+    if fast_path:
+        try:
+            parsed = parse_fast(data)
+        except UnsupportedFeed as e:
+            logger.debug(f"Быстрый разбор неприменим ({e}), используется feedparser.")
+    if parsed is None:
+        parsed = parse_with_feedparser(data, response_headers)
+    parsed["entries"] = [compact_entry(entry) for entry in parsed["entries"]]
+    return parsed
+
+
+def as_feedparser_dict(value: Any) -> Any:
+    """dict/list -> FeedParserDict рекурсивно (атрибутный доступ: entry.links, link.href)."""
+    import feedparser
+
+    if isinstance(value, dict):
+        return feedparser.FeedParserDict({k: as_feedparser_dict(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [as_feedparser_dict(v) for v in value]
+    return value
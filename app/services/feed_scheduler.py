@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.utils.dates import normalize_entry_date
+
+logger = logging.getLogger(__name__)
+
+# Период обновления из sy:updatePeriod (модуль syndication RSS 1.0) в секундах
+_SY_PERIOD_SECONDS = {
+    "hourly": 3600,
+    "daily": 86400,
+    "weekly": 7 * 86400,
+    "monthly": 30 * 86400,
+    "yearly": 365 * 86400,
+}
+
+_MAX_AGE_RE = re.compile(r"max-age\s*=\s*(\d+)", re.IGNORECASE)
+
+# Сколько последних записей учитываем при оценке интервала между публикациями
+_RATE_SAMPLE_SIZE = 20
+# Вес нового наблюдения в экспоненциальном сглаживании интервала
+_EWMA_ALPHA = 0.3
+# Во сколько раз растягиваем интервал, если лента не принесла ничего нового
+_IDLE_GROWTH = 1.5
+
+
+@dataclass
+class FeedPollState:
+    """Состояние опроса одной ленты."""
+    url: str
+    interval: float                      # Текущий (выученный) интервал опроса, сек
+    next_poll_at: float = 0.0            # Unix-время следующего опроса
+    last_poll_at: float = 0.0
+    failures: int = 0                    # Подряд идущие ошибки (для экспоненциального backoff)
+    min_interval_hint: float = 0.0       # Нижняя граница из ttl / Cache-Control, сек
+    newest_entry_ts: float = 0.0         # Время самой свежей виденной записи
+    etag: Optional[str] = None
+    modified: Optional[str] = None
+    polls: int = 0
+    not_modified: int = 0
+
+
+class FeedPollScheduler:
+    """Адаптивный планировщик опроса RSS-лент.
+
+    Для каждой ленты оценивает средний интервал между публикациями и опрашивает
+    активные ленты часто, а тихие редко. Учитывает ttl и sy:updatePeriod из самой
+    ленты, заголовок Cache-Control ответа и экспоненциально откладывает опрос
+    лент, которые подряд отдают ошибки.
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        default_interval: float,
+        state_file: Optional[str] = None,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.default_interval = self._clamp(default_interval)
+        self.state_file = state_file
+        self._states: Dict[str, FeedPollState] = {}
+        self._load()
+
+    # --- Публичный API ---
+
+    def state_for(self, url: str) -> FeedPollState:
+        state = self._states.get(url)
+        if state is None:
+            state = FeedPollState(url=url, interval=self.default_interval)
+            self._states[url] = state
+        return state
+
+    def due_feeds(self, feeds: Iterable[str], now: Optional[float] = None) -> List[str]:
+        """Возвращает ленты, время опроса которых уже наступило."""
+        now = time.time() if now is None else now
+        return [url for url in feeds if self.state_for(url).next_poll_at <= now]
+
+    def conditional_headers(self, url: str) -> Dict[str, Optional[str]]:
+        """etag/modified для условного GET (передаются в feedparser.parse)."""
+        state = self.state_for(url)
+        return {"etag": state.etag, "modified": state.modified}
+
+    def record_success(self, url: str, parsed_feed: Any, now: Optional[float] = None) -> float:
+        """Учитывает успешный опрос ленты и планирует следующий. Возвращает интервал, сек."""
+        now = time.time() if now is None else now
+        state = self.state_for(url)
+        state.failures = 0
+        state.polls += 1
+        state.last_poll_at = now
+        state.etag = parsed_feed.get("etag") or state.etag
+        state.modified = parsed_feed.get("modified") or state.modified
+        state.min_interval_hint = self._hint_from_feed(parsed_feed)
+
+        if parsed_feed.get("status") == 304:
+            state.not_modified += 1
+            state.interval = self._clamp(state.interval * _IDLE_GROWTH)
+        else:
+            entries = parsed_feed.get("entries") or []
+            observed_gap = self._observed_gap(entries) or self._sy_period(parsed_feed)
+            newest = self._newest_timestamp(entries)
+            if observed_gap and state.polls == 1:
+                # Первый успешный опрос: сразу берем наблюдаемый темп вместо значения по умолчанию
+                state.interval = self._clamp(observed_gap)
+            elif observed_gap:
+                state.interval = self._clamp(_EWMA_ALPHA * observed_gap + (1 - _EWMA_ALPHA) * state.interval)
+            if newest is not None and newest <= state.newest_entry_ts:
+                # Ничего нового с прошлого опроса: ленту можно опрашивать реже
+                state.interval = self._clamp(state.interval * _IDLE_GROWTH)
+            if newest is not None:
+                state.newest_entry_ts = max(state.newest_entry_ts, newest)
+
+        # ttl/Cache-Control соблюдаем, но не дольше максимального интервала опроса
+        interval = max(state.interval, min(state.min_interval_hint, self.max_interval))
+        state.next_poll_at = now + interval
+        logger.debug(f"Лента {url}: следующий опрос через {interval / 60:.1f} мин.")
+        return interval
+
+    def record_failure(self, url: str, now: Optional[float] = None) -> float:
+        """Учитывает ошибку опроса: откладывает следующий опрос экспоненциально."""
+        now = time.time() if now is None else now
+        state = self.state_for(url)
+        state.failures += 1
+        state.polls += 1
+        state.last_poll_at = now
+        delay = min(self.max_interval, max(state.interval, self.min_interval * (2 ** state.failures)))
+        delay *= random.uniform(0.9, 1.1)  # Небольшой джиттер, чтобы ленты не синхронизировались
+        state.next_poll_at = now + delay
+        logger.warning(
+            f"Лента {url}: ошибка опроса №{state.failures} подряд, следующая попытка через {delay / 60:.1f} мин."
+        )
+        return delay
+
+    def snapshot(self) -> Dict[str, FeedPollState]:
+        return dict(self._states)
+
+    def save(self) -> None:
+        """Сохраняет выученные интервалы, чтобы они переживали перезапуск бота."""
+        if not self.state_file:
+            return
+        try:
+            with open(self.state_file, "w", encoding="utf-8") as f:
+                json.dump({url: asdict(state) for url, state in self._states.items()}, f)
+        except OSError as e:
+            logger.error(f"Ошибка при сохранении состояния опроса лент в {self.state_file}: {e}")
+
+    # --- Внутренние помощники ---
+
+    def _load(self) -> None:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            for url, data in raw.items():
+                state = FeedPollState(**data)
+                state.interval = self._clamp(state.interval)
+                self._states[url] = state
+            logger.info(f"Загружено состояние опроса для {len(self._states)} лент из {self.state_file}.")
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"Ошибка при загрузке состояния опроса лент из {self.state_file}: {e}")
+
+    def _clamp(self, seconds: float) -> float:
+        return min(self.max_interval, max(self.min_interval, seconds))
+
+    @staticmethod
+    def _timestamps(entries: List[Any]) -> List[float]:
+        stamps = []
+        for entry in entries[:_RATE_SAMPLE_SIZE * 2]:
+            published = normalize_entry_date(entry)
+            if published is not None:
+                stamps.append(published.timestamp())
+        stamps.sort(reverse=True)
+        return stamps[:_RATE_SAMPLE_SIZE]
+
+    def _newest_timestamp(self, entries: List[Any]) -> Optional[float]:
+        stamps = self._timestamps(entries)
+        return stamps[0] if stamps else None
+
+    def _observed_gap(self, entries: List[Any]) -> Optional[float]:
+        """Медианный интервал между соседними публикациями ленты, сек."""
+        stamps = self._timestamps(entries)
+        gaps = [a - b for a, b in zip(stamps, stamps[1:]) if a > b]
+        if not gaps:
+            return None
+        return statistics.median(gaps)
+
+    @staticmethod
+    def _sy_period(parsed_feed: Any) -> Optional[float]:
+        feed = parsed_feed.get("feed") or {}
+        period = _SY_PERIOD_SECONDS.get(str(feed.get("sy_updateperiod", "")).strip().lower())
+        if not period:
+            return None
+        try:
+            frequency = max(1, int(feed.get("sy_updatefrequency", 1)))
+        except (TypeError, ValueError):
+            frequency = 1
+        return period / frequency
+
+    @staticmethod
+    def _hint_from_feed(parsed_feed: Any) -> float:
+        """Нижняя граница интервала из <ttl> (минуты) и Cache-Control: max-age."""
+        hint = 0.0
+        feed = parsed_feed.get("feed") or {}
+        try:
+            hint = max(hint, float(feed.get("ttl", 0)) * 60)
+        except (TypeError, ValueError):
+            pass
+        headers = {str(k).lower(): v for k, v in (parsed_feed.get("headers") or {}).items()}
+        cache_control = headers.get("cache-control", "")
+        if cache_control and "no-cache" not in cache_control.lower():
+            match = _MAX_AGE_RE.search(cache_control)
+            if match:
+                hint = max(hint, float(match.group(1)))
+        return hint
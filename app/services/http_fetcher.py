@@ -0,0 +1,214 @@
+"""Общий HTTP-клиент для загрузки лент и статей с вежливым обходом сайтов.
+
+Одна долгоживущая aiohttp-сессия на процесс: TCPConnector с кэшем DNS,
+keep-alive и ограничением соединений на хост, поэтому DNS, TCP и TLS не
+устанавливаются заново на каждом запуске задачи, а статьи одного издателя
+загружаются по уже открытым соединениям.
+
+Для статей поверх сессии работает планировщик вежливости (PoliteFetcher.get):
+
+- запросы к одному хосту начинаются не чаще раза в FETCH_HOST_DELAY секунд
+  (или Crawl-delay из robots.txt, но не больше FETCH_MAX_HOST_DELAY);
+- robots.txt хоста загружается раз в час и проверяется для нашего
+  User-Agent (RESPECT_ROBOTS_TXT); недоступный robots.txt ничего не запрещает;
+- ответ 429/503 с Retry-After откладывает следующие запросы к этому хосту.
+
+Ленты загружаются через ту же сессию, но без задержек: частотой их опроса
+управляет feed_scheduler.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import aiohttp
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Как долго хранится разобранный robots.txt; при ошибке загрузки - повторная попытка раньше
+ROBOTS_TTL_SECONDS = 3600.0
+ROBOTS_RETRY_SECONDS = 600.0
+# Время жизни записей в кэше DNS и простаивающих keep-alive соединений, сек
+DNS_CACHE_TTL_SECONDS = 300
+KEEPALIVE_TIMEOUT_SECONDS = 30.0
+
+
+class RobotsDisallowed(Exception):
+    """robots.txt запрещает загрузку страницы нашему User-Agent."""
+
+
+class _HostState:
+    """Очередь запросов к одному хосту: время следующего запроса и robots.txt."""
+
+    __slots__ = ("lock", "next_request", "robots", "robots_expires")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.next_request = 0.0
+        self.robots: Optional[RobotFileParser] = None
+        self.robots_expires = 0.0
+
+
+class PoliteFetcher:
+    """Долгоживущая aiohttp-сессия и вежливые запросы к сайтам статей."""
+
+    def __init__(
+        self,
+        user_agent: str,
+        max_connections: int = 100,
+        max_connections_per_host: int = 4,
+        host_delay: float = 1.0,
+        max_host_delay: float = 30.0,
+        respect_robots: bool = True,
+    ):
+        self.user_agent = user_agent
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.host_delay = host_delay
+        self.max_host_delay = max_host_delay
+        self.respect_robots = respect_robots
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._hosts: Dict[str, _HostState] = {}
+        self.robots_blocked = 0
+
+    async def session(self) -> aiohttp.ClientSession:
+        """Общая сессия; создается при первом обращении в текущем event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not None and self._loop is not loop:
+            await self._close_foreign_session()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                ttl_dns_cache=DNS_CACHE_TTL_SECONDS,
+                keepalive_timeout=KEEPALIVE_TIMEOUT_SECONDS,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, headers={"User-Agent": self.user_agent})
+            if self._loop is not loop:
+                self._hosts.clear() # Блокировки хостов привязаны к event loop
+            self._loop = loop
+        return self._session
+
+    async def _close_foreign_session(self) -> None:
+        """Закрывает сессию, созданную в другом event loop (например, прежним asyncio.run CLI или бенчмарка)."""
+        session, self._session = self._session, None
+        if session is None or session.closed:
+            return
+        if self._loop.is_running():
+            # Прежний loop еще работает в другом потоке: закрывать соединения нужно в нем
+            asyncio.run_coroutine_threadsafe(session.close(), self._loop)
+            return
+        try:
+            await session.close()
+        except Exception as e:
+            logger.warning(f"Не удалось закрыть HTTP-сессию прежнего event loop: {e}")
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._hosts.clear()
+
+    def _host(self, url: str) -> _HostState:
+        host = urlsplit(url).netloc.lower()
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState()
+        return state
+
+    async def _robots(self, url: str, state: _HostState) -> RobotFileParser:
+        if state.robots is not None and state.robots_expires > time.monotonic():
+            return state.robots
+        parts = urlsplit(url)
+        robots_url = f"{parts.scheme}://{parts.netloc}/robots.txt"
+        parser = RobotFileParser(robots_url)
+        ttl = ROBOTS_TTL_SECONDS
+        try:
+            session = await self.session()
+            async with session.get(robots_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status >= 500:
+                    parser.allow_all = True
+                    ttl = ROBOTS_RETRY_SECONDS
+                elif response.status >= 400:
+                    parser.allow_all = True # robots.txt нет - ограничений нет
+                else:
+                    parser.parse((await response.text(errors="replace")).splitlines())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug(f"Не удалось загрузить {robots_url}: {e}")
+            parser.allow_all = True
+            ttl = ROBOTS_RETRY_SECONDS
+        parser.modified()
+        state.robots, state.robots_expires = parser, time.monotonic() + ttl
+        return parser
+
+    async def _wait_turn(self, url: str) -> None:
+        """Проверяет robots.txt и ждет очереди к хосту. Бросает RobotsDisallowed."""
+        await self.session()
+        state = self._host(url)
+        async with state.lock:
+            delay = self.host_delay
+            if self.respect_robots:
+                robots = await self._robots(url, state)
+                if not robots.can_fetch(self.user_agent, url):
+                    self.robots_blocked += 1
+                    raise RobotsDisallowed(url)
+                crawl_delay = robots.crawl_delay(self.user_agent)
+                if crawl_delay:
+                    delay = max(delay, min(float(crawl_delay), self.max_host_delay))
+            wait = state.next_request - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            state.next_request = time.monotonic() + delay
+
+    def _back_off(self, url: str, retry_after: Optional[str]) -> None:
+        """После 429/503 откладывает следующие запросы к хосту на Retry-After (в пределах FETCH_MAX_HOST_DELAY)."""
+        try:
+            seconds = float(retry_after) if retry_after else self.max_host_delay
+        except ValueError:
+            seconds = self.max_host_delay # Retry-After в виде HTTP-даты не разбираем
+        state = self._host(url)
+        state.next_request = max(state.next_request, time.monotonic() + min(seconds, self.max_host_delay))
+        logger.warning(f"Сайт {urlsplit(url).netloc} попросил подождать ({retry_after or 'без Retry-After'}), запросы к нему отложены.")
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """GET с учетом robots.txt и очереди к хосту (async with fetcher.get(url) as response)."""
+        await self._wait_turn(url)
+        session = await self.session()
+        async with session.get(url, **kwargs) as response:
+            if response.status in (429, 503):
+                self._back_off(url, response.headers.get("Retry-After"))
+            yield response
+
+    def stats(self) -> Dict[str, int]:
+        return {"hosts": len(self._hosts), "robots_blocked": self.robots_blocked}
+
+
+_http_fetcher: Optional[PoliteFetcher] = None
+
+
+def get_http_fetcher() -> PoliteFetcher:
+    """Общий HTTP-клиент процесса, создаваемый из настроек при первом обращении."""
+    global _http_fetcher
+    if _http_fetcher is None:
+        settings = get_settings()
+        _http_fetcher = PoliteFetcher(
+            user_agent=settings.http_user_agent,
+            max_connections=settings.http_max_connections,
+            max_connections_per_host=settings.http_max_connections_per_host,
+            host_delay=settings.fetch_host_delay,
+            max_host_delay=settings.fetch_max_host_delay,
+            respect_robots=settings.respect_robots_txt,
+        )
+    return _http_fetcher
+
+
+async def close_http_fetcher() -> None:
+    if _http_fetcher is not None:
+        await _http_fetcher.close()
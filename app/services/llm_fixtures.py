@@ -0,0 +1,107 @@
+"""Запись ответов LLM в фикстуры и их поиск для воспроизведения.
+
+Если задан LLM_RECORD_DIR, каждый успешный ответ OpenAI/OpenRouter
+сохраняется в файл <ключ>.json вместе с телом запроса. Ключ - SHA-256 от
+полей запроса, влияющих на ответ (модель, сообщения, температура, max_tokens,
+response_format), поэтому одинаковый запрос всегда попадает в один файл.
+
+Записанный каталог отдает локальная заглушка (python -m app.llm_stub): она
+ищет ответ по тому же ключу, так что разработка и нагрузочные прогоны
+ai_service идут без платного API.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Поля запроса chat completions, от которых зависит ответ
+KEY_FIELDS = ("model", "messages", "temperature", "max_tokens", "response_format")
+
+
+def request_key(body: Dict[str, Any]) -> str:
+    """Ключ фикстуры: SHA-256 от значимых полей запроса в каноническом JSON."""
+    canonical = json.dumps(
+        {field: body[field] for field in KEY_FIELDS if body.get(field) is not None},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMFixtureStore:
+    """Каталог фикстур: один JSON-файл {"request", "response", "recorded_at"} на запрос."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def __len__(self) -> int:
+        if not os.path.isdir(self.directory):
+            return 0
+        return sum(1 for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def record(self, body: Dict[str, Any], response: Dict[str, Any]) -> Optional[str]:
+        """Сохраняет ответ на запрос; возвращает ключ (None при ошибке записи)."""
+        key = request_key(body)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"request": body, "response": response, "recorded_at": time.time()}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            logger.debug(f"Ответ LLM записан в фикстуру {path}.")
+            return key
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Ошибка при записи фикстуры LLM в {self.directory}: {e}")
+            return None
+
+    def lookup(self, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Записанный ответ на такой же запрос или None."""
+        path = self._path(request_key(body))
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)["response"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Ошибка при чтении фикстуры LLM {path}: {e}")
+            return None
+
+    def responses(self) -> List[Dict[str, Any]]:
+        """Все записанные ответы (в порядке имен файлов)."""
+        if not os.path.isdir(self.directory):
+            return []
+        result = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                    result.append(json.load(f)["response"])
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Фикстура LLM {name} пропущена: {e}")
+        return result
+
+
+_llm_recorder: Optional[LLMFixtureStore] = None
+_llm_recorder_configured = False
+
+
+def get_llm_recorder() -> Optional[LLMFixtureStore]:
+    """Хранилище для записи ответов LLM (None - запись выключена, LLM_RECORD_DIR не задан)."""
+    global _llm_recorder, _llm_recorder_configured
+    if not _llm_recorder_configured:
+        record_dir = get_settings().llm_record_dir
+        if record_dir:
+            _llm_recorder = LLMFixtureStore(record_dir)
+            logger.info(f"Ответы LLM записываются в {record_dir}.")
+        _llm_recorder_configured = True
+    return _llm_recorder
@@ -0,0 +1,254 @@
+"""Учет токенов и стоимости LLM, дневной бюджет и переход на более дешевые модели.
+
+Каждый вызов модели записывается в TokenLedger: токены запроса, из них
+кэшированные провайдером (prompt_tokens_details.cached_tokens), токены ответа
+и стоимость по ценам LLM_PRICES. Если провайдер не вернул usage, токены
+оцениваются локально: tiktoken, если он установлен, иначе по длине текста.
+
+Дневной бюджет (LLM_DAILY_TOKEN_BUDGET и/или LLM_DAILY_COST_BUDGET, сутки -
+по BOT_TIMEZONE) расходуется так: до доли LLM_BUDGET_DEGRADE_AT запросы идут
+основной модели, дальше - по очереди моделям из LLM_FALLBACK_MODELS (от
+дорогой к дешевой), а после исчерпания бюджета новые запросы не отправляются
+до следующих суток. Расход за текущие сутки сохраняется в LLM_USAGE_FILE и
+переживает перезапуск.
+
+Стоимость одного поста собирается через track_post_usage (см. scheduler).
+"""
+import json
+import logging
+import math
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from app.config import get_settings
+from app.utils.metrics import LLM_COST, LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Цена: USD за 1M токенов (вход, кэшированный вход, выход)
+ModelPrice = Tuple[float, float, float]
+
+
+def parse_model_prices(raw: Optional[str]) -> Dict[str, ModelPrice]:
+    """Разбирает "gpt-4o-mini=0.15/0.075/0.6,gpt-4o=2.5/1.25/10"; цену кэшированного входа можно опустить."""
+    prices: Dict[str, ModelPrice] = {}
+    for part in (raw or "").split(","):
+        if "=" not in part:
+            continue
+        model, _, values = part.partition("=")
+        try:
+            numbers = [float(v) for v in values.split("/")]
+            if len(numbers) == 2:
+                numbers = [numbers[0], numbers[0], numbers[1]]
+            prompt_price, cached_price, completion_price = numbers
+        except ValueError:
+            logger.warning(f"Некорректная цена модели '{part.strip()}' в LLM_PRICES, пропускаем.")
+            continue
+        prices[model.strip()] = (prompt_price, cached_price, completion_price)
+    return prices
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    """Число токенов текста: tiktoken, если установлен, иначе грубая оценка по длине."""
+    try:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return len(encoding.encode(text))
+    except ImportError:
+        # Около 3 символов на токен для смеси русского и английского текста
+        return math.ceil(len(text) / 3)
+
+
+def count_message_tokens(messages: List[Dict[str, Any]], model: str = "") -> int:
+    """Оценка токенов запроса chat completions (с накладными токенами на сообщение)."""
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list): # Части сообщения (например, с cache_control)
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        total += count_tokens(content or "", model) + 4
+    return total + 2
+
+
+@dataclass
+class Usage:
+    """Расход одного вызова или суммарный расход поста."""
+    calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other: "Usage") -> None:
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.cached_tokens += other.cached_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+
+
+# Расход текущего поста (см. track_post_usage)
+_post_usage: ContextVar[Optional[Usage]] = ContextVar("post_usage", default=None)
+
+
+@contextmanager
+def track_post_usage() -> Iterator[Usage]:
+    """Собирает расход всех вызовов LLM внутри блока (обработка одной новости)."""
+    usage = Usage()
+    token = _post_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _post_usage.reset(token)
+
+
+class TokenLedger:
+    """Расход LLM за текущие сутки и выбор модели с учетом бюджета."""
+
+    def __init__(
+        self,
+        prices: Optional[Dict[str, ModelPrice]] = None,
+        daily_token_budget: int = 0,
+        daily_cost_budget: float = 0.0,
+        degrade_at: float = 0.8,
+        timezone: str = "UTC",
+        state_file: Optional[str] = None,
+    ):
+        self.prices = prices or {}
+        self.daily_token_budget = daily_token_budget
+        self.daily_cost_budget = daily_cost_budget
+        self.degrade_at = degrade_at
+        self.timezone = ZoneInfo(timezone)
+        self.state_file = state_file
+        self.day = self._today()
+        self.today = Usage()
+        self.models: Dict[str, Usage] = {}
+        self._unpriced: set = set()
+        self._load()
+
+    def _today(self) -> str:
+        return datetime.now(self.timezone).strftime("%Y-%m-%d")
+
+    def _roll_day(self) -> None:
+        day = self._today()
+        if day != self.day:
+            logger.info(f"Расход LLM за {self.day}: {self.today.total_tokens} токенов, ${self.today.cost:.4f}.")
+            self.day, self.today, self.models = day, Usage(), {}
+
+    def cost(self, model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+        price = self.prices.get(model)
+        if price is None:
+            if model not in self._unpriced:
+                self._unpriced.add(model)
+                logger.warning(f"Нет цены модели {model} в LLM_PRICES: ее стоимость считается нулевой.")
+            return 0.0
+        prompt_price, cached_price, completion_price = price
+        return (
+            (prompt_tokens - cached_tokens) * prompt_price + cached_tokens * cached_price + completion_tokens * completion_price
+        ) / 1_000_000
+
+    def record(self, provider: str, model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> Usage:
+        """Учитывает вызов: метрики, расход за сутки, расход текущего поста."""
+        self._roll_day()
+        cached_tokens = min(cached_tokens, prompt_tokens)
+        usage = Usage(1, prompt_tokens, cached_tokens, completion_tokens, self.cost(model, prompt_tokens, cached_tokens, completion_tokens))
+        LLM_TOKENS.inc(prompt_tokens, provider=provider, kind="prompt")
+        LLM_TOKENS.inc(cached_tokens, provider=provider, kind="cached")
+        LLM_TOKENS.inc(completion_tokens, provider=provider, kind="completion")
+        LLM_COST.inc(usage.cost, provider=provider, model=model)
+        self.today.add(usage)
+        self.models.setdefault(model, Usage()).add(usage)
+        post_usage = _post_usage.get()
+        if post_usage is not None:
+            post_usage.add(usage)
+        self.save()
+        return usage
+
+    def spent_ratio(self) -> float:
+        """Доля израсходованного дневного бюджета (наибольшая из токенов и стоимости; 0 - бюджета нет)."""
+        self._roll_day()
+        ratios = [0.0]
+        if self.daily_token_budget > 0:
+            ratios.append(self.today.total_tokens / self.daily_token_budget)
+        if self.daily_cost_budget > 0:
+            ratios.append(self.today.cost / self.daily_cost_budget)
+        return max(ratios)
+
+    def exhausted(self) -> bool:
+        return self.spent_ratio() >= 1.0
+
+    def choose_model(self, primary: str, fallbacks: List[str]) -> Optional[str]:
+        """Модель для следующего вызова; None - дневной бюджет исчерпан.
+
+        Между LLM_BUDGET_DEGRADE_AT и полным бюджетом промежуток делится поровну
+        между запасными моделями: чем ближе к исчерпанию, тем дешевле модель.
+        """
+        ratio = self.spent_ratio()
+        if ratio >= 1.0:
+            return None
+        if ratio < self.degrade_at or not fallbacks:
+            return primary
+        step = (1.0 - self.degrade_at) / len(fallbacks)
+        return fallbacks[min(len(fallbacks) - 1, int((ratio - self.degrade_at) / step))]
+
+    def stats(self) -> Dict[str, Any]:
+        """Сводка для /status."""
+        return {"day": self.day, "usage": self.today, "spent_ratio": self.spent_ratio(), "models": dict(self.models)}
+
+    def save(self) -> None:
+        if not self.state_file:
+            return
+        try:
+            with open(self.state_file, "w", encoding="utf-8") as f:
+                json.dump({
+                    "day": self.day,
+                    "today": self.today.__dict__,
+                    "models": {model: usage.__dict__ for model, usage in self.models.items()},
+                }, f)
+        except OSError as e:
+            logger.error(f"Ошибка при сохранении расхода LLM в {self.state_file}: {e}")
+
+    def _load(self) -> None:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            if raw.get("day") != self.day:
+                return # Расход прошлых суток бюджет не уменьшает
+            self.today = Usage(**raw.get("today", {}))
+            self.models = {model: Usage(**usage) for model, usage in raw.get("models", {}).items()}
+            logger.info(f"Расход LLM за {self.day} загружен из {self.state_file}: {self.today.total_tokens} токенов, ${self.today.cost:.4f}.")
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке расхода LLM из {self.state_file}: {e}")
+
+
+_token_ledger: Optional[TokenLedger] = None
+
+
+def get_token_ledger() -> TokenLedger:
+    global _token_ledger
+    if _token_ledger is None:
+        settings = get_settings()
+        _token_ledger = TokenLedger(
+            prices=parse_model_prices(settings.llm_prices),
+            daily_token_budget=settings.llm_daily_token_budget,
+            daily_cost_budget=settings.llm_daily_cost_budget,
+            degrade_at=settings.llm_budget_degrade_at,
+            timezone=settings.bot_timezone,
+            state_file=settings.llm_usage_file,
+        )
+    return _token_ledger
@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import logging
+import math
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from app.utils.dates import normalize_entry_date
+
+logger = logging.getLogger(__name__)
+
+# Штраф для записи, заголовок которой уже встречался (та же новость из другой ленты)
+DUPLICATE_TITLE_PENALTY = 0.3
+
+_NON_WORD_RE = re.compile(r"\W+", re.UNICODE)
+
+
+def title_fingerprint(title: str) -> str:
+    """Нормализованный заголовок для грубого поиска дублей между лентами."""
+    return _NON_WORD_RE.sub(" ", (title or "").lower()).strip()
+
+
+def parse_source_weights(raw: Optional[str]) -> Dict[str, float]:
+    """Разбирает строку вида "wired.com=1.5,rss.app=0.8" в словарь {домен: вес}."""
+    weights: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        if "=" not in part:
+            continue
+        domain, _, value = part.partition("=")
+        try:
+            weights[domain.strip().lower()] = float(value)
+        except ValueError:
+            logger.warning(f"Некорректный вес источника '{part.strip()}' в SOURCE_WEIGHTS, пропускаем.")
+    return weights
+
+
+@dataclass(order=True)
+class Candidate:
+    """Кандидат на публикацию в очереди."""
+    sort_key: float
+    seq: int
+    link: str = field(compare=False)
+    score: float = field(compare=False)
+    entry: Any = field(compare=False, repr=False)
+    enqueued_at: float = field(compare=False, default_factory=time.time)
+
+
+class CandidateQueue:
+    """Ранжированная очередь новостей-кандидатов на публикацию.
+
+    Оценка = вес источника * свежесть * штраф за дубль. Свежесть затухает
+    экспоненциально с периодом полураспада freshness_half_life; так как затухание
+    одинаково для всех записей, порядок кандидатов со временем не меняется и
+    ключ кучи можно вычислить один раз при добавлении.
+    """
+
+    def __init__(
+        self,
+        freshness_half_life: float,
+        source_weights: Optional[Dict[str, float]] = None,
+        max_size: int = 500,
+        max_age: Optional[float] = None,
+        is_posted: Optional[Callable[[str], bool]] = None,
+    ):
+        if freshness_half_life <= 0:
+            raise ValueError(f"Период полураспада свежести должен быть больше 0, получено {freshness_half_life}")
+        self.freshness_half_life = freshness_half_life
+        self.source_weights = source_weights or {}
+        self.max_size = max_size
+        self.max_age = max_age
+        self.is_posted = is_posted or (lambda link: False)
+        self._heap: List[Candidate] = []
+        self._queued_links: set = set()
+        self._seen_titles: set = set()
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, link: str) -> bool:
+        return link in self._queued_links
+
+    def source_weight(self, entry: Any) -> float:
+        source_url = entry.get("feed_source_url") or entry.get("link") or ""
+        host = urlparse(source_url).netloc.lower()
+        for domain, weight in self.source_weights.items():
+            if host == domain or host.endswith("." + domain):
+                return weight
+        return 1.0
+
+    def _published_ts(self, entry: Any, now: float) -> float:
+        published = normalize_entry_date(entry)
+        # Записи без даты считаем "давними", чтобы они не вытесняли свежие новости
+        return published.timestamp() if published else now - self.freshness_half_life * 4
+
+    def _static_weight(self, entry: Any) -> float:
+        penalty = DUPLICATE_TITLE_PENALTY if title_fingerprint(entry.get("title", "")) in self._seen_titles else 1.0
+        return self.source_weight(entry) * penalty
+
+    def score(self, entry: Any, now: Optional[float] = None) -> float:
+        """Текущая оценка записи (чем больше, тем раньше будет опубликована)."""
+        now = time.time() if now is None else now
+        age = max(0.0, now - self._published_ts(entry, now))
+        return self._static_weight(entry) * math.pow(0.5, age / self.freshness_half_life)
+
+    def push(self, entry: Any, now: Optional[float] = None) -> bool:
+        """Добавляет запись в очередь. Возвращает False для дублей и уже опубликованных."""
+        link = entry.get("link")
+        if not link or link in self._queued_links or self.is_posted(link):
+            return False
+        now = time.time() if now is None else now
+        weight = self._static_weight(entry)
+        if weight <= 0:
+            return False
+        published_ts = self._published_ts(entry, now)
+        # log(оценки) = log(weight) - ln2 * (now - published_ts) / half_life; слагаемое с now
+        # одинаково для всех кандидатов, поэтому для сравнения его можно отбросить
+        sort_key = -(math.log(weight) + math.log(2) * published_ts / self.freshness_half_life)
+        score = self.score(entry, now)
+        heapq.heappush(self._heap, Candidate(sort_key, next(self._counter), link, score, entry, now))
+        self._queued_links.add(link)
+        if len(self._seen_titles) > self.max_size * 10:
+            self._seen_titles.clear()  # Ограничиваем память: история заголовков нужна только для недавних дублей
+        self._seen_titles.add(title_fingerprint(entry.get("title", "")))
+        if len(self._heap) > self.max_size * 2:
+            self._trim()
+        return True
+
+    def peek(self, n: int) -> List[Any]:
+        """Записи n лучших кандидатов без извлечения из очереди."""
+        return [candidate.entry for candidate in heapq.nsmallest(n, self._heap)]
+
+    def pop_best(self, now: Optional[float] = None) -> Optional[Any]:
+        """Извлекает лучшую запись, отбрасывая устаревшие и уже опубликованные."""
+        now = time.time() if now is None else now
+        while self._heap:
+            candidate = heapq.heappop(self._heap)
+            self._queued_links.discard(candidate.link)
+            if self.is_posted(candidate.link):
+                continue
+            published = normalize_entry_date(candidate.entry)
+            if self.max_age and published and now - published.timestamp() > self.max_age:
+                logger.info(f"Кандидат устарел и удален из очереди: {candidate.link}")
+                continue
+            return candidate.entry
+        return None
+
+    def _trim(self) -> None:
+        """Оставляет в очереди только max_size лучших кандидатов."""
+        kept = heapq.nsmallest(self.max_size, self._heap)
+        dropped = len(self._heap) - len(kept)
+        self._heap = kept
+        heapq.heapify(self._heap)
+        self._queued_links = {candidate.link for candidate in kept}
+        logger.info(f"Очередь кандидатов переполнена, отброшено {dropped} наименее приоритетных записей.")
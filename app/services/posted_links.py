@@ -0,0 +1,138 @@
+"""Учет опубликованных ссылок канала: фильтр Блума впереди, точное хранилище позади.
+
+Ссылка превращается в 64-битный хеш (blake2b). Проверка сначала идет по
+вращающемуся фильтру Блума (app.utils.bloom) в файле <posted_links_file>.bloom:
+ответ "нет" - окончательный и не требует обращения к диску, а редкое "возможно"
+подтверждается в SQLite-базе <posted_links_file>.db с хешами опубликованных ссылок.
+
+Фильтр рассчитан на POSTED_LINKS_CAPACITY ссылок в поколении с долей ложных
+срабатываний POSTED_LINKS_ERROR_RATE и помнит два поколения, поэтому старая
+статья, снова появившаяся в ленте, не публикуется повторно, пока после нее не
+опубликованы миллионы других. При вращении фильтра из базы удаляются хеши
+вышедшего поколения: ни память, ни диск не растут без ограничений.
+
+Старый текстовый posted_links_file (по ссылке в строке) импортируется при
+первом запуске. Если файл фильтра потерян или его параметры изменились, фильтр
+восстанавливается из базы.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Optional
+
+from app.utils.bloom import RotatingBloomFilter
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS links (
+    digest INTEGER PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    added REAL NOT NULL
+);
+"""
+_MASK64 = (1 << 64) - 1
+
+
+def link_digest(link: str) -> int:
+    """64-битный хеш ссылки со знаком (так его хранит INTEGER в SQLite)."""
+    return int.from_bytes(hashlib.blake2b(link.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+class PostedLinks:
+    """Опубликованные в канал ссылки.
+
+    Файлы открываются лениво, при первой проверке.
+    """
+
+    def __init__(self, file_path: str, capacity: int = 1_000_000, error_rate: float = 0.001):
+        self.file_path = file_path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        base = os.path.splitext(file_path)[0]
+        self.bloom_path = f"{base}.bloom"
+        self.db_path = f"{base}.db"
+        self._bloom: Optional[RotatingBloomFilter] = None
+        self._db: Optional[sqlite3.Connection] = None
+        # Сколько раз фильтр сказал "возможно", а база не подтвердила
+        self.false_positives = 0
+
+    def __len__(self) -> int:
+        """Число ссылок в двух поколениях фильтра (без обращения к базе)."""
+        self._ensure_loaded()
+        return len(self._bloom)
+
+    def __contains__(self, link: str) -> bool:
+        self._ensure_loaded()
+        digest = link_digest(link)
+        if digest & _MASK64 not in self._bloom:
+            return False
+        if self._db.execute("SELECT 1 FROM links WHERE digest = ?", (digest,)).fetchone():
+            return True
+        self.false_positives += 1
+        return False
+
+    def _ensure_loaded(self) -> None:
+        if self._bloom is not None:
+            return
+        self._db = sqlite3.connect(self.db_path)
+        self._db.executescript(_SCHEMA)
+        self._import_text_file()
+        self._bloom = RotatingBloomFilter(self.bloom_path, self.capacity, self.error_rate)
+        if self._bloom.created:
+            generation = max(1, self._db.execute("SELECT MAX(generation) FROM links").fetchone()[0] or 0)
+            rows = ((digest & _MASK64, row_generation) for digest, row_generation in self._db.execute("SELECT digest, generation FROM links"))
+            restored = self._bloom.rebuild(rows, generation)
+            self._db.execute("DELETE FROM links WHERE generation < ?", (generation - 1,))
+            self._db.commit()
+            if restored:
+                logger.info(f"Фильтр опубликованных ссылок {self.bloom_path} восстановлен из {self.db_path}: {restored} ссылок.")
+        logger.info(f"Опубликованных ссылок в {self.db_path}: {len(self._bloom)}.")
+
+    def _import_text_file(self) -> None:
+        """Переносит ссылки из текстового файла прежнего формата, если база еще пуста."""
+        if not os.path.exists(self.file_path) or self._db.execute("SELECT 1 FROM links LIMIT 1").fetchone():
+            return
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                links = {line.strip() for line in f if line.strip() and not line.startswith("#")}
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке ссылок из {self.file_path}: {e}", exc_info=True)
+            return
+        now = time.time()
+        self._db.executemany(
+            "INSERT OR IGNORE INTO links (digest, generation, added) VALUES (?, 1, ?)",
+            ((link_digest(link), now) for link in links),
+        )
+        self._db.commit()
+        logger.info(f"Импортировано {len(links)} ссылок из {self.file_path} в {self.db_path}.")
+
+    def add(self, link: str) -> None:
+        """Отмечает ссылку опубликованной в фильтре и в базе."""
+        if link in self:
+            return
+        digest = link_digest(link)
+        previous_generation = self._bloom.generation
+        generation = self._bloom.add(digest & _MASK64)
+        try:
+            self._db.execute(
+                "INSERT OR IGNORE INTO links (digest, generation, added) VALUES (?, ?, ?)", (digest, generation, time.time())
+            )
+            if generation != previous_generation:
+                # Фильтр повернулся: хеши очищенного поколения больше не проверяются
+                self._db.execute("DELETE FROM links WHERE generation < ?", (generation - 1,))
+            self._db.commit()
+            self._bloom.flush()
+            logger.debug(f"Ссылка {link} сохранена в {self.db_path}.")
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении ссылки в {self.db_path}: {e}", exc_info=True)
+
+    def close(self) -> None:
+        if self._bloom is not None:
+            self._bloom.close()
+            self._bloom = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
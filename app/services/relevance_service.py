@@ -0,0 +1,186 @@
+import json
+import logging
+import math
+import os
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Ключевые слова темы канала (AI и промпт-инжиниринг) и их веса.
+# Паттерны применяются к нижнему регистру заголовка и краткого описания.
+KEYWORD_PATTERNS: List[Tuple[re.Pattern, float]] = [
+    (re.compile(r"\bprompt(s|ing| engineering)?\b|промпт"), 3.0),
+    (re.compile(r"\b(llms?|large language models?|gpt-?\w*|chatgpt|openai|anthropic|claude|gemini|llama|mistral|copilot)\b"), 2.5),
+    (re.compile(r"\b(ai|a\.i\.|artificial intelligence|genai|generative)\b|\bии\b|искусственн\w* интеллект"), 2.0),
+    (re.compile(r"\b(machine learning|deep learning|neural (net|network)s?|transformers?|diffusion|fine-?tun\w*|rag|embeddings?|agents?)\b|нейросет\w*|машинн\w* обучени\w*"), 1.5),
+    (re.compile(r"\b(model|dataset|benchmark|inference|chatbot|robot\w*|automation)s?\b|модел\w*|чат-?бот\w*"), 0.7),
+]
+# Признаки явно нерелевантных материалов (скидки, гаджеты, обзоры товаров)
+NEGATIVE_PATTERNS: List[Tuple[re.Pattern, float]] = [
+    (re.compile(r"\b(deal|deals|discount|coupon|sale|promo code|black friday|cyber monday)\b|скидк\w*|промокод\w*"), -2.5),
+    (re.compile(r"\b(review|hands-on|best \w+ (of|for) 20\d\d|gift guide)\b|обзор \w+"), -1.0),
+]
+
+# Смещение логистической функции для ключевых слов: без совпадений вероятность ~0.12
+_KEYWORD_BIAS = -2.0
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_TOKEN_RE = re.compile(r"[\w\-]+", re.UNICODE)
+
+
+def _sigmoid(x: float) -> float:
+    if x < -30:
+        return 0.0
+    if x > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+def _prepare_text(title: str, summary: str) -> str:
+    return f"{title or ''} {_TAG_RE.sub(' ', summary or '')}".lower()
+
+
+class HashedLinearModel:
+    """Логистическая регрессия на хешированных признаках (униграммы и биграммы).
+
+    Обучается онлайн по одному примеру (SGD), хранит только ненулевые веса,
+    поэтому модель компактна и сохраняется в обычный JSON-файл.
+    """
+
+    def __init__(self, n_buckets: int = 2 ** 18, learning_rate: float = 0.1, l2: float = 1e-4):
+        self.n_buckets = n_buckets
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.bias = 0.0
+        self.weights: Dict[int, float] = {}
+        self.updates = 0
+
+    def features(self, text: str) -> Dict[int, float]:
+        tokens = _TOKEN_RE.findall(text)
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        features: Dict[int, float] = {}
+        for gram in grams:
+            index = zlib.crc32(gram.encode("utf-8")) % self.n_buckets
+            features[index] = features.get(index, 0.0) + 1.0
+        # Нормируем, чтобы длинные описания не доминировали
+        norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+        return {i: v / norm for i, v in features.items()}
+
+    def predict(self, text: str) -> float:
+        features = self.features(text)
+        return _sigmoid(self.bias + sum(self.weights.get(i, 0.0) * v for i, v in features.items()))
+
+    def update(self, text: str, label: bool) -> float:
+        """Один шаг SGD. Возвращает предсказание до обновления."""
+        features = self.features(text)
+        prediction = _sigmoid(self.bias + sum(self.weights.get(i, 0.0) * v for i, v in features.items()))
+        gradient = (1.0 if label else 0.0) - prediction
+        self.bias += self.learning_rate * gradient
+        for i, v in features.items():
+            weight = self.weights.get(i, 0.0)
+            weight += self.learning_rate * (gradient * v - self.l2 * weight)
+            self.weights[i] = weight
+        self.updates += 1
+        return prediction
+
+    def to_dict(self) -> dict:
+        return {
+            "n_buckets": self.n_buckets,
+            "bias": self.bias,
+            "updates": self.updates,
+            "weights": {str(i): w for i, w in self.weights.items() if abs(w) > 1e-6},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HashedLinearModel":
+        model = cls(n_buckets=int(data.get("n_buckets", 2 ** 18)))
+        model.bias = float(data.get("bias", 0.0))
+        model.updates = int(data.get("updates", 0))
+        model.weights = {int(i): float(w) for i, w in data.get("weights", {}).items()}
+        return model
+
+
+class RelevanceClassifier:
+    """Дешевый локальный фильтр релевантности новости теме канала.
+
+    Комбинирует оценку по ключевым словам с хешированной линейной моделью,
+    обученной на решениях администратора (опубликовать/отменить в /prepare_post).
+    Пока модель видела мало примеров, решение принимается только по ключевым словам.
+    """
+
+    def __init__(self, model_file: Optional[str] = None, threshold: float = 0.3, min_updates: int = 20):
+        self.model_file = model_file
+        self.threshold = threshold
+        self.min_updates = min_updates
+        self.model = self._load()
+
+    def keyword_score(self, text: str) -> float:
+        raw = _KEYWORD_BIAS
+        for pattern, weight in KEYWORD_PATTERNS + NEGATIVE_PATTERNS:
+            if pattern.search(text):
+                raw += weight
+        return _sigmoid(raw)
+
+    def score(self, title: str, summary: str) -> float:
+        """Вероятность (0..1) того, что новость по теме канала."""
+        text = _prepare_text(title, summary)
+        keyword_probability = self.keyword_score(text)
+        if self.model.updates < self.min_updates:
+            return keyword_probability
+        # Доверие к модели растет с числом примеров, но ключевые слова всегда учитываются
+        model_weight = min(0.7, self.model.updates / (self.model.updates + 100))
+        return (1 - model_weight) * keyword_probability + model_weight * self.model.predict(text)
+
+    def is_relevant(self, title: str, summary: str) -> Tuple[bool, float]:
+        score = self.score(title, summary)
+        return score >= self.threshold, score
+
+    def learn(self, title: str, summary: str, relevant: bool) -> None:
+        """Обучает модель на решении администратора и сохраняет ее."""
+        text = _prepare_text(title, summary)
+        prediction = self.model.update(text, relevant)
+        logger.info(
+            f"Модель релевантности обновлена ({'публикация' if relevant else 'отмена'}), "
+            f"предсказание до обновления: {prediction:.2f}, всего примеров: {self.model.updates}."
+        )
+        self.save()
+
+    def save(self) -> None:
+        if not self.model_file:
+            return
+        try:
+            with open(self.model_file, "w", encoding="utf-8") as f:
+                json.dump(self.model.to_dict(), f)
+        except OSError as e:
+            logger.error(f"Ошибка при сохранении модели релевантности в {self.model_file}: {e}")
+
+    def _load(self) -> HashedLinearModel:
+        if self.model_file and os.path.exists(self.model_file):
+            try:
+                with open(self.model_file, "r", encoding="utf-8") as f:
+                    model = HashedLinearModel.from_dict(json.load(f))
+                logger.info(f"Загружена модель релевантности из {self.model_file} ({model.updates} примеров).")
+                return model
+            except (OSError, ValueError, TypeError) as e:
+                logger.error(f"Ошибка при загрузке модели релевантности из {self.model_file}: {e}")
+        return HashedLinearModel()
+
+
+# Общий экземпляр фильтра: используется планировщиком и обучается из админ-команд.
+# Создается лениво, чтобы импорт модуля не читал модель с диска.
+_relevance_classifier: Optional[RelevanceClassifier] = None
+
+
+def get_relevance_classifier() -> RelevanceClassifier:
+    global _relevance_classifier
+    if _relevance_classifier is None:
+        settings = get_settings()
+        _relevance_classifier = RelevanceClassifier(
+            model_file=settings.relevance_model_file,
+            threshold=settings.relevance_threshold,
+        )
+    return _relevance_classifier
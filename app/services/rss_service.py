@@ -1,46 +1,151 @@
-import feedparser
 import asyncio
+import heapq
 import logging
-from typing import List, Dict, Any # Changed Optional to Any for entry
-from app.config import FEEDS # Changed from RSS_FEED_URL to FEEDS
-import time # Added for sorting by date
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from collections import Counter
+from typing import List, Dict, Any, Optional # Changed Optional to Any for entry
+
+import aiohttp
+
+from app.config import get_settings
 from datetime import datetime # Added for robust date parsing
+from app.utils.dates import MIN_UTC_DATETIME, normalize_entry_date
+from app.services.feed_content import prune_feed_content, spill_entry_content
+from app.services.feed_parser import as_feedparser_dict, parse_feed_bytes
+from app.services.feed_scheduler import FeedPollScheduler
+from app.services.http_fetcher import get_http_fetcher
+from app.services.runtime_state import get_runtime_state
+from app.utils.metrics import FAILURES, FEED_TICK_MEMORY, track_stage
 
 logger = logging.getLogger(__name__)
 
+# Планировщик адаптивного опроса: решает, какие ленты пора опрашивать на очередном тике.
+# Создается лениво при первом опросе (читает сохраненное состояние с диска).
+_feed_poll_scheduler: Optional[FeedPollScheduler] = None
+
+def get_feed_poll_scheduler() -> FeedPollScheduler:
+    global _feed_poll_scheduler
+    if _feed_poll_scheduler is None:
+        settings = get_settings()
+        posting_interval = settings.posting_interval_minutes if settings.posting_interval_minutes > 0 else 60
+        _feed_poll_scheduler = FeedPollScheduler(
+            min_interval=settings.feed_min_poll_minutes * 60,
+            max_interval=settings.feed_max_poll_minutes * 60,
+            default_interval=posting_interval * 60,
+            state_file=settings.feed_poll_state_file,
+        )
+    return _feed_poll_scheduler
+
+# Накопленное число записей с неразбираемой датой по каждой ленте (для отчётов/статуса)
+UNPARSEABLE_DATE_COUNTS: Counter = Counter()
+
 def get_entry_published_datetime(entry: Dict[str, Any]) -> Optional[datetime]:
-    """Safely retrieves and parses the publication date of an RSS entry."""
-    published_parsed = entry.get('published_parsed')
-    if published_parsed:
-        try:
-            return datetime.fromtimestamp(time.mktime(published_parsed))
-        except Exception:
-            pass # Invalid struct_time
-
-    published_str = entry.get('published') or entry.get('updated')
-    if published_str:
-        try:
-            # Try parsing with feedparser's own utility if available, or common formats
-            # For simplicity, directly trying common datetime formats if feedparser hasn't parsed it
-            # This part might need to be more robust if various date formats are common
-            return datetime.strptime(published_str, "%a, %d %b %Y %H:%M:%S %z") # RFC 822
-        except ValueError:
-            try:
-                return datetime.strptime(published_str, "%Y-%m-%dT%H:%M:%SZ") # ISO 8601
-            except ValueError:
-                logger.warning(f"Could not parse date string: {published_str} for entry {entry.get('title', 'N/A')}")
-    return None
-
-
-async def fetch_single_feed(feed_url: str, loop: asyncio.AbstractEventLoop) -> List[Dict[str, Any]]:
-    """Асинхронно загружает и парсит одну RSS-ленту."""
+    """Возвращает дату публикации записи как tz-aware datetime в UTC.
+
+    Дата разбирается один раз и кэшируется в самой записи, поэтому функцию
+    можно дёшево вызывать и как ключ сортировки, и при постинге.
+    """
+    return normalize_entry_date(entry)
+
+
+def _normalize_feed_dates(feed_url: str, entries: List[Dict[str, Any]]) -> None:
+    """Разбирает даты всех записей ленты и сводно сообщает о неразбираемых."""
+    unparseable = sum(1 for entry in entries if normalize_entry_date(entry) is None)
+    if unparseable:
+        UNPARSEABLE_DATE_COUNTS[feed_url] += unparseable
+        logger.warning(
+            f"Не удалось разобрать дату публикации у {unparseable} из {len(entries)} записей ленты {feed_url}"
+        )
+
+
+# Пул процессов для разбора лент: разбор не держит GIL основного процесса с event loop.
+# Создается при первом опросе; FEED_PARSE_WORKERS=0 - разбор в пуле потоков, как раньше.
+_feed_parse_pool: Optional[ProcessPoolExecutor] = None
+
+def get_feed_parse_pool() -> Optional[ProcessPoolExecutor]:
+    global _feed_parse_pool
+    workers = get_settings().feed_parse_workers
+    if workers <= 0:
+        return None
+    if _feed_parse_pool is None:
+        _feed_parse_pool = ProcessPoolExecutor(max_workers=workers)
+    return _feed_parse_pool
+
+def shutdown_feed_parse_pool() -> None:
+    """Останавливает пул процессов разбора лент (при завершении бота)."""
+    global _feed_parse_pool
+    if _feed_parse_pool is not None:
+        _feed_parse_pool.shutdown(wait=False, cancel_futures=True)
+        _feed_parse_pool = None
+
+async def parse_feed(data: bytes, response_headers: Dict[str, str]) -> Dict[str, Any]:
+    """Разбирает байты ленты в пуле процессов (при сбое пула - в пуле потоков)."""
+    parse = partial(parse_feed_bytes, data, response_headers, get_settings().feed_fast_parser)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_feed_parse_pool(), parse)
+    except BrokenProcessPool:
+        global _feed_parse_pool
+        logger.error("Пул процессов разбора лент аварийно завершился, пересоздаем; эта лента разбирается в потоке.")
+        _feed_parse_pool = None
+        return await loop.run_in_executor(None, parse)
+
+@track_stage("feed_fetch")
+async def fetch_single_feed(feed_url: str, session: aiohttp.ClientSession, conditional: bool = False) -> List[Dict[str, Any]]:
+    """Асинхронно загружает одну RSS-ленту и разбирает ее в пуле процессов.
+
+    conditional=True - опрос сборщика: условный GET и обновление состояния адаптивного
+    планировщика (валидаторы, новейшая запись, интервал). conditional=False загружает
+    ленту целиком и состояние не трогает: ручная загрузка не должна скрыть от сборщика
+    записи, появившиеся после его последнего опроса.
+    """
     logger.info(f"Загрузка RSS-ленты: {feed_url}")
+    feed_poll_scheduler = get_feed_poll_scheduler()
+    runtime_state = get_runtime_state()
+    # Условный GET: при неизменной ленте сервер ответит 304 без тела
+    validators = feed_poll_scheduler.conditional_headers(feed_url) if conditional else {}
+    request_headers = {}
+    if validators.get("etag"):
+        request_headers["If-None-Match"] = validators["etag"]
+    if validators.get("modified"):
+        request_headers["If-Modified-Since"] = validators["modified"]
     try:
-        parsed_feed = await asyncio.wait_for(
-            loop.run_in_executor(None, feedparser.parse, feed_url), 
-            timeout=30.0
-        )
-        
+        async with session.get(feed_url, headers=request_headers, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            response_headers = {k.lower(): v for k, v in response.headers.items()}
+            http_info = {
+                "status": response.status,
+                "etag": response_headers.get("etag"),
+                "modified": response_headers.get("last-modified"),
+                "headers": response_headers,
+            }
+            if response.status == 304:
+                logger.info(f"RSS-лента не изменилась с прошлого опроса (304): {feed_url}")
+                feed_poll_scheduler.record_success(feed_url, http_info)
+                runtime_state.record_feed(feed_url, "not_modified")
+                return []
+            response.raise_for_status()
+            data = await response.read()
+
+        parsed_feed = as_feedparser_dict(dict(await asyncio.wait_for(parse_feed(data, response_headers), timeout=30.0), **http_info))
+
+        if parsed_feed.bozo and not parsed_feed.entries:
+            logger.error(
+                f"Не удалось разобрать RSS-ленту: {feed_url}, "
+                f"ошибка: {parsed_feed.bozo_exception}"
+            )
+            if conditional:
+                feed_poll_scheduler.record_failure(feed_url)
+            runtime_state.record_feed(feed_url, "error", error=f"parse: {parsed_feed.bozo_exception}")
+            FAILURES.inc(reason="feed_parse")
+            return []
+
+        if conditional:
+            feed_poll_scheduler.record_success(feed_url, parsed_feed)
+        runtime_state.record_feed(feed_url, "ok", entries=len(parsed_feed.entries))
+
         if parsed_feed.bozo:
             logger.warning(
                 f"RSS-лента может быть некорректно сформирована: {feed_url}, "
@@ -48,10 +153,13 @@ async def fetch_single_feed(feed_url: str, loop: asyncio.AbstractEventLoop) -> L
             )
 
         if parsed_feed.entries:
-            logger.info(f"Найдено {len(parsed_feed.entries)} записей в RSS-ленте: {feed_url}")
+            logger.info(f"Найдено {len(parsed_feed.entries)} записей в RSS-ленте ({parsed_feed.parser}): {feed_url}")
             # Add feed_url to each entry for context if needed later
             for entry in parsed_feed.entries:
                 entry['feed_source_url'] = feed_url
+            _normalize_feed_dates(feed_url, parsed_feed.entries)
+            # Длинный текст статей из ленты не держим в памяти до публикации
+            spill_entry_content(parsed_feed.entries)
             return parsed_feed.entries
         else:
             logger.warning(f"В RSS-ленте не найдено записей: {feed_url}")
@@ -59,55 +167,122 @@ async def fetch_single_feed(feed_url: str, loop: asyncio.AbstractEventLoop) -> L
             
     except asyncio.TimeoutError:
         logger.error(f"Тайм-аут при загрузке или парсинге RSS-ленты {feed_url}")
+        if conditional:
+            feed_poll_scheduler.record_failure(feed_url)
+        runtime_state.record_feed(feed_url, "error", error="timeout")
+        FAILURES.inc(reason="feed_timeout")
+        return []
+    except aiohttp.ClientError as e:
+        logger.error(f"HTTP ошибка при загрузке RSS-ленты {feed_url}: {e}")
+        if conditional:
+            feed_poll_scheduler.record_failure(feed_url)
+        runtime_state.record_feed(feed_url, "error", error=str(e))
+        FAILURES.inc(reason="feed_http")
         return []
     except Exception as e:
         logger.error(f"Ошибка при загрузке или парсинге RSS-ленты {feed_url}: {e}", exc_info=True)
+        if conditional:
+            feed_poll_scheduler.record_failure(feed_url)
+        runtime_state.record_feed(feed_url, "error", error=str(e))
+        FAILURES.inc(reason="feed_error")
         return []
 
-async def fetch_feed_entries() -> List[Dict[str, Any]]: # Changed return type
+async def fetch_feed_entries(
+    only_due: bool = False, feeds: Optional[List[str]] = None, conditional: bool = False, limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
     """Асинхронно загружает и парсит RSS-ленты из списка FEEDS в конфигурации.
     Собранные записи сортируются по дате публикации (от новых к старым).
 
+    Args:
+        only_due: Если True, опрашиваются только ленты, для которых адаптивный
+                  планировщик считает, что пора (см. feed_scheduler.FeedPollScheduler).
+        feeds: Список лент вместо FEEDS (например, объединение лент всех каналов).
+        conditional: Условный GET (ETag/Last-Modified) с сохранением состояния опроса:
+                     ленты без изменений с прошлого опроса не возвращают записей. Нужен
+                     только сбору новостей (ingest_job); ручные команды и /dry_run загружают
+                     ленты целиком, не меняя валидаторы и расписание опроса.
+        limit: Вернуть только limit самых свежих записей (остальные сразу освобождаются).
+
     Returns:
         Список словарей, где каждый словарь представляет запись из ленты.
         Возвращает пустой список в случае ошибки или отсутствия записей.
     """
-    if not FEEDS:
+    if get_settings().feed_trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if not tracemalloc.is_tracing():
+        return await _fetch_feed_entries(only_due, feeds, conditional, limit)
+
+    # Память тика: пик выделений за опрос и сколько из них удерживают возвращенные записи
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    entries = await _fetch_feed_entries(only_due, feeds, conditional, limit)
+    current, peak = tracemalloc.get_traced_memory()
+    peak_bytes, retained_bytes = max(0, peak - baseline), max(0, current - baseline)
+    FEED_TICK_MEMORY.set(peak_bytes, kind="peak")
+    FEED_TICK_MEMORY.set(retained_bytes, kind="retained")
+    get_runtime_state().record_feed_memory(peak_bytes, retained_bytes, len(entries))
+    logger.info(
+        f"Память опроса лент: пик {peak_bytes / 2**20:.1f} МБ, "
+        f"удерживается {retained_bytes / 2**20:.1f} МБ ({len(entries)} записей)."
+    )
+    return entries
+
+async def _fetch_feed_entries(
+    only_due: bool, feeds: Optional[List[str]], conditional: bool, limit: Optional[int]
+) -> List[Dict[str, Any]]:
+    feeds = feeds if feeds is not None else get_settings().feeds
+    if not feeds:
         logger.error("Список RSS-лент (FEEDS) не указан или пуст в конфигурации.")
         return []
     
-    loop = asyncio.get_event_loop()
-    tasks = [fetch_single_feed(feed_url, loop) for feed_url in FEEDS]
-    
+    feed_poll_scheduler = get_feed_poll_scheduler()
+    feeds_to_poll = feed_poll_scheduler.due_feeds(feeds) if only_due else list(feeds)
+    if not feeds_to_poll:
+        logger.info("Ни одной ленте пока не пора обновляться, опрос пропущен.")
+        return []
+
+    # Общая сессия процесса: соединения и DNS переиспользуются между опросами
+    session = await get_http_fetcher().session()
+    tasks = [fetch_single_feed(feed_url, session, conditional) for feed_url in feeds_to_poll]
     all_entries_lists = await asyncio.gather(*tasks)
+    if conditional:
+        feed_poll_scheduler.save()
+    prune_feed_content()
     
     aggregated_entries: List[Dict[str, Any]] = [] # Ensure type for aggregated_entries
     for entry_list in all_entries_lists:
         aggregated_entries.extend(entry_list)
+    del all_entries_lists
     
     if not aggregated_entries:
         logger.info("Новые записи не найдены ни в одной из RSS-лент.")
         return []
 
     # Сортировка всех записей по дате публикации (от новых к старым)
-    # Используем 'published_parsed' (time.struct_time) или 'published' (str)
-    aggregated_entries.sort(key=lambda x: get_entry_published_datetime(x) or datetime.min, reverse=True)
+    # Даты уже разобраны и закэшированы в записях при загрузке лент
+    sort_key = lambda x: get_entry_published_datetime(x) or MIN_UTC_DATETIME
+    total = len(aggregated_entries)
+    if limit is not None and limit < total:
+        aggregated_entries = heapq.nlargest(limit, aggregated_entries, key=sort_key)
+    else:
+        aggregated_entries.sort(key=sort_key, reverse=True)
     
-    logger.info(f"Всего собрано и отсортировано {len(aggregated_entries)} записей из {len(FEEDS)} лент.")
+    logger.info(f"Всего собрано {total} записей из {len(feeds_to_poll)} лент, возвращено {len(aggregated_entries)}.")
     return aggregated_entries
 
-async def get_latest_news(count: int = 1) -> List[Dict[str, Any]]: # Changed return type
+async def get_latest_news(count: int = 1, only_due: bool = False) -> List[Dict[str, Any]]: # Changed return type
     """Возвращает последние 'count' новостей из всех RSS-лент, отсортированных по дате.
 
     Args:
         count: Количество последних новостей для получения.
+        only_due: Опрашивать только ленты, которым пора обновиться.
 
     Returns:
         Список словарей с данными новостей.
     """
-    entries = await fetch_feed_entries()
-    # Записи уже отсортированы от новых к старым в fetch_feed_entries
-    return entries[:count]
+    # Записи уже отсортированы от новых к старым в fetch_feed_entries. Без условного GET:
+    # после опроса сборщиком неизменившиеся ленты иначе не вернули бы ни одной записи
+    return await fetch_feed_entries(only_due=only_due, conditional=False, limit=count)
 
 # Пример использования (для тестирования сервиса отдельно):
 # if __name__ == '__main__':
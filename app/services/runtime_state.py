@@ -0,0 +1,162 @@
+"""Состояние работающего бота для /status.
+
+Конвейер обновляет RuntimeState по ходу работы: результат последнего опроса
+каждой ленты, итоги сбора новостей, последние публикации по каналам,
+последние ошибки (через RecentErrorsHandler в логировании), следующий запуск
+и итог последнего выполнения задач APScheduler (через слушатель событий),
+сводку координации. /status только читает готовые значения и не обходит
+файлы, ленты или базу.
+"""
+import logging
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних ошибок хранить для /status
+MAX_RECENT_ERRORS = 10
+
+
+@dataclass
+class FeedStatus:
+    """Итог последнего опроса ленты."""
+
+    last_fetch: float = 0.0
+    # ok, not_modified или error
+    status: str = ""
+    entries: int = 0
+    error: Optional[str] = None
+    # Ошибок подряд
+    failures: int = 0
+
+
+@dataclass
+class JobStatus:
+    """Задача APScheduler: следующий запуск и итог последнего выполнения."""
+
+    next_run: Optional[datetime] = None
+    last_run: Optional[float] = None
+    last_error: Optional[str] = None
+    runs: int = 0
+    failures: int = 0
+
+
+class RuntimeState:
+    """Счетчики и последние события конвейера, обновляемые по ходу работы."""
+
+    def __init__(self, max_errors: int = MAX_RECENT_ERRORS):
+        self.started_at = time.time()
+        self.feeds: Dict[str, FeedStatus] = {}
+        # Количество лент по статусу последнего опроса (ok, not_modified, error)
+        self.feed_status_counts: Counter = Counter()
+        self.last_feed_fetch: Optional[float] = None
+        self.jobs: Dict[str, JobStatus] = {}
+        self.errors: Deque[Tuple[float, str, str]] = deque(maxlen=max_errors)
+        self.ingest_runs = 0
+        self.ingested_total = 0
+        self.last_ingest: Optional[Tuple[float, int]] = None
+        # Последний замер памяти опроса лент: (пик, удерживается, записей), байты
+        self.last_feed_memory: Optional[Tuple[int, int, int]] = None
+        self.posts_total = 0
+        self.last_posts: Dict[str, Tuple[float, str]] = {}
+        self.coordination: Optional[Dict[str, Any]] = None
+
+    def record_feed(self, url: str, status: str, entries: int = 0, error: Optional[str] = None) -> None:
+        feed = self.feeds.get(url)
+        if feed is None:
+            feed = self.feeds[url] = FeedStatus()
+        elif feed.status:
+            self.feed_status_counts[feed.status] -= 1
+        feed.last_fetch = self.last_feed_fetch = time.time()
+        feed.status = status
+        feed.entries = entries
+        feed.error = error
+        feed.failures = feed.failures + 1 if status == "error" else 0
+        self.feed_status_counts[status] += 1
+
+    def record_ingest(self, added: int) -> None:
+        self.ingest_runs += 1
+        self.ingested_total += added
+        self.last_ingest = (time.time(), added)
+
+    def record_feed_memory(self, peak_bytes: int, retained_bytes: int, entries: int) -> None:
+        self.last_feed_memory = (peak_bytes, retained_bytes, entries)
+
+    def record_post(self, channel: str, title: str) -> None:
+        self.posts_total += 1
+        self.last_posts[channel] = (time.time(), title)
+
+    def record_error(self, source: str, message: str) -> None:
+        self.errors.append((time.time(), source, message))
+
+    def record_job(self, job_id: str, next_run: Optional[datetime], executed: bool = False, error: Optional[str] = None) -> None:
+        job = self.jobs.get(job_id)
+        if job is None:
+            job = self.jobs[job_id] = JobStatus()
+        job.next_run = next_run
+        if executed:
+            job.runs += 1
+            job.last_run = time.time()
+            job.last_error = error
+            if error:
+                job.failures += 1
+
+    def remove_job(self, job_id: str) -> None:
+        self.jobs.pop(job_id, None)
+
+
+_runtime_state: Optional[RuntimeState] = None
+
+
+def get_runtime_state() -> RuntimeState:
+    global _runtime_state
+    if _runtime_state is None:
+        _runtime_state = RuntimeState()
+    return _runtime_state
+
+
+class RecentErrorsHandler(logging.Handler):
+    """Обработчик логов: ошибки приложения попадают в RuntimeState.errors (см. setup_logging в bot.py)."""
+
+    def __init__(self, level: int = logging.ERROR):
+        super().__init__(level)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            message = record.getMessage()
+            get_runtime_state().record_error(record.name, message.splitlines()[0][:300] if message else "")
+        except Exception:
+            self.handleError(record)
+
+
+def track_scheduler_jobs(scheduler) -> None:
+    """Подписывает RuntimeState на события APScheduler: добавление, удаление и выполнение задач."""
+    from apscheduler.events import (
+        EVENT_JOB_ADDED, EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED, EVENT_JOB_MODIFIED,
+        EVENT_JOB_REMOVED,
+    )
+
+    state = get_runtime_state()
+
+    def listener(event) -> None:
+        if event.code == EVENT_JOB_REMOVED:
+            state.remove_job(event.job_id)
+            return
+        job = scheduler.get_job(event.job_id)
+        if job is None:
+            state.remove_job(event.job_id)
+            return
+        executed = event.code in (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR)
+        error = f"{type(event.exception).__name__}: {event.exception}" if event.code == EVENT_JOB_ERROR else None
+        # У задачи, добавленной до запуска планировщика, next_run_time еще нет
+        state.record_job(event.job_id, getattr(job, "next_run_time", None), executed=executed, error=error)
+
+    scheduler.add_listener(
+        listener,
+        EVENT_JOB_ADDED | EVENT_JOB_MODIFIED | EVENT_JOB_REMOVED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED,
+    )
+    for job in scheduler.get_jobs():
+        state.record_job(job.id, getattr(job, "next_run_time", None))
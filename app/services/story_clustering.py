@@ -0,0 +1,224 @@
+"""Склейка записей разных лент об одном событии в сюжеты.
+
+Крупную новость почти одновременно публикуют несколько лент из feeds.txt.
+Без склейки бот загружал бы, переписывал и публиковал каждую из них. Здесь
+каждая новая запись сравнивается с сюжетами за последние
+STORY_CLUSTER_WINDOW_HOURS часов:
+
+- из заголовка и начала описания получается множество слов (шинглов);
+- по нему считается MinHash-сигнатура, оценивающая сходство Жаккара двух
+  записей без попарного сравнения текстов;
+- сигнатура делится на полосы (LSH); сюжеты-кандидаты - те, у которых
+  совпала хотя бы одна полоса, и запись присоединяется к ближайшему из них,
+  если оценка сходства не ниже STORY_CLUSTER_THRESHOLD.
+
+В очередь кандидатов попадает только первая запись сюжета, остальные лишь
+пополняют его. При публикации (см. scheduler) пост строится по самой полной
+записи сюжета, а остальные передаются модели как дополнительные источники в
+том же запросе; опубликованными отмечаются ссылки всех записей сюжета.
+"""
+import hashlib
+import html
+import itertools
+import logging
+import random
+import re
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.config import get_settings
+from app.services.content_fetch_service import text_length
+from app.services.feed_content import entry_content, entry_content_chars
+
+logger = logging.getLogger(__name__)
+
+# Размер сигнатуры и число полос LSH. Заголовки и анонсы одного события в разных
+# лентах пересекаются по словам всего на 0.35-0.5, поэтому полосы короткие (по 2
+# значения): кандидатом почти наверняка становится сюжет со сходством от 0.3,
+# а решает оценка по всей сигнатуре
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 64
+# Сколько символов описания учитывать вместе с заголовком
+LEAD_CHARS = 300
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_TAG_RE = re.compile(r"<[^>]+>")
+_WORD_RE = re.compile(r"\w{3,}", re.UNICODE)
+
+
+def entry_lead(entry: Any, limit: int = LEAD_CHARS) -> str:
+    """Начало описания записи без тегов."""
+    summary = entry.get("summary") or entry.get("description") or ""
+    return " ".join(html.unescape(_TAG_RE.sub(" ", summary)).split())[:limit]
+
+
+def shingles(entry: Any) -> Set[str]:
+    """Слова (от трех букв) заголовка и начала описания в нижнем регистре."""
+    text = f"{entry.get('title', '')} {entry_lead(entry)}".lower()
+    return set(_WORD_RE.findall(text))
+
+
+def entry_richness(entry: Any) -> int:
+    """Сколько текста статьи есть прямо в ленте: чем больше, тем меньше нужно загружать."""
+    content_chars = entry_content_chars(entry)
+    if content_chars is None:
+        content_chars = text_length(entry_content(entry))
+    return content_chars or text_length(entry.get("summary") or entry.get("description"))
+
+
+class MinHasher:
+    """MinHash-сигнатуры множеств строк: семейство хешей (a*x + b) mod p."""
+
+    def __init__(self, num_perm: int = NUM_PERMUTATIONS, seed: int = 1):
+        rng = random.Random(seed) # Одинаковые сигнатуры во всех процессах и после перезапуска
+        self._coefficients = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)
+        ]
+
+    def signature(self, tokens: Set[str]) -> Tuple[int, ...]:
+        hashes = [int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big") for token in tokens]
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in self._coefficients
+        )
+
+
+def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+    """Оценка сходства Жаккара по двум сигнатурам."""
+    return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+
+@dataclass
+class StoryCluster:
+    """Сюжет: записи разных лент об одном событии."""
+    id: int
+    signature: Tuple[int, ...] = field(repr=False)
+    members: List[Any] = field(default_factory=list, repr=False)
+    created_at: float = field(default_factory=time.time)
+    last_seen: float = field(default_factory=time.time)
+    # Ссылка записи сюжета, стоящей в очереди кандидатов
+    queued_link: Optional[str] = None
+    posted: bool = False
+
+    @property
+    def links(self) -> List[str]:
+        return [member.get("link") for member in self.members if member.get("link")]
+
+    def representative(self, eligible: Optional[Callable[[Any], bool]] = None) -> Any:
+        """Запись, по которой строится пост: больше всего текста в ленте, при равенстве - более ранняя."""
+        candidates = [m for m in self.members if eligible is None or eligible(m)] or self.members
+        return max(candidates, key=entry_richness) # max возвращает первую из равных
+
+
+class StoryClusterer:
+    """Онлайн-кластеризация записей по MinHash LSH в скользящем окне времени."""
+
+    def __init__(
+        self,
+        threshold: float = 0.35,
+        window_seconds: float = 24 * 3600,
+        num_perm: int = NUM_PERMUTATIONS,
+        bands: int = LSH_BANDS,
+    ):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) должно делиться на число полос ({bands})")
+        self.threshold = threshold
+        self.window_seconds = window_seconds
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._hasher = MinHasher(num_perm)
+        # Сюжеты в порядке последнего пополнения: устаревшие вытесняются с начала
+        self._clusters: "OrderedDict[int, StoryCluster]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[int]] = defaultdict(set)
+        self._by_link: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+
+    def __len__(self) -> int:
+        return len(self._clusters)
+
+    def __contains__(self, link: str) -> bool:
+        return link in self._by_link
+
+    def _bands(self, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def _evict(self, now: float) -> None:
+        while self._clusters:
+            cluster = next(iter(self._clusters.values()))
+            if now - cluster.last_seen <= self.window_seconds:
+                break
+            del self._clusters[cluster.id]
+            for key in self._bands(cluster.signature):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(cluster.id)
+                    if not bucket:
+                        del self._buckets[key]
+            for link in cluster.links:
+                if self._by_link.get(link) == cluster.id:
+                    del self._by_link[link]
+
+    def add(self, entry: Any, now: Optional[float] = None) -> Tuple[StoryCluster, bool]:
+        """Относит запись к сюжету. Возвращает (сюжет, True - если это новый сюжет)."""
+        now = time.time() if now is None else now
+        self._evict(now)
+        link = entry.get("link")
+        if link in self._by_link:
+            return self._clusters[self._by_link[link]], False
+
+        tokens = shingles(entry)
+        # Запись без текста ни с чем не сравнить: она образует отдельный сюжет
+        signature = self._hasher.signature(tokens) if tokens else ()
+        candidate_ids: Set[int] = set()
+        for key in self._bands(signature) if tokens else ():
+            candidate_ids.update(self._buckets.get(key, ()))
+        best: Optional[StoryCluster] = None
+        best_similarity = self.threshold
+        for cluster_id in candidate_ids:
+            cluster = self._clusters[cluster_id]
+            score = similarity(signature, cluster.signature)
+            if score >= best_similarity:
+                best, best_similarity = cluster, score
+
+        is_new = best is None
+        if best is None:
+            best = StoryCluster(next(self._ids), signature, created_at=now, last_seen=now)
+            for key in self._bands(signature) if tokens else ():
+                self._buckets[key].add(best.id)
+        else:
+            logger.info(
+                f"Запись \"{entry.get('title', '')}\" присоединена к сюжету \"{best.members[0].get('title', '')}\" "
+                f"(сходство {best_similarity:.2f}, записей {len(best.members) + 1})."
+            )
+        best.members.append(entry)
+        best.last_seen = now
+        self._clusters[best.id] = best
+        self._clusters.move_to_end(best.id)
+        if link:
+            self._by_link[link] = best.id
+        return best, is_new
+
+    def story_for(self, link: str) -> Optional[StoryCluster]:
+        cluster_id = self._by_link.get(link)
+        return self._clusters.get(cluster_id) if cluster_id is not None else None
+
+
+_story_clusterer: Optional[StoryClusterer] = None
+_story_clusterer_configured = False
+
+
+def get_story_clusterer() -> Optional[StoryClusterer]:
+    """Кластеризатор сюжетов из настроек (None - склейка выключена, STORY_CLUSTERING_ENABLED=false)."""
+    global _story_clusterer, _story_clusterer_configured
+    if not _story_clusterer_configured:
+        settings = get_settings()
+        if settings.story_clustering_enabled:
+            _story_clusterer = StoryClusterer(
+                threshold=settings.story_cluster_threshold,
+                window_seconds=settings.story_cluster_window_hours * 3600,
+            )
+        _story_clusterer_configured = True
+    return _story_clusterer
@@ -0,0 +1,217 @@
+"""Очередь исходящих сообщений Telegram с учетом лимитов Bot API.
+
+Telegram ограничивает частоту отправки: не больше ~1 сообщения в секунду в один
+чат, ~20 в минуту в группу или канал и ~30 в секунду суммарно. При превышении
+сервер отвечает 429 с retry_after (TelegramRetryAfter). TelegramSender держит
+по очереди на каждый чат, выдерживает интервалы между сообщениями, общий лимит
+на все чаты и при RetryAfter откладывает отправку, а не теряет сообщение.
+
+Сообщения о ходе выполнения (send_progress) объединяются: пока предыдущее
+обновление ждет своей очереди, новые лишь заменяют его текст, а уже
+отправленное сообщение редактируется вместо отправки нового.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from app.config import get_settings
+from app.utils.metrics import FAILURES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+ChatId = Union[int, str]
+Request = Callable[[], Awaitable[Any]]
+
+
+class RateLimiter:
+    """Простой token bucket: не больше rate операций в секунду (с запасом burst)."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Запрещает отправку на seconds секунд (глобальный флуд-контроль); паузы не суммируются."""
+        self._tokens = min(self._tokens, -seconds * self.rate)
+        self._updated = time.monotonic()
+
+
+@dataclass
+class _ProgressState:
+    text: str = ""
+    message_id: Optional[int] = None
+    pending: bool = False
+
+
+class TelegramSender:
+    """Отправка запросов Bot API через очереди по чатам с соблюдением лимитов."""
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_interval: float = 1.0,
+        group_interval: float = 3.0,
+        max_retries: int = 5,
+    ):
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+        self._global = RateLimiter(global_rate)
+        self._queues: Dict[ChatId, Deque[Tuple[Request, asyncio.Future]]] = {}
+        self._workers: Dict[ChatId, asyncio.Task] = {}
+        self._next_send_at: Dict[ChatId, float] = {}
+        self._progress: Dict[Tuple[ChatId, str], _ProgressState] = {}
+
+    def interval_for(self, chat_id: ChatId) -> float:
+        """Минимальный интервал между сообщениями в чат: группы и каналы строже личных чатов."""
+        if isinstance(chat_id, str) or chat_id < 0:
+            return self.group_interval
+        return self.chat_interval
+
+    def pending(self, chat_id: Optional[ChatId] = None) -> int:
+        """Количество сообщений, ожидающих отправки (в чат или всего)."""
+        if chat_id is not None:
+            return len(self._queues.get(chat_id, ()))
+        return sum(len(queue) for queue in self._queues.values())
+
+    def enqueue(self, chat_id: ChatId, request: Request) -> asyncio.Future:
+        """Ставит запрос в очередь чата. Возвращает future с результатом запроса.
+
+        request - фабрика корутины (например, lambda: bot.send_message(...)): при
+        повторе после RetryAfter запрос создается заново.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(chat_id, deque()).append((request, future))
+        worker = self._workers.get(chat_id)
+        if worker is None or worker.done():
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return future
+
+    async def send(self, chat_id: ChatId, request: Callable[[], Awaitable[T]]) -> T:
+        """Ставит запрос в очередь чата и ждет его результата."""
+        return await self.enqueue(chat_id, request)
+
+    async def send_progress(self, bot: Bot, chat_id: ChatId, key: str, text: str) -> None:
+        """Сообщение о ходе выполнения: одно на key, обновляется редактированием.
+
+        Не ждет отправки: вызывающий код не тормозит из-за лимитов чата, а частые
+        обновления схлопываются в одно.
+        """
+        state = self._progress.setdefault((chat_id, key), _ProgressState())
+        state.text = text
+        if state.pending:
+            return  # Уже стоит в очереди: при отправке возьмется самый свежий текст
+
+        async def request() -> None:
+            state.pending = False
+            if state.message_id is None:
+                message = await bot.send_message(chat_id=chat_id, text=state.text, parse_mode=None)
+                state.message_id = message.message_id
+                return
+            try:
+                await bot.edit_message_text(text=state.text, chat_id=chat_id, message_id=state.message_id, parse_mode=None)
+            except TelegramBadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+
+        def log_failure(future: asyncio.Future) -> None:
+            if not future.cancelled() and future.exception() is not None:
+                logger.warning(f"Не удалось обновить сообщение о ходе выполнения в чате {chat_id}: {future.exception()}")
+
+        state.pending = True
+        self.enqueue(chat_id, request).add_done_callback(log_failure)
+
+    def finish_progress(self, chat_id: ChatId, key: str) -> None:
+        """Забывает сообщение о ходе выполнения: следующее с тем же key будет новым сообщением."""
+        self._progress.pop((chat_id, key), None)
+
+    async def _drain(self, chat_id: ChatId) -> None:
+        queue = self._queues[chat_id]
+        while queue:
+            request, future = queue.popleft()
+            if future.done():  # Ожидающий отменил отправку
+                continue
+            try:
+                result = await self._execute(chat_id, request)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def _wait_turn(self, chat_id: ChatId) -> None:
+        delay = self._next_send_at.get(chat_id, 0.0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._global.acquire()
+        self._next_send_at[chat_id] = time.monotonic() + self.interval_for(chat_id)
+
+    async def _execute(self, chat_id: ChatId, request: Request) -> Any:
+        attempt = 0
+        while True:
+            await self._wait_turn(chat_id)
+            try:
+                return await request()
+            except TelegramRetryAfter as e:
+                attempt += 1
+                FAILURES.inc(reason="telegram_retry_after")
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(
+                    f"Флуд-контроль Telegram для чата {chat_id}: повтор через {e.retry_after} с "
+                    f"(попытка {attempt}/{self.max_retries})."
+                )
+                self._next_send_at[chat_id] = time.monotonic() + e.retry_after
+                if e.retry_after > self.group_interval * 2:
+                    self._global.pause(1.0)  # Долгая блокировка - признак общего перегруза, притормаживаем всех
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                backoff = min(30.0, 2.0 ** attempt)
+                logger.warning(f"Ошибка сети/сервера Telegram для чата {chat_id}: {e}. Повтор через {backoff:.0f} с.")
+                self._next_send_at[chat_id] = time.monotonic() + backoff
+
+
+_telegram_sender: Optional[TelegramSender] = None
+
+
+def get_telegram_sender() -> TelegramSender:
+    """Общий отправитель, созданный по настройкам при первом обращении."""
+    global _telegram_sender
+    if _telegram_sender is None:
+        settings = get_settings()
+        _telegram_sender = TelegramSender(
+            global_rate=settings.telegram_global_rate,
+            chat_interval=settings.telegram_chat_interval,
+            group_interval=settings.telegram_group_interval,
+            max_retries=settings.telegram_max_retries,
+        )
+    return _telegram_sender
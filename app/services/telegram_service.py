@@ -1,21 +1,28 @@
 import logging
-from typing import Optional
-import requests
-import io
+from typing import Optional, Union
 import html
 
 from aiogram import Bot
 from aiogram.types import InputFile, URLInputFile
 from aiogram.exceptions import TelegramAPIError
 
-from app.config import TELEGRAM_CHANNEL_ID
+from app.config import get_settings
+from app.services.telegram_sender import get_telegram_sender
+from app.utils.metrics import FAILURES, track_stage
 
 logger = logging.getLogger(__name__)
 
 def is_url(string: str) -> bool:
     return string.startswith('http://') or string.startswith('https://')
 
-async def post_to_channel(bot: Bot, text: str, image_url: Optional[str] = None, image_path: Optional[str] = None) -> bool:
+@track_stage("telegram_send")
+async def post_to_channel(
+    bot: Bot,
+    text: str,
+    image_url: Optional[str] = None,
+    image_path: Optional[str] = None,
+    chat_id: Optional[Union[int, str]] = None,
+) -> bool:
     """Отправляет сообщение с изображением (если указано) в Telegram канал.
 
     Args:
@@ -24,11 +31,13 @@ async def post_to_channel(bot: Bot, text: str, image_url: Optional[str] = None,
         image_url: URL изображения для отправки.
         image_path: Локальный путь к изображению для отправки.
                     Приоритетнее image_url, если указаны оба.
+        chat_id: Канал для отправки; по умолчанию TELEGRAM_CHANNEL_ID.
 
     Returns:
         True, если сообщение успешно отправлено, иначе False.
     """
-    if not TELEGRAM_CHANNEL_ID:
+    channel_id = chat_id or get_settings().telegram_channel_id
+    if not channel_id:
         logger.error("TELEGRAM_CHANNEL_ID не настроен. Невозможно отправить сообщение.")
         return False
 
@@ -50,7 +59,7 @@ async def post_to_channel(bot: Bot, text: str, image_url: Optional[str] = None,
                 # Это должно быть сделано перед вызовом, но для надежности можно и здесь
                 # import os; if not os.path.exists(image_path): logger.error(...); return False
                 photo_to_send = image_path
-                logger.info(f"Отправка сообщения с локальным изображением: {image_path} в канал {TELEGRAM_CHANNEL_ID}")
+                logger.info(f"Отправка сообщения с локальным изображением: {image_path} в канал {channel_id}")
             except Exception as e: # Ловим потенциальные ошибки с путем, если он некорректен
                 logger.error(f"Ошибка с локальным путем изображения '{image_path}': {e}", exc_info=True)
                 # Попытка отправить только текст
@@ -61,71 +70,55 @@ async def post_to_channel(bot: Bot, text: str, image_url: Optional[str] = None,
             if is_url(image_url):
                 # Для URLInputFile не нужна предварительная загрузка, aiogram сделает это.
                 photo_to_send = URLInputFile(image_url)
-                logger.info(f"Отправка сообщения с изображением по URL: {image_url} в канал {TELEGRAM_CHANNEL_ID}")
+                logger.info(f"Отправка сообщения с изображением по URL: {image_url} в канал {channel_id}")
             else:
                 # Если image_url не URL, возможно, это идентификатор файла Telegram (file_id)
                 # или требует специальной обработки, которую здесь не предусматриваем.
                 # В данном случае, будем трактовать как file_id.
                 photo_to_send = image_url
-                logger.info(f"Отправка сообщения с изображением по file_id: {image_url} в канал {TELEGRAM_CHANNEL_ID}")
+                logger.info(f"Отправка сообщения с изображением по file_id: {image_url} в канал {channel_id}")
         
+        # Отправка идет через очередь канала: соблюдаются лимиты Bot API, а при RetryAfter запрос повторяется
+        sender = get_telegram_sender()
         if photo_to_send:
-            await bot.send_photo(
-                chat_id=TELEGRAM_CHANNEL_ID,
+            await sender.send(channel_id, lambda: bot.send_photo(
+                chat_id=channel_id,
                 photo=photo_to_send,
                 caption=caption_for_photo, # Use pre-formatted, truncated HTML
                 parse_mode="HTML"
-            )
+            ))
         else:
-            logger.info(f"Отправка текстового сообщения в канал {TELEGRAM_CHANNEL_ID}")
-            await bot.send_message(
-                chat_id=TELEGRAM_CHANNEL_ID,
+            logger.info(f"Отправка текстового сообщения в канал {channel_id}")
+            await sender.send(channel_id, lambda: bot.send_message(
+                chat_id=channel_id,
                 text=text, # Use pre-formatted HTML
                 parse_mode="HTML",
                 disable_web_page_preview=False # Можно сделать True, если превью ссылок не нужны
-            )
+            ))
         
-        logger.info(f"Сообщение успешно отправлено в канал {TELEGRAM_CHANNEL_ID}.")
+        logger.info(f"Сообщение успешно отправлено в канал {channel_id}.")
         return True
 
     except TelegramAPIError as e: # Catches TelegramBadRequest and other API errors
         failed_content_preview = text[:200].replace('\n', ' ') + "..."
         logger.error(
-            f"Telegram API ошибка при отправке сообщения в канал {TELEGRAM_CHANNEL_ID}. "
+            f"Telegram API ошибка при отправке сообщения в канал {channel_id}. "
             f"Ошибка: {e.message}. Код: {getattr(e, 'error_code', 'N/A')}. "
             f"URL изображения (если был): {image_url}. "
             f"Текст поста (начало): '{failed_content_preview}'", 
             exc_info=True
         )
+        FAILURES.inc(reason="telegram_api")
         return False
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка сети (requests) при попытке доступа к URL изображения {image_url}: {e}", exc_info=True)
-        try:
-            logger.warning(f"Попытка отправить только текстовое сообщение в канал {TELEGRAM_CHANNEL_ID} после ошибки с изображением.")
-            await bot.send_message(
-                chat_id=TELEGRAM_CHANNEL_ID,
-                text=text, 
-                parse_mode="HTML",
-                disable_web_page_preview=False
-            )
-            logger.info(f"Текстовое сообщение успешно отправлено в канал {TELEGRAM_CHANNEL_ID} после ошибки с изображением.")
-            return True 
-        except Exception as fallback_e:
-            failed_content_preview = text[:200].replace('\n', ' ') + "..."
-            logger.error(
-                f"Ошибка при отправке текстового сообщения (fallback) в канал {TELEGRAM_CHANNEL_ID}: {fallback_e}. "
-                f"Текст поста (начало): '{failed_content_preview}'", 
-                exc_info=True
-            )
-            return False
     except Exception as e:
         failed_content_preview = text[:200].replace('\n', ' ') + "..."
         logger.error(
-            f"Непредвиденная ошибка при отправке сообщения в канал {TELEGRAM_CHANNEL_ID}: {e}. "
+            f"Непредвиденная ошибка при отправке сообщения в канал {channel_id}: {e}. "
             f"URL изображения (если был): {image_url}. "
             f"Текст поста (начало): '{failed_content_preview}'", 
             exc_info=True
         ) 
+        FAILURES.inc(reason="telegram_error")
         return False
 
 # Для тестирования можно добавить:
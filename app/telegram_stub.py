@@ -0,0 +1,392 @@
+"""Локальный заменитель Telegram Bot API для нагрузочных прогонов публикации.
+
+Отвечает на POST /bot{token}/{method} так же, как api.telegram.org, поэтому бот
+подключается к нему через TELEGRAM_API_BASE=http://host:port без изменений кода:
+
+- sendMessage, sendPhoto, editMessageText, editMessageCaption, getUpdates,
+  answerCallbackQuery, getMe; прочие методы (setWebhook, sendChatAction...) - ok;
+- проверка запросов по правилам Telegram: разбор HTML (только поддерживаемые
+  теги, правильная вложенность, экранирование < и &), длина текста (4096) и
+  подписи (1024) в UTF-16 после разбора разметки, пустой текст, отсутствующее
+  сообщение при редактировании, "message is not modified";
+- флуд-контроль как у Telegram: не чаще 1 сообщения в секунду в личный чат,
+  20 в минуту в группу или канал и 30 в секунду всего, иначе 429 с retry_after;
+  дополнительно --flood-rate отвечает 429 случайной доле запросов, а
+  --server-error-rate - ошибкой 502;
+- задержка ответа --latency/--jitter.
+
+Входящие обновления для getUpdates (команды администратора, нажатия кнопок)
+добавляются через POST /_stub/updates: полный Update или сокращенно
+{"chat_id": ..., "text": "/status"} либо {"chat_id": ..., "callback_data": ...}.
+GET /_stub/stats - счетчики, GET /_stub/messages - отправленные сообщения.
+
+Запуск из корня проекта:
+
+    python -m app.telegram_stub --port 8767 --latency 0.05
+    TELEGRAM_API_BASE=http://127.0.0.1:8767 python -m app.bot
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import math
+import random
+import re
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8767
+MAX_TEXT_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+MAX_CALLBACK_ANSWER_LENGTH = 200
+# (сообщений, окно в секундах) - лимиты Bot API
+PRIVATE_CHAT_LIMIT = (1, 1.0)
+GROUP_CHAT_LIMIT = (20, 60.0)
+GLOBAL_LIMIT = (30, 1.0)
+MAX_POLL_TIMEOUT = 30.0
+
+SUPPORTED_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del", "a", "code", "pre",
+    "tg-spoiler", "span", "blockquote", "tg-emoji",
+}
+_NAMED_ENTITIES = {"lt": "<", "gt": ">", "amp": "&", "quot": '"'}
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z][\w-]*)((?:\s+[^<>]*?)?)\s*>")
+_ENTITY_RE = re.compile(r"&(#\d+|#x[0-9a-fA-F]+|[a-zA-Z]+);")
+
+
+class EntityParseError(ValueError):
+    """Текст не проходит разбор HTML-разметки Telegram."""
+
+
+def _byte_offset(text: str, index: int) -> int:
+    return len(text[:index].encode("utf-8"))
+
+
+def parse_html(text: str) -> str:
+    """Разбирает Telegram HTML и возвращает видимый текст; EntityParseError - как "can't parse entities"."""
+    plain: List[str] = []
+    stack: List[str] = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "<":
+            match = _TAG_RE.match(text, i)
+            if not match:
+                raise EntityParseError(f"Unclosed start tag at byte offset {_byte_offset(text, i)}")
+            closing, name, attributes = match.group(1), match.group(2).lower(), match.group(3)
+            if closing:
+                if not stack:
+                    raise EntityParseError(f"Unexpected end tag at byte offset {_byte_offset(text, i)}")
+                if stack[-1] != name:
+                    raise EntityParseError(
+                        f'Unmatched end tag at byte offset {_byte_offset(text, i)}, expected "</{stack[-1]}>", found "</{name}>"'
+                    )
+                stack.pop()
+            else:
+                if name not in SUPPORTED_TAGS or (name == "span" and "tg-spoiler" not in attributes):
+                    raise EntityParseError(f'Unsupported start tag "{name}" at byte offset {_byte_offset(text, i)}')
+                stack.append(name)
+            i = match.end()
+        elif char == "&":
+            match = _ENTITY_RE.match(text, i)
+            if match and (match.group(1).startswith("#") or match.group(1) in _NAMED_ENTITIES):
+                entity = match.group(1)
+                if entity.startswith("#x"):
+                    plain.append(chr(int(entity[2:], 16)))
+                elif entity.startswith("#"):
+                    plain.append(chr(int(entity[1:])))
+                else:
+                    plain.append(_NAMED_ENTITIES[entity])
+                i = match.end()
+            else:
+                plain.append(char) # Неизвестная сущность остается текстом
+                i += 1
+        else:
+            plain.append(char)
+            i += 1
+    if stack:
+        raise EntityParseError(f'Can\'t find end tag corresponding to start tag "{stack[-1]}"')
+    return "".join(plain)
+
+
+def utf16_length(text: str) -> int:
+    """Длина в единицах UTF-16: так Telegram считает лимиты текста (эмодзи - 2 единицы)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+class BotAPIError(Exception):
+    def __init__(self, code: int, description: str, retry_after: Optional[int] = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+    def response(self) -> web.Response:
+        body: Dict[str, Any] = {"ok": False, "error_code": self.code, "description": self.description}
+        if self.retry_after is not None:
+            body["parameters"] = {"retry_after": self.retry_after}
+        return web.json_response(body, status=self.code)
+
+
+def _bad_request(description: str) -> BotAPIError:
+    return BotAPIError(400, f"Bad Request: {description}")
+
+
+def _is_private(chat_id: str) -> bool:
+    return chat_id.lstrip("-").isdigit() and not chat_id.startswith("-")
+
+
+class FakeBotAPI:
+    """Состояние и обработчики заменителя Bot API: сообщения по чатам, очередь обновлений, лимиты."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        enforce_limits: bool = True,
+        flood_rate: float = 0.0,
+        flood_retry_after: int = 1,
+        server_error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.enforce_limits = enforce_limits
+        self.flood_rate = flood_rate
+        self.flood_retry_after = flood_retry_after
+        self.server_error_rate = server_error_rate
+        self._random = random.Random(seed)
+        self.messages: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._message_ids: Dict[str, itertools.count] = {}
+        self._sent_at: Dict[str, Deque[float]] = {}
+        self._global_sent_at: Deque[float] = deque()
+        self._updates: List[Dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self.stats: Counter = Counter()
+
+    def add_routes(self, app: web.Application) -> None:
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_post("/_stub/updates", self.handle_push_update)
+        app.router.add_get("/_stub/stats", self.handle_stats)
+        app.router.add_get("/_stub/messages", self.handle_messages)
+
+    # --- Входящие обновления ---
+
+    def push_update(self, update: Dict[str, Any]) -> Dict[str, Any]:
+        """Добавляет обновление для getUpdates (update_id назначается, если его нет)."""
+        update = dict(update)
+        update.setdefault("update_id", next(self._update_ids))
+        self._updates.append(update)
+        return update
+
+    def message_update(self, chat_id: int, text: str, from_id: Optional[int] = None) -> Dict[str, Any]:
+        """Обновление с текстовым сообщением (например, командой администратора) от пользователя from_id."""
+        user = {"id": from_id or chat_id, "is_bot": False, "first_name": "Stub"}
+        message = {
+            "message_id": 0, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}, "from": user,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self.push_update({"message": message})
+
+    def callback_update(self, chat_id: int, data: str, from_id: Optional[int] = None, message_id: int = 1) -> Dict[str, Any]:
+        """Обновление с нажатием inline-кнопки (callback_data=data) под сообщением message_id."""
+        user = {"id": from_id or chat_id, "is_bot": False, "first_name": "Stub"}
+        stored = self.messages.get(str(chat_id), {}).get(message_id)
+        message = stored or {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": ""}
+        callback = {"id": str(next(self._callback_ids)), "from": user, "chat_instance": "stub", "data": data, "message": message}
+        return self.push_update({"callback_query": callback})
+
+    async def handle_push_update(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if "update_id" in body or "message" in body or "callback_query" in body:
+            update = self.push_update(body)
+        elif "callback_data" in body:
+            update = self.callback_update(int(body["chat_id"]), body["callback_data"], body.get("from_id"), int(body.get("message_id", 1)))
+        else:
+            update = self.message_update(int(body["chat_id"]), body.get("text", ""), body.get("from_id"))
+        return web.json_response(update)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.stats))
+
+    async def handle_messages(self, request: web.Request) -> web.Response:
+        chat_id = request.query.get("chat_id")
+        chats = {chat_id: self.messages.get(chat_id, {})} if chat_id else self.messages
+        return web.json_response({chat: list(messages.values()) for chat, messages in chats.items()})
+
+    # --- Bot API ---
+
+    def _delay(self) -> float:
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def _check_flood(self, chat_id: str) -> None:
+        if self.flood_rate and self._random.random() < self.flood_rate:
+            raise BotAPIError(429, f"Too Many Requests: retry after {self.flood_retry_after}", self.flood_retry_after)
+        if not self.enforce_limits:
+            return
+        now = time.monotonic()
+        limits: List[Tuple[Deque[float], Tuple[int, float]]] = [
+            (self._sent_at.setdefault(chat_id, deque()), PRIVATE_CHAT_LIMIT if _is_private(chat_id) else GROUP_CHAT_LIMIT),
+            (self._global_sent_at, GLOBAL_LIMIT),
+        ]
+        for sent_at, (count, window) in limits:
+            while sent_at and now - sent_at[0] >= window:
+                sent_at.popleft()
+            if len(sent_at) >= count:
+                retry_after = max(1, math.ceil(window - (now - sent_at[0])))
+                raise BotAPIError(429, f"Too Many Requests: retry after {retry_after}", retry_after)
+        for sent_at, _ in limits:
+            sent_at.append(now)
+
+    @staticmethod
+    def _visible_text(text: str, parse_mode: Optional[str]) -> str:
+        if (parse_mode or "").upper() != "HTML":
+            return text
+        try:
+            return parse_html(text)
+        except EntityParseError as e:
+            raise _bad_request(f"can't parse entities: {e}")
+
+    def _store(self, chat_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        ids = self._message_ids.setdefault(chat_id, itertools.count(1))
+        message_id = next(ids)
+        chat_type = "private" if _is_private(chat_id) else "channel"
+        stored = dict(
+            message,
+            message_id=message_id,
+            date=int(time.time()),
+            chat={"id": int(chat_id) if chat_id.lstrip("-").isdigit() else chat_id, "type": chat_type},
+        )
+        self.messages.setdefault(chat_id, {})[message_id] = stored
+        return stored
+
+    def _existing(self, chat_id: str, form) -> Dict[str, Any]:
+        try:
+            message_id = int(form.get("message_id", ""))
+        except ValueError:
+            raise _bad_request("message identifier is not specified")
+        message = self.messages.get(chat_id, {}).get(message_id)
+        if message is None:
+            raise _bad_request("message to edit not found")
+        return message
+
+    def _call(self, method: str, form) -> Any:
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "StubBot", "username": "stub_bot"}
+        if method == "answercallbackquery":
+            if not form.get("callback_query_id"):
+                raise _bad_request("query is too old and response timeout expired or query ID is invalid")
+            if utf16_length(form.get("text", "")) > MAX_CALLBACK_ANSWER_LENGTH:
+                raise _bad_request("MESSAGE_TOO_LONG")
+            return True
+        if method not in ("sendmessage", "sendphoto", "editmessagetext", "editmessagecaption"):
+            return True # setWebhook, deleteWebhook, sendChatAction...
+
+        chat_id = str(form.get("chat_id", ""))
+        if not chat_id:
+            raise _bad_request("chat_id is empty")
+        parse_mode = form.get("parse_mode")
+        if method in ("sendmessage", "editmessagetext"):
+            text = form.get("text", "")
+            visible = self._visible_text(text, parse_mode)
+            if not visible.strip():
+                raise _bad_request("message text is empty")
+            if utf16_length(visible) > MAX_TEXT_LENGTH:
+                raise _bad_request("message is too long")
+            content = {"text": visible}
+        else:
+            caption = form.get("caption", "")
+            visible = self._visible_text(caption, parse_mode)
+            if utf16_length(visible) > MAX_CAPTION_LENGTH:
+                raise _bad_request("message caption is too long")
+            content = {"caption": visible} if visible else {}
+
+        if method.startswith("edit"):
+            message = self._existing(chat_id, form)
+            field = "text" if method == "editmessagetext" else "caption"
+            if message.get(field, "") == content.get(field, ""):
+                raise _bad_request("message is not modified: specified new message content and reply markup are exactly the same as a current content and reply markup of the message")
+            self._check_flood(chat_id)
+            message.update(content, edit_date=int(time.time()))
+            return message
+
+        if method == "sendphoto":
+            photo = form.get("photo")
+            if photo is None or photo == "":
+                raise _bad_request("there is no photo in the request")
+            content["photo"] = [{"file_id": "stub", "file_unique_id": "stub", "width": 1, "height": 1}]
+        self._check_flood(chat_id)
+        return self._store(chat_id, content)
+
+    async def _get_updates(self, form) -> List[Dict[str, Any]]:
+        offset = int(form.get("offset", 0) or 0)
+        limit = int(form.get("limit", 100) or 100)
+        timeout = min(float(form.get("timeout", 0) or 0), MAX_POLL_TIMEOUT)
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        deadline = time.monotonic() + timeout
+        # Длинный опрос: обновления могут добавить из другого потока, поэтому проверка периодическая
+        while not self._updates and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return self._updates[:limit]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        form = await request.post()
+        self.stats["requests"] += 1
+        self.stats[f"method_{method}"] += 1
+        delay = self._delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            if self.server_error_rate and method != "getupdates" and self._random.random() < self.server_error_rate:
+                raise BotAPIError(502, "Bad Gateway")
+            result = await self._get_updates(form) if method == "getupdates" else self._call(method, form)
+        except BotAPIError as e:
+            self.stats[f"error_{e.code}"] += 1
+            return e.response()
+        self.stats["ok"] += 1
+        return web.json_response({"ok": True, "result": result})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальный заменитель Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="Средняя задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Разброс задержки (равномерно ±jitter), сек")
+    parser.add_argument("--no-limits", dest="enforce_limits", action="store_false", help="Не применять лимиты частоты Telegram")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Доля запросов, получающих 429 случайно (0..1)")
+    parser.add_argument("--flood-retry-after", type=int, default=1, help="retry_after для случайных 429, сек")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Доля запросов с ошибкой 502 (0..1)")
+    parser.add_argument("--seed", type=int, help="Seed для задержек и ошибок")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    api = FakeBotAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        enforce_limits=args.enforce_limits,
+        flood_rate=args.flood_rate,
+        flood_retry_after=args.flood_retry_after,
+        server_error_rate=args.server_error_rate,
+        seed=args.seed,
+    )
+    app = web.Application(client_max_size=20 * 1024 * 1024)
+    api.add_routes(app)
+    logger.info(f"Заменитель Bot API на http://{args.host}:{args.port} (TELEGRAM_API_BASE).")
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1 @@
 # Этот файл делает директорию 'utils' пакетом Python
-from . import image_utils 
\ No newline at end of file
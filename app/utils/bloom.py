@@ -0,0 +1,158 @@
+"""Вращающийся фильтр Блума в файле, отображенном в память (mmap).
+
+Фильтр хранит 64-битные ключи (хеши ссылок) и отвечает "точно нет" или
+"возможно есть" с заданной долей ложных срабатываний. Два поколения по
+capacity ключей: новые ключи пишутся в текущее, проверка идет по обоим; когда
+текущее заполнено, старшее очищается и становится текущим. Так память
+ограничена (2 * capacity ключей), а доля ложных срабатываний не растет: не
+больше error_rate на поколение, то есть до 2 * error_rate на проверку.
+
+Формат файла: заголовок HEADER (магия, версия, k, размер поколения в битах,
+capacity, номер и число ключей каждого поколения), затем биты двух поколений.
+Файл открывается через mmap: загрузка при запуске не читает его целиком, а
+изменения битов сразу попадают в страницы файла.
+"""
+import logging
+import math
+import mmap
+import os
+import struct
+from typing import Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"NBBF"
+VERSION = 1
+# magic, version, k, бит в поколении, capacity, (поколение, ключей) x 2
+HEADER = struct.Struct("<4sHHQQQQQQ")
+HEADER_SIZE = 64
+_MASK32 = (1 << 32) - 1
+
+
+def optimal_parameters(capacity: int, error_rate: float) -> Tuple[int, int]:
+    """Размер поколения в битах (кратный 8) и число хеш-функций для capacity ключей."""
+    bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+    bits = max(64, (bits + 7) // 8 * 8)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class RotatingBloomFilter:
+    """Фильтр Блума из двух поколений в mmap-файле; ключи - 64-битные целые."""
+
+    def __init__(self, path: str, capacity: int, error_rate: float):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("capacity должно быть > 0, error_rate - в интервале (0, 1)")
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits, self.hashes = optimal_parameters(capacity, error_rate)
+        self.slot_bytes = self.bits // 8
+        # True, если файл создан заново (нет файла или другие параметры): содержимое нужно восстановить
+        self.created = False
+        self._file = None
+        self._mm = self._open()
+        _, _, _, _, _, gen0, count0, gen1, count1 = HEADER.unpack_from(self._mm, 0)
+        self._generations = [gen0, gen1]
+        self._counts = [count0, count1]
+
+    def _open(self) -> mmap.mmap:
+        size = HEADER_SIZE + 2 * self.slot_bytes
+        if os.path.exists(self.path) and os.path.getsize(self.path) == size:
+            with open(self.path, "rb") as f:
+                header = HEADER.unpack(f.read(HEADER.size))
+            if header[:5] == (MAGIC, VERSION, self.hashes, self.bits, self.capacity):
+                self._file = open(self.path, "r+b")
+                return mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_WRITE)
+            logger.info(f"Параметры фильтра {self.path} изменились, файл будет пересоздан.")
+        self.created = True
+        with open(self.path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.hashes, self.bits, self.capacity, 0, 0, 1, 0).ljust(HEADER_SIZE, b"\0"))
+            f.truncate(size) # Остаток файла - нули (пустые поколения)
+        self._file = open(self.path, "r+b")
+        return mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_WRITE)
+
+    @property
+    def _active(self) -> int:
+        return 0 if self._generations[0] > self._generations[1] else 1
+
+    @property
+    def generation(self) -> int:
+        """Номер текущего поколения (растет при каждом вращении)."""
+        return self._generations[self._active]
+
+    def __len__(self) -> int:
+        return sum(self._counts)
+
+    def _positions(self, key: int) -> Iterable[int]:
+        # Двойное хеширование (Кирш-Митценмахер): k позиций из двух половин 64-битного ключа
+        low, high = key & _MASK32, (key >> 32) & _MASK32 | 1
+        return ((low + i * high) % self.bits for i in range(self.hashes))
+
+    def _slot_contains(self, slot: int, key: int) -> bool:
+        offset = HEADER_SIZE + slot * self.slot_bytes
+        mm = self._mm
+        return all(mm[offset + (pos >> 3)] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def _slot_add(self, slot: int, key: int) -> None:
+        offset = HEADER_SIZE + slot * self.slot_bytes
+        mm = self._mm
+        for pos in self._positions(key):
+            mm[offset + (pos >> 3)] |= 1 << (pos & 7)
+        self._counts[slot] += 1
+
+    def __contains__(self, key: int) -> bool:
+        return self._slot_contains(0, key) or self._slot_contains(1, key)
+
+    def _write_header(self) -> None:
+        HEADER.pack_into(
+            self._mm, 0, MAGIC, VERSION, self.hashes, self.bits, self.capacity,
+            self._generations[0], self._counts[0], self._generations[1], self._counts[1],
+        )
+
+    def _reset_slot(self, slot: int, generation: int) -> None:
+        offset = HEADER_SIZE + slot * self.slot_bytes
+        self._mm[offset:offset + self.slot_bytes] = bytes(self.slot_bytes)
+        self._generations[slot] = generation
+        self._counts[slot] = 0
+
+    def add(self, key: int) -> int:
+        """Добавляет ключ в текущее поколение (при необходимости вращая фильтр); возвращает номер поколения."""
+        active = self._active
+        if self._counts[active] >= self.capacity:
+            retired = 1 - active
+            logger.info(
+                f"Фильтр {self.path}: поколение {self._generations[active]} заполнено, "
+                f"поколение {self._generations[retired]} ({self._counts[retired]} ключей) очищено."
+            )
+            self._reset_slot(retired, self._generations[active] + 1)
+            active = retired
+        self._slot_add(active, key)
+        self._write_header()
+        return self._generations[active]
+
+    def rebuild(self, items: Iterable[Tuple[int, int]], generation: int) -> int:
+        """Заполняет фильтр заново парами (ключ, поколение): текущее - generation, предыдущее - generation - 1.
+
+        Ключи более старых поколений пропускаются. Возвращает число добавленных ключей.
+        """
+        self._reset_slot(0, generation - 1)
+        self._reset_slot(1, generation)
+        added = 0
+        for key, key_generation in items:
+            if key_generation in (generation - 1, generation):
+                self._slot_add(1 if key_generation == generation else 0, key)
+                added += 1
+        self._write_header()
+        self.created = False
+        return added
+
+    def flush(self) -> None:
+        self._mm.flush()
+
+    def close(self) -> None:
+        if self._mm is not None and not self._mm.closed:
+            self._mm.flush()
+            self._mm.close()
+        if self._file is not None:
+            self._file.close()
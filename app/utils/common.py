@@ -1,6 +1,7 @@
 import re
 import os
 import logging
+from typing import List
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +12,22 @@ def markdown_v2_escape(text: str) -> str:
     escape_chars = r'([_*[\]()~`>#+\-=|{}.!])' # Добавили экранирование для дефиса
     return re.sub(escape_chars, r'\\\1', text)
 
+def load_feeds(file_path: str) -> List[str]:
+    """Загружает список RSS-лент из файла (пустые строки и комментарии # пропускаются)."""
+    feeds: List[str] = []
+    if not os.path.exists(file_path):
+        logger.warning(f"Файл со списком RSS-лент {file_path} не найден.")
+        return feeds
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                url = line.split('#', 1)[0].strip()
+                if url and url not in feeds:
+                    feeds.append(url)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке списка RSS-лент из {file_path}: {e}")
+    return feeds
+
 def load_posted_links(file_path: str) -> set:
     """Загружает ранее опубликованные ссылки из файла."""
     posted_links = set()
@@ -0,0 +1,138 @@
+import calendar
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_tz
+from typing import Any, Optional
+
+# Минимальная tz-aware дата: используется как ключ сортировки для записей без даты
+MIN_UTC_DATETIME = datetime.min.replace(tzinfo=timezone.utc)
+
+# Ключ, под которым разобранная дата кэшируется прямо в записи ленты
+PUBLISHED_CACHE_KEY = "_published_dt"
+
+_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+
+# Именованные зоны, встречающиеся в RFC 822 датах реальных лент (смещение в минутах)
+_NAMED_ZONES = {
+    "Z": 0, "UT": 0, "UTC": 0, "GMT": 0,
+    "EST": -300, "EDT": -240, "CST": -360, "CDT": -300,
+    "MST": -420, "MDT": -360, "PST": -480, "PDT": -420,
+    "CET": 60, "CEST": 120, "MSK": 180,
+}
+
+# ISO 8601 / Atom (RFC 3339): 2024-05-01T12:30:00Z, 2024-05-01T12:30:00.123+03:00, 2024-05-01 12:30, 2024-05-01
+_ISO_RE = re.compile(
+    r"^\s*(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[Tt ](\d{2}):(\d{2})(?::(\d{2})(?:[.,]\d+)?)?)?"
+    r"\s*(Z|z|[+-]\d{2}(?::?\d{2})?|UTC|GMT)?\s*$"
+)
+
+# RFC 822 / RFC 2822: "Wed, 01 May 2024 12:30:00 +0000", "1 May 24 12:30 GMT", "Wednesday, 01-May-2024 12:30:00 EST"
+_RFC822_RE = re.compile(
+    r"^\s*(?:[A-Za-z]+,?\s*)?(\d{1,2})[\s-]+([A-Za-z]{3})[A-Za-z]*\.?[\s-]+(\d{2,4})"
+    r"\s+(\d{1,2}):(\d{2})(?::(\d{2}))?"
+    r"\s*([+-]\d{2}:?\d{2}|[A-Za-z]{1,5})?\s*$"
+)
+
+
+def _offset_from_zone(zone: Optional[str]) -> Optional[int]:
+    """Возвращает смещение зоны в минутах или None, если зона неизвестна."""
+    if not zone:
+        return 0  # Даты без зоны трактуем как UTC
+    if zone[0] in "+-":
+        digits = zone[1:].replace(":", "")
+        hours = int(digits[:2])
+        minutes = int(digits[2:4]) if len(digits) >= 4 else 0
+        offset = hours * 60 + minutes
+        return -offset if zone[0] == "-" else offset
+    return _NAMED_ZONES.get(zone.upper())
+
+
+def _build_utc(year: int, month: int, day: int, hour: int, minute: int, second: int, offset_minutes: int) -> Optional[datetime]:
+    try:
+        local = datetime(year, month, day, hour, minute, min(second, 59), tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return local - timedelta(minutes=offset_minutes)
+
+
+def parse_feed_date(value: Optional[str]) -> Optional[datetime]:
+    """Разбирает строку даты из RSS/Atom в tz-aware datetime (UTC).
+
+    Сначала пробует быстрые регулярные выражения для ISO 8601/Atom и RFC 822,
+    затем email.utils.parsedate_tz как медленный запасной вариант.
+    Возвращает None, если дату разобрать не удалось.
+    """
+    if not value:
+        return None
+
+    match = _ISO_RE.match(value)
+    if match:
+        year, month, day, hour, minute, second, zone = match.groups()
+        offset = _offset_from_zone(zone)
+        if offset is None:
+            return None
+        return _build_utc(
+            int(year), int(month), int(day),
+            int(hour or 0), int(minute or 0), int(second or 0), offset
+        )
+
+    match = _RFC822_RE.match(value)
+    if match:
+        day, month_name, year, hour, minute, second, zone = match.groups()
+        month = _MONTHS.get(month_name.lower())
+        offset = _offset_from_zone(zone)
+        if month and offset is not None:
+            year_num = int(year)
+            if year_num < 100:
+                year_num += 2000 if year_num < 70 else 1900
+            return _build_utc(
+                year_num, month, int(day),
+                int(hour), int(minute), int(second or 0), offset
+            )
+
+    parsed = parsedate_tz(value)
+    if parsed:
+        try:
+            timestamp = calendar.timegm(parsed[:9]) - (parsed[9] or 0)
+            return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+        except (OverflowError, ValueError):
+            return None
+    return None
+
+
+def struct_time_to_utc(value: Any) -> Optional[datetime]:
+    """Переводит time.struct_time от feedparser (всегда в UTC) в tz-aware datetime.
+
+    В отличие от time.mktime не зависит от локальной таймзоны сервера.
+    """
+    if not isinstance(value, (time.struct_time, tuple)):
+        return None
+    try:
+        return datetime.fromtimestamp(calendar.timegm(value), tz=timezone.utc)
+    except (OverflowError, ValueError, TypeError):
+        return None
+
+
+def normalize_entry_date(entry: Any) -> Optional[datetime]:
+    """Возвращает дату публикации записи в UTC, разбирая её только один раз.
+
+    Результат (в том числе None для неразбираемых дат) кэшируется в самой записи
+    под ключом PUBLISHED_CACHE_KEY, поэтому повторные вызовы (сортировка, постинг)
+    ничего не разбирают заново.
+    """
+    if PUBLISHED_CACHE_KEY in entry:
+        return entry[PUBLISHED_CACHE_KEY]
+
+    published = (
+        struct_time_to_utc(entry.get("published_parsed"))
+        or struct_time_to_utc(entry.get("updated_parsed"))
+        or parse_feed_date(entry.get("published"))
+        or parse_feed_date(entry.get("updated"))
+    )
+    entry[PUBLISHED_CACHE_KEY] = published
+    return published
@@ -1,16 +1,24 @@
 import logging
 from typing import Optional, Dict
 
-from app.config import IMAGE_SOURCE_PRIORITY, OPENAI_IMAGE_MODEL
+from app.config import get_settings
 from app.services import ai_service
+from app.utils.metrics import track_stage
 
 logger = logging.getLogger(__name__)
 
+@track_stage("image")
 async def get_final_image_url(
     news_item: Dict, 
-    ai_generated_image_prompt: Optional[str]
+    ai_generated_image_prompt: Optional[str],
+    image_source_priority: Optional[str] = None
 ) -> Optional[str]:
-    """Определяет URL изображения для поста на основе настроек IMAGE_SOURCE_PRIORITY."""
+    """Определяет URL изображения для поста на основе настроек IMAGE_SOURCE_PRIORITY.
+
+    image_source_priority переопределяет глобальную настройку (политика изображений канала).
+    """
+    settings = get_settings()
+    image_source_priority = image_source_priority or settings.image_source_priority
     
     rss_image_url: Optional[str] = None
     # Извлечение URL изображения из RSS (аналогично тому, как это было раньше)
@@ -34,7 +42,7 @@ async def get_final_image_url(
 
     async def _try_generate_ai_image() -> Optional[str]:
         nonlocal ai_generated_image_url
-        if ai_generated_image_prompt and OPENAI_IMAGE_MODEL:
+        if ai_generated_image_prompt and settings.openai_image_model:
             logger.info(f"Попытка генерации AI изображения для новости: '{news_item.get('title', 'N/A')}' (промпт: {ai_generated_image_prompt[:100]}...)")
             ai_generated_image_url = await ai_service.generate_image_with_dalle(ai_generated_image_prompt)
             if ai_generated_image_url:
@@ -44,11 +52,11 @@ async def get_final_image_url(
                 logger.warning("Не удалось сгенерировать AI изображение.")
         return None
 
-    if IMAGE_SOURCE_PRIORITY == "none":
+    if image_source_priority == "none":
         logger.info("Постинг без изображения согласно настройке IMAGE_SOURCE_PRIORITY='none'.")
         return None
 
-    if IMAGE_SOURCE_PRIORITY == "rss_only":
+    if image_source_priority == "rss_only":
         if rss_image_url:
             logger.info(f"Используется изображение из RSS (rss_only): {rss_image_url}")
             return rss_image_url
@@ -56,7 +64,7 @@ async def get_final_image_url(
             logger.info("Изображение из RSS не найдено (rss_only), постинг без изображения.")
             return None
 
-    if IMAGE_SOURCE_PRIORITY == "ai_only":
+    if image_source_priority == "ai_only":
         generated_url = await _try_generate_ai_image()
         if generated_url:
             logger.info(f"Используется AI изображение (ai_only): {generated_url}")
@@ -65,7 +73,7 @@ async def get_final_image_url(
             logger.info("AI изображение не сгенерировано (ai_only), постинг без изображения.")
             return None
 
-    if IMAGE_SOURCE_PRIORITY == "rss_then_ai":
+    if image_source_priority == "rss_then_ai":
         if rss_image_url:
             logger.info(f"Используется изображение из RSS (rss_then_ai): {rss_image_url}")
             return rss_image_url
@@ -78,7 +86,7 @@ async def get_final_image_url(
             logger.info("AI изображение не сгенерировано (rss_then_ai fallback), постинг без изображения.")
             return None
 
-    if IMAGE_SOURCE_PRIORITY == "ai_then_rss":
+    if image_source_priority == "ai_then_rss":
         generated_url = await _try_generate_ai_image()
         if generated_url:
             logger.info(f"Используется AI изображение (ai_then_rss): {generated_url}")
@@ -92,5 +100,5 @@ async def get_final_image_url(
             return None
             
     # На случай если IMAGE_SOURCE_PRIORITY имеет какое-то другое значение (хотя это проверяется в config.py)
-    logger.warning(f"Неизвестное значение IMAGE_SOURCE_PRIORITY: {IMAGE_SOURCE_PRIORITY}. Постинг без изображения.")
+    logger.warning(f"Неизвестное значение IMAGE_SOURCE_PRIORITY: {image_source_priority}. Постинг без изображения.")
     return None 
\ No newline at end of file
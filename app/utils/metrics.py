@@ -0,0 +1,288 @@
+"""Минимальные метрики в формате Prometheus (text exposition 0.0.4).
+
+Счетчики, гауги и гистограммы хранятся в памяти процесса и отдаются по HTTP
+на /metrics локальным aiohttp-сервером (см. start_metrics_server). Внешних
+зависимостей нет: формат простой, а библиотека prometheus_client ради пяти
+метрик не нужна.
+"""
+import functools
+import logging
+import math
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, сек: от быстрых локальных этапов до долгих вызовов LLM
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+_INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получено {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError("Счетчик не может уменьшаться")
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        """Текущие значения по меткам (для подсчета приращения за период)."""
+        return dict(self._values)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """Текущее значение; может вычисляться функцией в момент выдачи метрик."""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = float(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Значение без меток берется из function() при каждом запросе /metrics."""
+        self._function = function
+
+    def value(self, **labels: str) -> float:
+        if self._function is not None and not labels:
+            return float(self._function())
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception as e:
+                logger.error(f"Ошибка при вычислении метрики {self.name}: {e}")
+                return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Гистограмма с накопительными корзинами, суммой и количеством наблюдений."""
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики корзин..., сумма, количество]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        state = self._values.get(self._key(labels))
+        return int(state[-1]) if state else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, state in sorted(self._values.items()):
+            for bound, bucket_count in zip(self.buckets, state):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(bucket_count)}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, _INF_LABEL)} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class LatencyWindow:
+    """Последние N длительностей по каждому этапу: живые перцентили для /status.
+
+    В отличие от гистограммы (накопленной с запуска, с грубыми корзинами),
+    окно показывает задержки последних вызовов. В /metrics не выводится.
+    """
+
+    def __init__(self, size: int = 256):
+        self.size = size
+        self._values: Dict[str, Deque[float]] = {}
+
+    def observe(self, stage: str, value: float) -> None:
+        window = self._values.get(stage)
+        if window is None:
+            window = self._values[stage] = deque(maxlen=self.size)
+        window.append(value)
+
+    def percentiles(self, quantiles: Sequence[float] = (0.5, 0.95)) -> Dict[str, Tuple[int, List[float]]]:
+        """Этап -> (число значений в окне, [перцентили в секундах])."""
+        result = {}
+        for stage, window in self._values.items():
+            values = sorted(window)
+            result[stage] = (len(values), [values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))] for q in quantiles])
+        return result
+
+
+class Registry:
+    """Набор метрик процесса."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Метрики бота ---
+
+STAGE_LATENCY: Histogram = REGISTRY.register(Histogram(
+    "newsbot_stage_duration_seconds",
+    "Длительность этапов конвейера (stage) с результатом (outcome: ok, empty, error; "
+    "для ступеней каскада моделей llm:<модель> еще rejected - ответ не прошел проверку).",
+    ["stage", "outcome"],
+))
+POSTS: Counter = REGISTRY.register(Counter(
+    "newsbot_posts_total", "Опубликованные посты по каналам.", ["channel"]
+))
+DEDUPE_HITS: Counter = REGISTRY.register(Counter(
+    "newsbot_dedupe_hits_total", "Отброшенные дубли (где сработала проверка: queue, posted, claim, story).", ["where"]
+))
+FAILURES: Counter = REGISTRY.register(Counter(
+    "newsbot_failures_total", "Ошибки конвейера по причинам.", ["reason"]
+))
+LLM_TOKENS: Counter = REGISTRY.register(Counter(
+    "newsbot_llm_tokens_total", "Токены LLM по провайдеру и типу (prompt, cached - часть prompt из кэша провайдера, completion).", ["provider", "kind"]
+))
+LLM_COST: Counter = REGISTRY.register(Counter(
+    "newsbot_llm_cost_usd_total", "Стоимость вызовов LLM в USD по ценам LLM_PRICES.", ["provider", "model"]
+))
+ARTICLE_EXTRACTIONS: Counter = REGISTRY.register(Counter(
+    "newsbot_article_extractions_total",
+    "Извлечение текста статей по уровням (tier: feed, prefetched, meta, readability, none).",
+    ["tier"],
+))
+QUEUE_DEPTH: Gauge = REGISTRY.register(Gauge(
+    "newsbot_queue_depth", "Количество кандидатов в очереди на публикацию."
+))
+FEED_TICK_MEMORY: Gauge = REGISTRY.register(Gauge(
+    "newsbot_feed_tick_memory_bytes",
+    "Память последнего опроса лент по tracemalloc (kind: peak - пик за опрос, retained - удерживают записи).",
+    ["kind"],
+))
+RECENT_LATENCY = LatencyWindow()
+
+
+def track_stage(stage: str):
+    """Декоратор async-функции этапа: пишет длительность в STAGE_LATENCY.
+
+    outcome = "ok" для непустого результата, "empty" для None/False/[],
+    "error" при исключении (исключение пробрасывается дальше).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = "ok" if result else "empty"
+                return result
+            finally:
+                duration = time.perf_counter() - start
+                STAGE_LATENCY.observe(duration, stage=stage, outcome=outcome)
+                RECENT_LATENCY.observe(stage, duration)
+        return wrapper
+    return decorator
+
+
+async def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Запускает HTTP-сервер с /metrics. Возвращает aiohttp AppRunner (для cleanup())."""
+    from aiohttp import web
+
+    async def handle_metrics(request: "web.Request") -> "web.Response":
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,154 @@
+"""Терпимый разбор JSON из ответа модели.
+
+Модель в режиме JSON почти всегда возвращает корректный объект, но бывает и
+иначе: ответ обернут в ```json ... ```, перед объектом есть пояснение, стоит
+лишняя запятая, строка содержит перевод строки без экранирования или ответ
+обрезан по max_tokens посреди строки. json.loads в этих случаях отказывает
+целиком, и весь вызов пропадает.
+
+parse_partial_json читает значение слева направо за один проход и на любом
+префиксе корректного JSON возвращает уже прочитанную часть: незакрытые строки,
+массивы и объекты закрываются, ключ без значения отбрасывается. Поэтому
+обрезанный ответ дает объект с полными первыми полями и началом последнего.
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+_WHITESPACE = " \t\r\n"
+# Число допускает обрезанный хвост ("1.", "2e"): он отбрасывается при разборе
+_LITERAL_RE = re.compile(r"-?\d+(?:\.\d*)?(?:[eE][+-]?\d*)?|true|false|null")
+_LITERALS = {"true": True, "false": False, "null": None}
+_ESCAPES = {'"': '"', "'": "'", "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_BARE_KEY_RE = re.compile(r"[A-Za-z_][\w-]*")
+
+
+class _Truncated(ValueError):
+    """Текст закончился посреди значения."""
+
+
+class _Parser:
+    def __init__(self, text: str, start: int):
+        self.text = text
+        self.pos = start
+
+    def _at_end(self) -> bool:
+        return self.pos >= len(self.text)
+
+    def _skip(self, chars: str = _WHITESPACE) -> None:
+        while self.pos < len(self.text) and self.text[self.pos] in chars:
+            self.pos += 1
+
+    def value(self) -> Any:
+        self._skip()
+        if self._at_end():
+            raise _Truncated("нет значения")
+        char = self.text[self.pos]
+        if char == "{":
+            return self._object()
+        if char == "[":
+            return self._array()
+        if char in "\"'":
+            return self._string()[0]
+        match = _LITERAL_RE.match(self.text, self.pos)
+        if not match:
+            rest = self.text[self.pos:]
+            if rest == "-" or any(literal.startswith(rest) for literal in _LITERALS):
+                raise _Truncated("обрезанный литерал")
+            raise ValueError(f"неожиданный символ {char!r} в позиции {self.pos}")
+        self.pos = match.end()
+        literal = match.group()
+        if literal in _LITERALS:
+            return _LITERALS[literal]
+        literal = literal.rstrip("eE+-")
+        return float(literal) if any(c in literal for c in ".eE") else int(literal)
+
+    def _string(self) -> Tuple[str, bool]:
+        """Строка в двойных или одинарных кавычках; (значение, закрыта ли строка)."""
+        quote = self.text[self.pos]
+        self.pos += 1
+        chars: List[str] = []
+        while not self._at_end():
+            char = self.text[self.pos]
+            self.pos += 1
+            if char == quote:
+                return "".join(chars), True
+            if char != "\\":
+                chars.append(char) # Неэкранированный перевод строки тоже допускается
+                continue
+            if self._at_end():
+                break
+            escaped = self.text[self.pos]
+            self.pos += 1
+            if escaped == "u":
+                code = self.text[self.pos:self.pos + 4]
+                if len(code) < 4:
+                    self.pos = len(self.text)
+                    break
+                try:
+                    chars.append(chr(int(code, 16)))
+                except ValueError:
+                    chars.append("\\u" + code)
+                self.pos += 4
+            else:
+                chars.append(_ESCAPES.get(escaped, escaped))
+        return "".join(chars), False
+
+    def _object(self) -> Dict[str, Any]:
+        self.pos += 1
+        result: Dict[str, Any] = {}
+        while True:
+            self._skip(_WHITESPACE + ",")
+            if self._at_end():
+                return result
+            char = self.text[self.pos]
+            if char == "}":
+                self.pos += 1
+                return result
+            if char in "\"'":
+                key, closed = self._string()
+                if not closed:
+                    return result
+            else:
+                match = _BARE_KEY_RE.match(self.text, self.pos)
+                if not match:
+                    raise ValueError(f"неожиданный символ {char!r} в позиции {self.pos}")
+                key = match.group()
+                self.pos = match.end()
+            self._skip()
+            if self._at_end():
+                return result
+            if self.text[self.pos] != ":":
+                raise ValueError(f"ожидалось ':' в позиции {self.pos}")
+            self.pos += 1
+            try:
+                result[key] = self.value()
+            except _Truncated:
+                return result
+
+    def _array(self) -> List[Any]:
+        self.pos += 1
+        result: List[Any] = []
+        while True:
+            self._skip(_WHITESPACE + ",")
+            if self._at_end():
+                return result
+            if self.text[self.pos] == "]":
+                self.pos += 1
+                return result
+            try:
+                result.append(self.value())
+            except _Truncated:
+                return result
+
+
+def parse_partial_json(text: Optional[str]) -> Optional[Any]:
+    """Первый JSON-объект или массив в тексте, в том числе обрезанный; None - если его нет или он испорчен."""
+    if not text:
+        return None
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None
+    try:
+        return _Parser(text, min(starts)).value()
+    except ValueError:
+        return None
@@ -0,0 +1,253 @@
+"""Легковесная трассировка обработки новостей.
+
+Каждая новость обрабатывается в своей трассе (trace id хранится в contextvar,
+поэтому параллельные задачи asyncio не путаются), а этапы оборачиваются в спаны:
+
+    with start_trace("process_and_post_news", link=link):
+        with span("article_fetch") as s:
+            content = await fetch_article_content(link, session)
+            s.set(chars=len(content or ""))
+
+Законченная трасса экспортируется целиком: в JSONL-файл (TRACE_EXPORT=jsonl,
+по одному спану на строку) или в OTLP/HTTP-совместимый коллектор
+(TRACE_EXPORT=otlp, JSON на TRACE_OTLP_ENDPOINT). Без экспорта трассы
+все равно создаются: trace id попадает в логи через TraceIdFilter.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(n_bytes: int) -> str:
+    return os.urandom(n_bytes).hex()
+
+
+class Span:
+    """Один этап обработки: имя, время начала/конца, атрибуты и статус."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attributes", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.time()) - self.start)
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Заглушка, возвращаемая span() вне трассы: set() ничего не делает."""
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """Все спаны одной новости."""
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or _new_id(16)
+        self.spans: List[Span] = []
+
+
+# --- Экспорт ---
+
+class JsonlExporter:
+    """Дописывает спаны в JSONL-файл (одна строка на спан)."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]) -> None:
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for s in spans:
+                    f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            logger.error(f"Ошибка при записи трассы в {self.path}: {e}")
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        result.append({"key": key, "value": typed})
+    return result
+
+
+class OtlpHttpExporter:
+    """Отправляет спаны в формате OTLP/JSON (POST /v1/traces) в фоне, не блокируя обработку."""
+
+    def __init__(self, endpoint: str, service_name: str = "telegram-ai-news-bot"):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._pending: set = set()
+
+    def payload(self, spans: List[Span]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+            "scopeSpans": [{
+                "scope": {"name": "app.utils.tracing"},
+                "spans": [{
+                    "traceId": s.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id or "",
+                    "name": s.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(int(s.start * 1e9)),
+                    "endTimeUnixNano": str(int((s.end or s.start) * 1e9)),
+                    "attributes": _otlp_attributes(s.attributes),
+                    "status": {"code": 2, "message": s.error or ""} if s.status == "error" else {"code": 1},
+                } for s in spans],
+            }],
+        }]}
+
+    def export(self, spans: List[Span]) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.debug("Нет запущенного event loop, трасса в OTLP не отправлена.")
+            return
+        task = loop.create_task(self._send(self.payload(spans)))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _send(self, payload: Dict[str, Any]) -> None:
+        import aiohttp
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(self.endpoint, json=payload, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                    if response.status >= 400:
+                        logger.warning(f"OTLP коллектор {self.endpoint} ответил {response.status}")
+        except Exception as e:
+            logger.warning(f"Не удалось отправить трассу в {self.endpoint}: {e}")
+
+
+_exporter: Any = None
+_exporter_configured = False
+
+
+def get_exporter():
+    """Экспортер из настроек TRACE_EXPORT (None, если экспорт выключен)."""
+    global _exporter, _exporter_configured
+    if not _exporter_configured:
+        settings = get_settings()
+        mode = settings.trace_export.lower()
+        if mode == "jsonl":
+            _exporter = JsonlExporter(settings.trace_file)
+        elif mode == "otlp":
+            _exporter = OtlpHttpExporter(settings.trace_otlp_endpoint)
+        elif mode:
+            logger.warning(f"Неизвестное значение TRACE_EXPORT: '{mode}'. Экспорт трасс отключен.")
+        _exporter_configured = True
+    return _exporter
+
+
+def set_exporter(exporter) -> None:
+    """Подменяет экспортер (для бенчмарков и тестов); None отключает экспорт."""
+    global _exporter, _exporter_configured
+    _exporter = exporter
+    _exporter_configured = True
+
+
+# --- Публичный API ---
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None, **attributes: Any) -> Iterator[Span]:
+    """Открывает трассу с корневым спаном name и экспортирует ее по завершении.
+
+    trace_id позволяет продолжить трассу, начатую ранее (например, превью и
+    последующая публикация в /prepare_post).
+    """
+    trace = Trace(trace_id)
+    trace_token = _current_trace.set(trace)
+    try:
+        with span(name, **attributes) as root:
+            yield root
+    finally:
+        _current_trace.reset(trace_token)
+        exporter = get_exporter()
+        if exporter is not None:
+            exporter.export(trace.spans)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Спан этапа внутри текущей трассы. Вне трассы ничего не записывает."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+    parent = _current_span.get()
+    current = Span(name, trace.trace_id, parent.span_id if parent else None, attributes)
+    span_token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end = time.time()
+        _current_span.reset(span_token)
+        trace.spans.append(current)
+
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет в записи логов поле trace_id ("-" вне трассы)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id() or "-"
+        return True
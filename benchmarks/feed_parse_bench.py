@@ -0,0 +1,113 @@
+"""Бенчмарк разбора лент: быстрый парсер на lxml против feedparser.
+
+Ленты берутся из feeds.txt (скачиваются один раз), плюс записанная фикстура
+benchmarks/fixtures/feed.xml, поэтому без сети бенчмарк тоже работает. Каждая
+лента разбирается обоими парсерами --repeat раз; выводятся медианное время,
+ускорение, число записей и расхождения в полях, которые использует бот
+(title, link, id, дата публикации, наличие содержимого и картинок).
+
+Запуск из корня проекта:
+
+    python benchmarks/feed_parse_bench.py
+    python benchmarks/feed_parse_bench.py --feeds-file feeds.txt --repeat 20 --offline
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import urllib.request
+from email.utils import formatdate
+from typing import Any, Callable, Dict, List, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app.services.feed_parser import as_feedparser_dict, parse_feed_bytes, parse_with_feedparser  # noqa: E402
+from app.utils.common import load_feeds  # noqa: E402
+from app.utils.dates import normalize_entry_date  # noqa: E402
+
+
+def fixture_feed() -> bytes:
+    with open(os.path.join(PROJECT_ROOT, "benchmarks", "fixtures", "feed.xml"), "r", encoding="utf-8") as f:
+        body = f.read().replace("{base}", "http://127.0.0.1").replace("{feed}", "0")
+    now = time.time()
+    for i in range(20):
+        body = body.replace("{date%d}" % i, formatdate(now - i * 1800, usegmt=True))
+    return body.encode("utf-8")
+
+
+def download(url: str, timeout: float = 20.0) -> bytes:
+    request = urllib.request.Request(url, headers={"User-Agent": "telegram-ai-news-bot/1.0 (RSS reader)"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def time_parser(parse: Callable[[], Dict[str, Any]], repeat: int) -> Tuple[float, Dict[str, Any]]:
+    samples = []
+    result: Dict[str, Any] = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = parse()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def _has_image(entry: Any) -> bool:
+    if any(m.get("medium") == "image" for m in entry.get("media_content", [])):
+        return True
+    return any(str(l.get("type", "")).startswith("image/") for l in entry.get("links", []) + entry.get("enclosures", []))
+
+
+def mismatches(fast: List[Any], reference: List[Any]) -> Dict[str, int]:
+    """Расхождения по полям между записями быстрого парсера и feedparser."""
+    counts = {"count": abs(len(fast) - len(reference))}
+    checks = {
+        "title": lambda e: e.get("title"),
+        "link": lambda e: e.get("link"),
+        "id": lambda e: e.get("id"),
+        "date": normalize_entry_date,
+        "content": lambda e: bool(e.get("content")),
+        "image": _has_image,
+    }
+    for name, get in checks.items():
+        counts[name] = sum(1 for a, b in zip(fast, reference) if get(a) != get(b))
+    return {k: v for k, v in counts.items() if v}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--feeds-file", default=os.path.join(PROJECT_ROOT, "feeds.txt"))
+    parser.add_argument("--repeat", type=int, default=10, help="Сколько раз разбирать каждую ленту")
+    parser.add_argument("--offline", action="store_true", help="Только записанная фикстура, без сети")
+    args = parser.parse_args()
+
+    feeds: List[Tuple[str, bytes]] = [("fixtures/feed.xml", fixture_feed())]
+    if not args.offline:
+        for url in load_feeds(args.feeds_file):
+            try:
+                feeds.append((url, download(url)))
+            except Exception as e:
+                print(f"Пропуск {url}: {e}", file=sys.stderr)
+
+    header = f"{'лента':<50} {'парсер':<10} {'записей':>7} {'быстрый, мс':>12} {'feedparser, мс':>15} {'ускор.':>7}  расхождения"
+    print(header)
+    print("-" * len(header))
+    total_fast = total_reference = 0.0
+    for name, data in feeds:
+        fast_time, fast = time_parser(lambda: parse_feed_bytes(data), args.repeat)
+        reference_time, reference = time_parser(lambda: parse_with_feedparser(data), args.repeat)
+        total_fast += fast_time
+        total_reference += reference_time
+        diff = mismatches(as_feedparser_dict(fast["entries"]), as_feedparser_dict(reference["entries"]))
+        print(
+            f"{name[-50:]:<50} {fast['parser']:<10} {len(fast['entries']):>7} {fast_time * 1000:>12.2f} "
+            f"{reference_time * 1000:>15.2f} {reference_time / fast_time:>6.1f}x  {diff or '-'}"
+        )
+    if total_fast:
+        print(f"\nИтого: {total_fast * 1000:.1f} мс против {total_reference * 1000:.1f} мс ({total_reference / total_fast:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Бенчмарк слоя генерации (ai_service) на заглушке LLM: пропускная способность и поведение при сбоях.
+
+Синтетические новости проходят reformat_news_for_channel параллельно через
+заглушку LLM (app.llm_stub.LLMReplayStub внутри benchmarks/stub_servers.py) с
+заданной задержкой, разбросом и долей ответов с ошибкой. Ключи и сеть не нужны.
+С --fixtures ответы воспроизводятся из каталога, записанного с LLM_RECORD_DIR.
+
+Запуск из корня проекта:
+
+    python benchmarks/llm_bench.py
+    python benchmarks/llm_bench.py --items 200 --concurrency 1,8,32 --latency 0.8 --jitter 0.4 --error-rate 0,0.05,0.2
+    python benchmarks/llm_bench.py --cascade gpt-4o-mini,gpt-4o --fixtures llm_fixtures --output llm_bench.json
+
+Для каждой пары (параллелизм, доля ошибок) выводятся: успешные посты, посты/с,
+p50/p95 времени на пост, запросы к заглушке и повторы клиента OpenAI, внесенные
+ошибки, причины отказов и исходы ступеней каскада моделей.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from pipeline_bench import _timed_concurrently, percentile  # noqa: E402
+from stub_servers import StubServer, StubServerThread  # noqa: E402
+
+OUTCOMES = ("ok", "rejected", "empty", "error")
+
+SUMMARY = (
+    "OpenAI представила обновление модели с более строгим следованием инструкциям. "
+    "The release also cuts prices for cached prompt tokens and adds a structured output mode. "
+    "Разработчики отмечают, что короткие промпты с примерами дают более стабильные ответы. "
+) * 3
+
+
+def _stage_counts(stage: str) -> Dict[str, int]:
+    from app.utils.metrics import STAGE_LATENCY
+
+    return {outcome: STAGE_LATENCY.count(stage=stage, outcome=outcome) for outcome in OUTCOMES}
+
+
+def _delta(before: Dict, after: Dict) -> Dict:
+    return {key: after[key] - before.get(key, 0) for key in after if after[key] - before.get(key, 0)}
+
+
+async def run_scenario(items: int, concurrency: int, latency: float, jitter: float, error_rate: float, cascade: str, fixtures: str, seed: int) -> Dict:
+    from app.config import Settings, configure_settings
+    from app.services import ai_service
+    from app.utils.metrics import FAILURES
+
+    stub = StubServer(llm_latency=latency, llm_jitter=jitter, llm_error_rate=error_rate, llm_fixtures_dir=fixtures, seed=seed)
+    workdir = tempfile.mkdtemp(prefix="newsbot-llm-bench-")
+    models = [model.strip() for model in cascade.split(",") if model.strip()]
+    with StubServerThread(stub) as server:
+        configure_settings(Settings(
+            bot_token="123456:BENCH",
+            telegram_channel_id=-1001,
+            openai_api_key="bench",
+            openai_base_url=f"{server.base_url}/v1",
+            feeds=[f"{server.base_url}/feeds/0.xml"],
+            posted_links_file=os.path.join(workdir, "posted_links.txt"),
+            feed_poll_state_file=None,
+            relevance_model_file=None,
+            channels_file=None,
+            llm_usage_file=os.path.join(workdir, "llm_usage.json"),
+            llm_cascade_models=cascade,
+        ))
+        stages = ["llm"] + [f"llm:{model}" for model in models]
+        before = {stage: _stage_counts(stage) for stage in stages}
+        failures_before = {labels[0]: value for labels, value in FAILURES.snapshot().items()}
+
+        async def reformat(i: int):
+            return await ai_service.reformat_news_for_channel(
+                news_title=f"Bench news {i}: model update",
+                news_summary=SUMMARY,
+                news_link=f"https://example.com/news/{i}",
+            )
+        try:
+            results, latencies, wall = await _timed_concurrently(reformat, range(items), concurrency)
+        finally:
+            await ai_service.close_httpx_client()
+
+    after = {stage: _stage_counts(stage) for stage in stages}
+    failures = _delta(failures_before, {labels[0]: value for labels, value in FAILURES.snapshot().items()})
+    llm_calls = sum(_delta(before["llm"], after["llm"]).values())
+    stub_stats = dict(stub.llm.stats)
+    ok = sum(1 for result in results if result)
+    return {
+        "items": items,
+        "concurrency": concurrency,
+        "error_rate": error_rate,
+        "ok": ok,
+        "success_rate": ok / items if items else 0.0,
+        "posts_per_sec": ok / wall if wall > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "llm_calls": llm_calls,
+        "stub_requests": stub_stats.get("requests", 0),
+        # Запросы сверх вызовов ai_service - повторы клиента OpenAI после ошибок
+        "client_retries": stub_stats.get("requests", 0) - llm_calls,
+        "injected_errors": {key[len("error_"):]: value for key, value in stub_stats.items() if key.startswith("error_")},
+        "replayed": stub_stats.get("replayed", 0),
+        "failures": {reason: int(count) for reason, count in failures.items()},
+        "tiers": {stage[len("llm:"):]: _delta(before[stage], after[stage]) for stage in stages[1:]},
+    }
+
+
+def print_report(reports: List[Dict]) -> None:
+    header = (
+        f"{'парал.':>6} {'ошибки':>7} {'успех':>7} {'пост/с':>8} {'p50, мс':>9} {'p95, мс':>9} "
+        f"{'вызовы':>7} {'запросы':>8} {'повторы':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        print(
+            f"{r['concurrency']:>6} {r['error_rate']:>7.0%} {r['success_rate']:>7.0%} {r['posts_per_sec']:>8.1f} "
+            f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['llm_calls']:>7} {r['stub_requests']:>8} {r['client_retries']:>8}"
+        )
+        details = []
+        if r["injected_errors"]:
+            details.append("внесено ошибок " + ", ".join(f"{code}: {count}" for code, count in sorted(r["injected_errors"].items())))
+        if r["failures"]:
+            details.append("отказы " + ", ".join(f"{reason}: {count}" for reason, count in sorted(r["failures"].items())))
+        for model, outcomes in r["tiers"].items():
+            if outcomes:
+                details.append(f"{model} " + ", ".join(f"{outcome} {count}" for outcome, count in outcomes.items()))
+        for line in details:
+            print(f"{'':>15}{line}")
+
+
+def _list(raw: str, cast) -> list:
+    return [cast(x) for x in raw.split(",") if x.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=100, help="Сколько новостей прогнать в каждом сценарии")
+    parser.add_argument("--concurrency", default="1,8,32", help="Параллелизм вызовов (через запятую)")
+    parser.add_argument("--latency", type=float, default=0.3, help="Средняя задержка ответа заглушки LLM, сек")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Разброс задержки (±), сек")
+    parser.add_argument("--error-rate", default="0,0.1", help="Доли ответов с ошибкой (через запятую)")
+    parser.add_argument("--cascade", default="", help="LLM_CASCADE_MODELS для прогона (пусто - одна модель)")
+    parser.add_argument("--fixtures", help="Каталог фикстур LLM (записанный с LLM_RECORD_DIR)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed задержек и ошибок")
+    parser.add_argument("--output", help="Сохранить отчеты в JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    async def run_all() -> List[Dict]:
+        reports = []
+        for concurrency in _list(args.concurrency, int):
+            for error_rate in _list(args.error_rate, float):
+                reports.append(await run_scenario(
+                    args.items, concurrency, args.latency, args.jitter, error_rate, args.cascade, args.fixtures, args.seed
+                ))
+        return reports
+
+    start = time.perf_counter()
+    reports = asyncio.run(run_all())
+    print_report(reports)
+    print(f"\nВсего {time.perf_counter() - start:.1f} с")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Офлайн-бенчмарк всего конвейера на записанных фикстурах.
+
+Внешние сервисы (RSS, сайты, OpenAI, Telegram) заменены локальными заглушками
+из benchmarks/stub_servers.py, поэтому ключи и сеть не нужны. Каждая комбинация
+(число лент, параллелизм) выполняется в отдельном процессе, чтобы пиковый RSS
+не накапливался между прогонами.
+
+Запуск из корня проекта:
+
+    python benchmarks/pipeline_bench.py
+    python benchmarks/pipeline_bench.py --feeds 1,10,50 --concurrency 1,8 --llm-latency 0.3 --output bench.json
+
+Этапы: fetch_feed_entries, fetch_article_content, reformat_news_for_channel,
+clean_for_tg_html и scheduled_post_job (сбор + публикация, время на пост берется
+из трасс process_and_post_news). Для каждого этапа выводятся пропускная
+способность (элементов/с), p50/p95 задержки и пиковый RSS процесса, а для опроса
+лент еще пик памяти и объем, удерживаемый записями (tracemalloc).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Перцентиль методом ближайшего ранга (q от 0 до 100)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, int(round(q / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(latencies: List[float], wall_time: float) -> Dict[str, float]:
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / wall_time if wall_time > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux в килобайтах, в macOS в байтах
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class _RootSpanCollector:
+    """Экспортер трасс, запоминающий длительность корневых спанов (время на одну новость)."""
+
+    def __init__(self):
+        self.durations: List[float] = []
+
+    def export(self, spans) -> None:
+        self.durations.extend(s.duration for s in spans if s.parent_id is None)
+
+
+async def _timed_concurrently(func, items, concurrency: int):
+    """Выполняет func(item) для всех items с ограничением параллелизма; возвращает (результаты, задержки, время)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def run(item):
+        async with semaphore:
+            start = time.perf_counter()
+            result = await func(item)
+            latencies.append(time.perf_counter() - start)
+            return result
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run(item) for item in items))
+    return results, latencies, time.perf_counter() - start
+
+
+async def run_worker(base_url: str, feed_count: int, concurrency: int, items: int, posts: int) -> Dict:
+    from app.bot import create_bot
+    from app.config import Settings, configure_settings
+    from app.services import ai_service, rss_service
+    from app.services.content_fetch_service import fetch_article_content
+    from app.services.http_fetcher import close_http_fetcher
+    from app.services.runtime_state import get_runtime_state
+    from app.scheduler import scheduled_post_job
+    from app.utils import tracing
+
+    workdir = tempfile.mkdtemp(prefix="newsbot-bench-")
+    settings = configure_settings(Settings(
+        bot_token="123456:BENCH",
+        telegram_channel_id=-1001,
+        telegram_api_base=base_url,
+        openai_api_key="bench",
+        openai_base_url=f"{base_url}/v1",
+        feeds=[f"{base_url}/feeds/{i}.xml" for i in range(feed_count)],
+        image_source_priority="rss_only",
+        posted_links_file=os.path.join(workdir, "posted_links.txt"),
+        feed_poll_state_file=None,
+        relevance_model_file=None,
+        channels_file=None,
+        llm_usage_file=os.path.join(workdir, "llm_usage.json"),
+        feed_content_cache_file=os.path.join(workdir, "feed_content.sqlite3"),
+        feed_trace_memory=True,
+        # Все "сайты" бенчмарка на одном хосте: вежливые задержки исказили бы замер параллелизма
+        fetch_host_delay=0.0,
+        http_max_connections_per_host=0,
+    ))
+    collector = _RootSpanCollector()
+    tracing.set_exporter(collector)
+    report: Dict = {"feeds": feed_count, "concurrency": concurrency, "stages": {}}
+
+    # 1. Загрузка и разбор лент
+    start = time.perf_counter()
+    entries = await rss_service.fetch_feed_entries()
+    feed_time = time.perf_counter() - start
+    # Ленты опрашиваются одним gather: задержка - время всего опроса, пропускная способность - записей/с
+    report["stages"]["fetch_feed_entries"] = dict(
+        summarize([feed_time], feed_time), count=len(entries), throughput=len(entries) / feed_time
+    )
+    # Пик памяти за опрос лент и сколько удерживают записи (tracemalloc, см. FEED_TRACE_MEMORY)
+    peak_bytes, retained_bytes, _ = get_runtime_state().last_feed_memory
+    report["feed_memory_mb"] = {"peak": peak_bytes / 2**20, "retained": retained_bytes / 2**20}
+
+    sample = entries[:items]
+    # 2. Загрузка статей и извлечение основного текста
+    contents, latencies, wall = await _timed_concurrently(
+        lambda entry: fetch_article_content(entry["link"]), sample, concurrency
+    )
+    report["stages"]["fetch_article_content"] = summarize(latencies, wall)
+
+    # 3. Генерация поста через (заглушку) LLM
+    async def reformat(pair):
+        entry, content = pair
+        return await ai_service.reformat_news_for_channel(
+            news_title=entry["title"], news_summary=entry.get("summary", ""),
+            news_link=entry["link"], news_content=content,
+        )
+    results, latencies, wall = await _timed_concurrently(reformat, list(zip(sample, contents)), concurrency)
+    report["stages"]["reformat_news_for_channel"] = summarize(latencies, wall)
+
+    # 4. Очистка HTML статьи (чистый CPU)
+    latencies = []
+    start = time.perf_counter()
+    for content in contents:
+        step = time.perf_counter()
+        ai_service.clean_for_tg_html(content or "")
+        latencies.append(time.perf_counter() - step)
+    report["stages"]["clean_for_tg_html"] = summarize(latencies, time.perf_counter() - start)
+
+    # 5. Полный цикл: сбор в очередь и публикация лучших новостей
+    bot = create_bot(settings)
+    try:
+        start = time.perf_counter()
+        await scheduled_post_job(bot, max_posts=posts, only_due=False)
+        report["stages"]["scheduled_post_job"] = summarize(collector.durations, time.perf_counter() - start)
+    finally:
+        await bot.session.close()
+        await ai_service.close_httpx_client()
+        await close_http_fetcher()
+
+    report["ok_results"] = sum(1 for r in results if r)
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def run_scenario(base_url: str, feed_count: int, concurrency: int, items: int, posts: int) -> Dict:
+    """Запускает один сценарий в отдельном процессе и возвращает его отчет."""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", "--base-url", base_url,
+        "--feeds", str(feed_count), "--concurrency", str(concurrency),
+        "--items", str(items), "--posts", str(posts),
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=PROJECT_ROOT).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_report(reports: List[Dict]) -> None:
+    header = f"{'лент':>5} {'парал.':>6}  {'этап':<27} {'кол-во':>6} {'эл/с':>9} {'p50, мс':>9} {'p95, мс':>9} {'RSS, МБ':>8}"
+    print(header)
+    print("-" * len(header))
+    for report in reports:
+        for stage, stats in report["stages"].items():
+            print(
+                f"{report['feeds']:>5} {report['concurrency']:>6}  {stage:<27} {stats['count']:>6} "
+                f"{stats['throughput']:>9.1f} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {report['peak_rss_mb']:>8.1f}"
+            )
+        memory = report["feed_memory_mb"]
+        print(
+            f"{report['feeds']:>5} {report['concurrency']:>6}  память опроса лент: пик {memory['peak']:.1f} МБ, "
+            f"удерживается записями {memory['retained']:.1f} МБ"
+        )
+
+
+def _int_list(raw: str) -> List[int]:
+    return [int(x) for x in raw.split(",") if x.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--feeds", default="1,5,20", help="Число лент (через запятую)")
+    parser.add_argument("--concurrency", default="1,4,16", help="Параллелизм загрузки статей и вызовов LLM")
+    parser.add_argument("--items", type=int, default=40, help="Сколько записей прогонять через статьи и LLM")
+    parser.add_argument("--posts", type=int, default=10, help="max_posts для scheduled_post_job")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Задержка ответа заглушки LLM, сек")
+    parser.add_argument("--article-latency", type=float, default=0.05, help="Задержка ответа страницы статьи, сек")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="Задержка ответа заглушки Telegram, сек")
+    parser.add_argument("--output", help="Сохранить отчеты в JSON")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        logging.basicConfig(level=logging.WARNING)
+        report = asyncio.run(run_worker(args.base_url, int(args.feeds), int(args.concurrency), args.items, args.posts))
+        print(json.dumps(report))
+        return
+
+    from stub_servers import StubServer, StubServerThread
+
+    stub = StubServer(
+        llm_latency=args.llm_latency,
+        article_latency=args.article_latency,
+        telegram_latency=args.telegram_latency,
+    )
+    reports = []
+    with StubServerThread(stub) as server:
+        for feed_count in _int_list(args.feeds):
+            for concurrency in _int_list(args.concurrency):
+                reports.append(run_scenario(server.base_url, feed_count, concurrency, args.items, args.posts))
+    print_report(reports)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
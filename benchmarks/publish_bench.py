@@ -0,0 +1,161 @@
+"""Бенчмарк публикации в Telegram на локальном заменителе Bot API.
+
+Готовые посты отправляются через telegram_service.post_to_channel (очередь
+TelegramSender) в несколько каналов заглушки app.telegram_stub.FakeBotAPI.
+Заглушка проверяет HTML и длину сообщений и отвечает 429 по лимитам Telegram
+или случайно, поэтому прогон показывает и пропускную способность публикации, и
+то, что отправитель повторяет запросы после флуд-контроля без потерь и дублей.
+
+Запуск из корня проекта:
+
+    python benchmarks/publish_bench.py
+    python benchmarks/publish_bench.py --channels 40 --posts 3 --latency 0.1 --flood-rate 0.2
+    python benchmarks/publish_bench.py --scenarios burst --output publish_bench.json
+
+Сценарии:
+
+    paced   интервалы отправителя по умолчанию (TELEGRAM_*), лимиты Telegram включены
+    burst   интервалы отправителя отключены: 429 по лимитам Telegram, проверка повторов
+    flood   интервалы отключены, лимитов нет, случайные 429 с долей --flood-rate
+
+Для каждого сценария выводятся: доставленные посты из отправленных, посты/с,
+p50/p95 времени на пост, ответы 429 и 400 заглушки, повторы отправителя и дубли.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from pipeline_bench import _timed_concurrently, percentile  # noqa: E402
+from stub_servers import StubServer, StubServerThread  # noqa: E402
+
+SCENARIOS = ("paced", "burst", "flood")
+
+POST_TEMPLATE = (
+    "<b>🤖 Новость {i}: обновление модели</b>\n\n"
+    "Разработчики представили обновление, которое заметно упрощает работу с языковыми моделями. "
+    "Короткие промпты с примерами дают более стабильный результат &amp; снижают стоимость запросов.\n\n"
+    "<i>Подробнее</i> — <a href=\"https://example.com/news/{i}\">в источнике</a>\n\n"
+    "#ИИ #LLM #PromptEngineering"
+)
+
+
+def _retry_after_count() -> int:
+    from app.utils.metrics import FAILURES
+
+    return int(sum(value for labels, value in FAILURES.snapshot().items() if labels[0] == "telegram_retry_after"))
+
+
+async def run_scenario(name: str, channels: int, posts: int, latency: float, flood_rate: float, with_images: bool) -> Dict:
+    from app.bot import create_bot
+    from app.config import Settings, configure_settings
+    from app.services import telegram_sender, telegram_service
+
+    stub = StubServer(telegram_latency=latency, telegram_limits=name != "flood", telegram_flood_rate=flood_rate if name == "flood" else 0.0, seed=1)
+    workdir = tempfile.mkdtemp(prefix="newsbot-publish-bench-")
+    overrides = {} if name == "paced" else {"telegram_chat_interval": 0.0, "telegram_group_interval": 0.0, "telegram_global_rate": 1000.0}
+    with StubServerThread(stub) as server:
+        settings = configure_settings(Settings(
+            bot_token="123456:BENCH",
+            telegram_channel_id=-1001,
+            telegram_api_base=server.base_url,
+            openai_api_key="bench",
+            feeds=[f"{server.base_url}/feeds/0.xml"],
+            posted_links_file=os.path.join(workdir, "posted_links.txt"),
+            feed_poll_state_file=None,
+            relevance_model_file=None,
+            channels_file=None,
+            **overrides,
+        ))
+        telegram_sender._telegram_sender = None  # Отправитель создается заново по настройкам сценария
+        retries_before = _retry_after_count()
+        bot = create_bot(settings)
+        jobs = [(-1001 - channel, i) for i in range(posts) for channel in range(channels)]
+
+        async def publish(job):
+            chat_id, i = job
+            image_url = f"{server.base_url}/images/{chat_id}_{i}.png" if with_images and i % 2 else None
+            return await telegram_service.post_to_channel(bot, POST_TEMPLATE.format(i=i), image_url=image_url, chat_id=chat_id)
+        try:
+            results, latencies, wall = await _timed_concurrently(publish, jobs, len(jobs))
+        finally:
+            await bot.session.close()
+
+    stats = stub.telegram.stats
+    delivered = sum(len(messages) for messages in stub.telegram.messages.values())
+    duplicates = sum(
+        count - 1
+        for messages in stub.telegram.messages.values()
+        for count in Counter(m.get("text") or m.get("caption") for m in messages.values()).values()
+        if count > 1
+    )
+    ok = sum(1 for result in results if result)
+    return {
+        "scenario": name,
+        "sent": len(jobs),
+        "ok": ok,
+        "delivered": delivered,
+        "posts_per_sec": ok / wall if wall > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "wall_s": wall,
+        "responses_429": stats.get("error_429", 0),
+        "responses_400": stats.get("error_400", 0),
+        "sender_retries": _retry_after_count() - retries_before,
+        "duplicates": duplicates,
+    }
+
+
+def print_report(reports: List[Dict]) -> None:
+    header = (
+        f"{'сценарий':<9} {'доставлено':>11} {'пост/с':>8} {'p50, мс':>9} {'p95, мс':>9} "
+        f"{'429':>5} {'400':>5} {'повторы':>8} {'дубли':>6}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        print(
+            f"{r['scenario']:<9} {r['delivered']:>5}/{r['sent']:<5} {r['posts_per_sec']:>8.1f} {r['p50_ms']:>9.1f} "
+            f"{r['p95_ms']:>9.1f} {r['responses_429']:>5} {r['responses_400']:>5} {r['sender_retries']:>8} {r['duplicates']:>6}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, default=40, help="Число каналов")
+    parser.add_argument("--posts", type=int, default=3, help="Постов в каждый канал")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа заглушки Bot API, сек")
+    parser.add_argument("--flood-rate", type=float, default=0.2, help="Доля случайных 429 в сценарии flood")
+    parser.add_argument("--no-images", dest="with_images", action="store_false", help="Только текстовые посты")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Сценарии через запятую")
+    parser.add_argument("--output", help="Сохранить отчеты в JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    async def run_all() -> List[Dict]:
+        return [
+            await run_scenario(name, args.channels, args.posts, args.latency, args.flood_rate, args.with_images)
+            for name in args.scenarios.split(",") if name.strip()
+        ]
+
+    start = time.perf_counter()
+    reports = asyncio.run(run_all())
+    print_report(reports)
+    print(f"\nВсего {time.perf_counter() - start:.1f} с")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Замер времени холодного старта: импорт модулей бота в чистом процессе.
+
+Запуск из корня проекта:
+
+    python benchmarks/startup_bench.py            # 5 прогонов на модуль
+    python benchmarks/startup_bench.py -n 10 app.bot
+
+Каждый прогон выполняется в отдельном интерпретаторе, поэтому кэш модулей
+не влияет на результат. Переменные окружения не нужны: импорт не читает настройки.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ["app.config", "app.services.ai_service", "app.scheduler", "app.bot"]
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(module: str) -> float:
+    """Время (сек) запуска интерпретатора с импортом модуля."""
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT, PYTHONDONTWRITEBYTECODE="1")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True, env=env, cwd=PROJECT_ROOT)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = [time_import("sys") for _ in range(args.runs)]
+    print(f"{'интерпретатор':<28} медиана {statistics.median(baseline) * 1000:8.1f} мс")
+    for module in args.modules:
+        samples = [time_import(module) for _ in range(args.runs)]
+        print(
+            f"{module:<28} медиана {statistics.median(samples) * 1000:8.1f} мс, "
+            f"мин {min(samples) * 1000:8.1f} мс"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Локальные заглушки внешних сервисов для офлайн-бенчмарков.
+
+Один aiohttp-сервер отдает записанные фикстуры из benchmarks/fixtures:
+
+    GET  /feeds/{feed}.xml            RSS-лента (20 записей, свежие даты)
+    GET  /articles/{name}.html        страница статьи
+    GET  /images/{name}.png           картинка 1x1
+    POST /v1/chat/completions         OpenAI-совместимый чат (записанный ответ; JSON-ответ для response_format)
+    POST /bot{token}/{method}         Telegram Bot API (app.telegram_stub.FakeBotAPI)
+
+Задержки ответа LLM, статей и Telegram настраиваются, чтобы имитировать сеть.
+Чат обслуживает app.llm_stub.LLMReplayStub: с llm_fixtures_dir ответы берутся
+из записанных фикстур, llm_jitter и llm_error_rate добавляют разброс задержки
+и ответы с ошибками. Bot API обслуживает app.telegram_stub.FakeBotAPI: он
+проверяет HTML и длину сообщений, а telegram_limits и telegram_flood_rate
+включают ответы 429 по лимитам Telegram и случайные.
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from email.utils import formatdate
+from typing import Optional
+
+from aiohttp import web
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app.llm_stub import LLMReplayStub  # noqa: E402
+from app.services.llm_fixtures import LLMFixtureStore  # noqa: E402
+from app.telegram_stub import FakeBotAPI  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Прозрачный PNG 1x1
+_PNG_1X1 = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+def _read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class StubServer:
+    """Заглушки RSS, статей, OpenAI и Telegram Bot API на одном порту."""
+
+    def __init__(
+        self,
+        llm_latency: float = 0.0,
+        article_latency: float = 0.0,
+        telegram_latency: float = 0.0,
+        llm_jitter: float = 0.0,
+        llm_error_rate: float = 0.0,
+        llm_fixtures_dir: Optional[str] = None,
+        telegram_limits: bool = False,
+        telegram_flood_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.article_latency = article_latency
+        self.feed_template = _read_fixture("feed.xml")
+        self.article_template = _read_fixture("article.html")
+        self.chat_completion = json.loads(_read_fixture("chat_completion.json"))
+        self.chat_completion_structured = json.loads(_read_fixture("chat_completion_structured.json"))
+        self.llm = LLMReplayStub(
+            store=LLMFixtureStore(llm_fixtures_dir) if llm_fixtures_dir else None,
+            latency=llm_latency,
+            jitter=llm_jitter,
+            error_rate=llm_error_rate,
+            fallback=self._recorded_completion,
+            seed=seed,
+        )
+        self.telegram = FakeBotAPI(
+            latency=telegram_latency,
+            enforce_limits=telegram_limits,
+            flood_rate=telegram_flood_rate,
+            seed=seed,
+        )
+        self.base_url = ""
+        self.requests = {"feed": 0, "article": 0, "image": 0, "llm": 0, "telegram": 0}
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=20 * 1024 * 1024)
+        app.router.add_get("/feeds/{feed}.xml", self.handle_feed)
+        app.router.add_get("/articles/{name}.html", self.handle_article)
+        app.router.add_get("/images/{name}.png", self.handle_image)
+        app.router.add_post("/v1/chat/completions", self.handle_chat_completion)
+        app.router.add_post("/bot{token}/{method}", self.handle_telegram)
+        return app
+
+    async def handle_feed(self, request: web.Request) -> web.Response:
+        self.requests["feed"] += 1
+        feed = request.match_info["feed"]
+        body = self.feed_template.replace("{base}", self.base_url).replace("{feed}", feed)
+        now = time.time()
+        for i in range(20):
+            # Свежие даты, чтобы записи не отбрасывались очередью как устаревшие
+            body = body.replace("{date%d}" % i, formatdate(now - i * 1800, usegmt=True))
+        return web.Response(text=body, content_type="application/rss+xml")
+
+    async def handle_article(self, request: web.Request) -> web.Response:
+        self.requests["article"] += 1
+        if self.article_latency:
+            await asyncio.sleep(self.article_latency)
+        title = f"Bench article {request.match_info['name']}"
+        return web.Response(text=self.article_template.replace("{title}", title), content_type="text/html")
+
+    async def handle_image(self, request: web.Request) -> web.Response:
+        self.requests["image"] += 1
+        return web.Response(body=_PNG_1X1, content_type="image/png")
+
+    def _recorded_completion(self, payload: dict) -> dict:
+        structured = (payload.get("response_format") or {}).get("type") == "json_object"
+        completion = self.chat_completion_structured if structured else self.chat_completion
+        return dict(completion, model=payload.get("model", "stub"))
+
+    async def handle_chat_completion(self, request: web.Request) -> web.Response:
+        self.requests["llm"] += 1
+        return await self.llm.handle(request)
+
+    async def handle_telegram(self, request: web.Request) -> web.Response:
+        self.requests["telegram"] += 1
+        return await self.telegram.handle(request)
+
+
+class StubServerThread:
+    """Запускает StubServer в отдельном потоке со своим event loop.
+
+    Так нагрузка на заглушки не смешивается с измеряемым кодом в основном цикле.
+    """
+
+    def __init__(self, server: StubServer, host: str = "127.0.0.1", port: int = 0):
+        self.server = server
+        self.host = host
+        self.port = port
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-stub-server", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start())
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    async def _start(self) -> None:
+        self._runner = web.AppRunner(self.server.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.server.base_url = self.base_url
+
+    def __enter__(self) -> "StubServerThread":
+        self._thread.start()
+        self._ready.wait(timeout=10)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Заглушки RSS/OpenAI/Telegram для ручной отладки")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-fixtures", help="Каталог фикстур LLM (LLM_RECORD_DIR)")
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    parser.add_argument("--telegram-limits", action="store_true", help="429 по лимитам частоты Telegram")
+    parser.add_argument("--telegram-flood-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = StubServer(
+        llm_latency=args.llm_latency,
+        llm_jitter=args.llm_jitter,
+        llm_error_rate=args.llm_error_rate,
+        llm_fixtures_dir=args.llm_fixtures,
+        telegram_latency=args.telegram_latency,
+        telegram_limits=args.telegram_limits,
+        telegram_flood_rate=args.telegram_flood_rate,
+    )
+    with StubServerThread(server, port=args.port) as stub:
+        print(f"Заглушки запущены на {stub.base_url} (Ctrl+C для остановки)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass